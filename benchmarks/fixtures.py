@@ -0,0 +1,204 @@
+"""
+Synthetic inputs for the pipeline benchmarks, so they run offline without any downloaded data.
+
+- CFS fields on the CFS 0.5 degree global grid, as the xarray DataArrays `read_grib_fields` returns,
+  with `synthetic_grib_reader` serving them in place of the GRIB decoder;
+- a GL mask netCDF file with the eight lake/land regions on the grid of the real mask;
+- a CFS forecast database of any number of 6-hourly runs (days to decades);
+- scalers and trained models with the input and output shapes of the production models.
+"""
+import contextlib
+import os
+from datetime import datetime, timedelta
+import numpy as np
+
+from src.database_utils import CFSWriter, open_cfs_db
+
+# The CFS 0.5 degree global grid, north to south as in the GRIB files
+CFS_LATITUDES = np.arange(90.0, -90.25, -0.5)
+CFS_LONGITUDES = np.arange(0.0, 360.0, 0.5)
+
+# Grid of the GL mask file
+MASK_LATITUDES = np.linspace(40.9, 50.7, 60)
+MASK_LONGITUDES = np.round(np.arange(267.6, 285.5, 0.2), 1)
+
+# Mask variables of the production mask, and the centre and radii (degrees) of each synthetic lake
+MASK_VARIABLES = ['eri_lake', 'eri_land', 'ont_lake', 'ont_land', 'mih_lake', 'mih_land', 'sup_lake', 'sup_land']
+SYNTHETIC_LAKES = {'eri': (42.2, 278.8, 0.5, 2.2), 'ont': (43.7, 282.2, 0.4, 1.6),
+                   'mih': (44.5, 273.5, 1.8, 1.2), 'sup': (47.7, 272.3, 0.8, 2.8)}
+
+# Forecast months written for each CFS run
+FORECAST_MONTHS = 9
+
+def make_cfs_fields(seed=0, constant=False):
+    """
+    Builds the CFS fields used by the ingest on the 0.5 degree global grid.
+
+    Parameters:
+    - seed (int): Seed of the random fields. Default = 0.
+    - constant (bool): Uniform fields (precipitation rate 3e-5 kg/m2/s, 280 K, 40 W/m2), whose basin
+      averages are known exactly. Default = False.
+
+    Returns:
+    - dict: {'pgbf': {'precipitation': DataArray}, 'flxf': {'air_temperature': DataArray,
+      'latent_heat_flux': DataArray}}, float32 with 'latitude' and 'longitude' coordinates.
+    """
+    import xarray as xr
+
+    rng = np.random.default_rng(seed)
+    shape = (len(CFS_LATITUDES), len(CFS_LONGITUDES))
+
+    def field(mean, spread):
+        values = np.full(shape, mean) if constant else mean + spread * rng.standard_normal(shape)
+        return xr.DataArray(values.astype(np.float32), dims=('latitude', 'longitude'),
+                            coords={'latitude': CFS_LATITUDES, 'longitude': CFS_LONGITUDES})
+
+    return {'pgbf': {'precipitation': abs(field(3e-5, 2e-5))},
+            'flxf': {'air_temperature': field(280.0, 10.0), 'latent_heat_flux': abs(field(40.0, 25.0))}}
+
+@contextlib.contextmanager
+def synthetic_grib_reader(fields):
+    """
+    Serves synthetic fields to the ingest instead of decoding GRIB files.
+
+    Inside the block `read_grib_fields` returns the fields of the product named by the file ('pgbf' or
+    'flxf'), cut to the mask domain as the GRIB reader does. The files only have to exist with the CFS
+    file names (see `write_grib_placeholders`).
+
+    Parameters:
+    - fields (dict): Fields from `make_cfs_fields`.
+    """
+    import src.data_processing as data_processing
+    from src.metrics_utils import metrics
+
+    def read_fields(grib_file, requested, mask_lat, mask_lon, index_dir=None):
+        product = os.path.basename(grib_file).split('.')[0]
+        with metrics.stage('crop'):
+            return {field: fields[product][field].sel(
+                        latitude=slice(mask_lat.max(), mask_lat.min()),
+                        longitude=slice(mask_lon.min(), mask_lon.max())
+                    ).astype(np.float32).load()
+                    for field in requested if field in fields[product]}
+
+    original = data_processing.read_grib_fields
+    data_processing.read_grib_fields = read_fields
+    try:
+        yield
+    finally:
+        data_processing.read_grib_fields = original
+
+def cfs_runs(start, num_runs):
+    """Returns `num_runs` consecutive 6-hourly CFS runs ('YYYYMMDDHH') from a datetime."""
+    return [(start + timedelta(hours=6 * i)).strftime('%Y%m%d%H') for i in range(num_runs)]
+
+def forecast_months(cfs_run, num_months=FORECAST_MONTHS):
+    """Returns the (year, month) forecast months of a CFS run, from the month after the run."""
+    year, month = int(cfs_run[:4]), int(cfs_run[4:6])
+    return [(year + (month + i - 1) // 12, (month + i - 1) % 12 + 1) for i in range(1, num_months + 1)]
+
+def write_grib_placeholders(directory, runs, num_months=FORECAST_MONTHS):
+    """Creates empty pgbf/flxf files with the CFS file names of the runs, for `synthetic_grib_reader`."""
+    os.makedirs(directory, exist_ok=True)
+    for cfs_run in runs:
+        for year, month in forecast_months(cfs_run, num_months):
+            for product in ('pgbf', 'flxf'):
+                open(os.path.join(directory, f'{product}.01.{cfs_run}.{year}{month:02d}.avrg.grib.grb2'), 'w').close()
+
+def write_gl_mask(path):
+    """
+    Writes a GL mask netCDF file with the layout of the production mask: eight float64 variables on the
+    mask grid, 1 inside the region and NaN (the fill value) outside. Each synthetic lake is an ellipse
+    and its land region the ring around it.
+
+    Parameters:
+    - path (str): Path of the netCDF file.
+
+    Returns:
+    - str: The path.
+    """
+    import netCDF4 as nc
+
+    lat, lon = np.meshgrid(MASK_LATITUDES, MASK_LONGITUDES, indexing='ij')
+    with nc.Dataset(path, 'w') as ds:
+        ds.createDimension('latitude', len(MASK_LATITUDES))
+        ds.createDimension('longitude', len(MASK_LONGITUDES))
+        ds.createVariable('latitude', 'f8', ('latitude',))[:] = MASK_LATITUDES
+        ds.createVariable('longitude', 'f8', ('longitude',))[:] = MASK_LONGITUDES
+        for abbreviation, (lat0, lon0, lat_radius, lon_radius) in SYNTHETIC_LAKES.items():
+            distance = ((lat - lat0) / lat_radius) ** 2 + ((lon - lon0) / lon_radius) ** 2
+            for surface_type, inside in (('lake', distance <= 1), ('land', (distance > 1) & (distance <= 2.5))):
+                variable = ds.createVariable(f'{abbreviation}_{surface_type}', 'f8', ('latitude', 'longitude'), fill_value=np.nan)
+                variable[:] = np.where(inside, 1.0, np.nan)
+    return path
+
+def make_cfs_database(path, num_runs, start=datetime(2000, 1, 1), seed=0, runs_per_commit=1000):
+    """
+    Writes a CFS forecast database with the basin averages of `num_runs` synthetic 6-hourly runs.
+
+    Parameters:
+    - path (str): Path of the SQLite database (created if needed).
+    - num_runs (int): Number of CFS runs (4 per day, 1460 per year).
+    - start (datetime): First CFS run. Default = 2000-01-01 00Z.
+    - seed (int): Seed of the values. Default = 0.
+    - runs_per_commit (int): CFS runs written per transaction. Default = 1000.
+
+    Returns:
+    - int: The number of rows written.
+    """
+    rng = np.random.default_rng(seed)
+    lakes = {'eri': 'erie', 'ont': 'ontario', 'mih': 'michigan-huron', 'sup': 'superior'}
+    components = {'precipitation': (80.0, 30.0), 'evaporation': (50.0, 30.0), 'air_temperature': (280.0, 10.0)}
+
+    conn, _ = open_cfs_db(path)
+    conn.close()
+    with CFSWriter(path, runs_per_commit=runs_per_commit) as writer:
+        for cfs_run in cfs_runs(start, num_runs):
+            for year, month in forecast_months(cfs_run):
+                values = iter(rng.standard_normal(len(MASK_VARIABLES) * len(components)).tolist())
+                for mask_var in MASK_VARIABLES:
+                    lake_abv, surface_type = mask_var.split('_')
+                    for component, (mean, spread) in components.items():
+                        writer.add(cfs_run, year, month, lakes[lake_abv], surface_type, component, mean + spread * next(values))
+            writer.end_run()
+        return writer.rows_written + len(writer.rows)
+
+def make_trained_models(directory, num_samples=312, num_features=36, num_targets=16, seed=0):
+    """
+    Fits scalers and LR and GP models with the shapes of the production models on random data.
+
+    Parameters:
+    - directory (str): Directory the joblib files are saved to.
+    - num_samples (int): Training samples (the production GP keeps 312). Default = 312.
+    - num_features (int): Input features. Default = 36.
+    - num_targets (int): Targets. Default = 16.
+    - seed (int): Seed of the training data. Default = 0.
+
+    Returns:
+    - tuple: (models_info, x_scaler path, y_scaler path).
+    """
+    import joblib
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import Matern, RationalQuadratic
+    from sklearn.linear_model import LinearRegression
+    from sklearn.preprocessing import StandardScaler
+
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((num_samples, num_features))
+    y = X[:, :num_targets] @ rng.standard_normal((num_targets, num_targets)) + 0.1 * rng.standard_normal((num_samples, num_targets))
+
+    os.makedirs(directory, exist_ok=True)
+    x_scaler, y_scaler = StandardScaler().fit(X), StandardScaler().fit(y)
+    X_scaled, y_scaled = x_scaler.transform(X), y_scaler.transform(y)
+    paths = {'x_scaler': os.path.join(directory, 'x_scaler.joblib'), 'y_scaler': os.path.join(directory, 'y_scaler.joblib')}
+    joblib.dump(x_scaler, paths['x_scaler'])
+    joblib.dump(y_scaler, paths['y_scaler'])
+
+    # The GP keeps the production kernel with its hyperparameters fixed, so the fit is instant
+    models = {'GP': GaussianProcessRegressor(kernel=1.0 * Matern(nu=1.5) * RationalQuadratic(), alpha=0.1, optimizer=None),
+              'LR': LinearRegression()}
+    models_info = []
+    for model_name, model in models.items():
+        path = os.path.join(directory, f'{model_name}_trained_model.joblib')
+        joblib.dump(model.fit(X_scaled, y_scaled), path)
+        models_info.append({'model': model_name, 'path': path})
+    return models_info, paths['x_scaler'], paths['y_scaler']
@@ -0,0 +1,362 @@
+"""
+Micro-benchmarks for the hot paths of the package.
+
+Each benchmark times the current implementation against the original (loop-based) reference
+implementation kept below, checks that both give the same result, and reports the speedup.
+
+The pipeline suite times the ingest, the feature loading, the prediction and the aggregation end to end
+on synthetic inputs (see `benchmarks.fixtures`), so it runs offline. Its times can be saved as a
+baseline, and a later run fails if any benchmark is slower than its baseline by more than the tolerance.
+
+The baseline of the suite at its default sizes is committed as `benchmarks/baseline.json`; the ingest check
+and the baseline comparison also run under pytest (see `benchmarks/test_suite.py`).
+
+Usage:
+    python -m benchmarks.suite --sizes 10000 1000000
+    python -m benchmarks.suite --suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --suite --baseline benchmarks/baseline.json --tolerance 0.3
+"""
+import argparse
+import calendar
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from src.hydro_utils import calculate_grid_cell_areas, convert_mm_to_cms, convert_cms_to_mm, LAKE_SURFACE_AREA
+
+# Times of the suite at its default sizes
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+def best_time(func, *args, repeat=3):
+    """Return the best wall-clock time in seconds of `repeat` calls to func(*args), and the last result."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def _reference_grid_cell_areas(lon, lat):
+    """Original double-loop implementation of `calculate_grid_cell_areas`."""
+    R = 6371000.0
+    lat_rad = np.radians(lat)
+    dlat = np.radians(lat[1] - lat[0])
+    dlon = np.radians(lon[1] - lon[0])
+    area = np.zeros((len(lat), len(lon)))
+    for i in range(len(lat)):
+        for j in range(len(lon)):
+            area[i, j] = R**2 * dlat * dlon * np.cos(lat_rad[i])
+    return area
+
+def _reference_mm_to_cms(df):
+    """Original row-wise `df.apply` implementation of `convert_mm_to_cms`."""
+    def seconds(year, month):
+        return calendar.monthrange(year, month)[1] * 24 * 60 * 60
+
+    df['value [cms]'] = df.apply(
+        lambda row: (row['value [mm]'] / 1000) * LAKE_SURFACE_AREA.get(row['lake'], 0) / seconds(row.name[2], row.name[1]),
+        axis=1
+    )
+    return df
+
+def make_forecast_frame(num_rows, seed=0):
+    """Build a synthetic forecast frame indexed by (cfs_run, month, year) with 'lake' and 'value [mm]' columns."""
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_arrays([
+        rng.integers(2020010100, 2025123118, num_rows),
+        rng.integers(1, 13, num_rows),
+        rng.integers(1990, 2031, num_rows),
+    ], names=['cfs_run', 'month', 'year'])
+    return pd.DataFrame({
+        'lake': rng.choice(list(LAKE_SURFACE_AREA), num_rows),
+        'value [mm]': rng.normal(50, 30, num_rows),
+    }, index=index)
+
+def bench_grid_cell_areas(repeat=3):
+    """Benchmark the grid cell areas on the 0.1 degree Great Lakes mask grid."""
+    lat = np.arange(40.0, 51.0, 0.1)
+    lon = np.arange(267.0, 286.0, 0.1)
+
+    ref_time, ref = best_time(_reference_grid_cell_areas, lon, lat, repeat=1)
+    new_time, new = best_time(calculate_grid_cell_areas, lon, lat, repeat=repeat)
+    if not np.array_equal(ref, new):
+        raise AssertionError("ERROR: calculate_grid_cell_areas does not match the reference implementation.")
+
+    return {'benchmark': f'grid_cell_areas {len(lat)}x{len(lon)}', 'reference [s]': ref_time, 'current [s]': new_time}
+
+def bench_mm_to_cms(num_rows, repeat=3):
+    """Benchmark the mm to cms conversion on a synthetic forecast frame."""
+    df = make_forecast_frame(num_rows)
+
+    ref_time, ref = best_time(_reference_mm_to_cms, df.copy(), repeat=1)
+    new_time, new = best_time(convert_mm_to_cms, df.copy(), repeat=repeat)
+    if not np.allclose(ref['value [cms]'], new['value [cms]'], rtol=1e-12):
+        raise AssertionError("ERROR: convert_mm_to_cms does not match the reference implementation.")
+
+    # The inverse conversion must give back the original values
+    back = convert_cms_to_mm(new.drop(columns='value [mm]'))
+    if not np.allclose(back['value [mm]'], df['value [mm]'], rtol=1e-12):
+        raise AssertionError("ERROR: convert_cms_to_mm is not the inverse of convert_mm_to_cms.")
+
+    return {'benchmark': f'mm_to_cms {num_rows:,} rows', 'reference [s]': ref_time, 'current [s]': new_time}
+
+def run_benchmarks(sizes=(10_000, 1_000_000), repeat=3):
+    """
+    Run the hydro_utils benchmarks.
+
+    Parameters:
+    sizes (tuple): Numbers of rows used for the conversion benchmarks. Default = (10000, 1000000).
+    repeat (int): Number of timed calls of the current implementation (the best is kept). Default = 3.
+
+    Returns:
+    pd.DataFrame: One row per benchmark with the reference and current times and the speedup.
+    """
+    results = [bench_grid_cell_areas(repeat)] + [bench_mm_to_cms(num_rows, repeat) for num_rows in sizes]
+    df = pd.DataFrame(results).set_index('benchmark')
+    df['speedup'] = df['reference [s]'] / df['current [s]']
+    return df
+
+@contextlib.contextmanager
+def synthetic_ingest(work_dir, runs):
+    """
+    Set up the GRIB placeholders and GL mask of synthetic CFS runs in work_dir.
+
+    Yields a function ingest(fields, runs, database) that ingests the runs from the given fields into a new CFS
+    database and returns the number of rows written.
+    """
+    import netCDF4 as nc
+    from benchmarks.fixtures import MASK_VARIABLES, synthetic_grib_reader, write_gl_mask, write_grib_placeholders
+    from src.data_processing import process_grib_files
+    from src.database_utils import CFSWriter, open_cfs_db
+    from src.mask_utils import MaskSet
+
+    grib_dir = os.path.join(work_dir, 'grib')
+    write_grib_placeholders(grib_dir, runs)
+    mask_ds = nc.Dataset(write_gl_mask(os.path.join(work_dir, 'GL_mask.nc')))
+    mask_lat, mask_lon = mask_ds.variables['latitude'][:], mask_ds.variables['longitude'][:]
+    area = calculate_grid_cell_areas(mask_lon, mask_lat)
+    mask_set = MaskSet(mask_ds, MASK_VARIABLES, area)
+
+    def ingest(fields, runs, database):
+        conn, _ = open_cfs_db(database)
+        conn.close()
+        with synthetic_grib_reader(fields), CFSWriter(database, runs_per_commit=len(runs)) as writer:
+            for cfs_run in runs:
+                process_grib_files(grib_dir, database, 'cfs_forecast_data', cfs_run, mask_lat, mask_lon, mask_ds,
+                                   MASK_VARIABLES, area, writer=writer, mask_set=mask_set)
+            return writer.rows_written + len(writer.rows)
+
+    try:
+        yield ingest
+    finally:
+        mask_ds.close()
+
+def ingest_basin_averages(work_dir):
+    """
+    Ingest one synthetic CFS run of uniform fields, whose basin averages are known exactly.
+
+    Returns:
+    pd.DataFrame: The 'component', 'value [mm]' and 'expected [mm]' of every region in the first forecast month.
+    """
+    from benchmarks.fixtures import cfs_runs, make_cfs_fields
+    from src.hydro_utils import calculate_evaporation
+
+    # January 2025 run, first forecast month February: 28 days
+    runs = cfs_runs(datetime(2025, 1, 1), 1)
+    database = os.path.join(work_dir, 'check.db')
+    with synthetic_ingest(work_dir, runs) as ingest:
+        ingest(make_cfs_fields(constant=True), runs, database)
+
+    expected = {'precipitation': 3e-5 * 4 * 28, 'air_temperature': 280.0,
+                'evaporation': calculate_evaporation(280.0, 40.0) * 28 * 86400}
+    with sqlite3.connect(database) as conn:
+        df = pd.read_sql('SELECT component, "value [mm]" FROM cfs_forecast_data WHERE month = 2', conn)
+    df['expected [mm]'] = df['component'].map(expected)
+    return df
+
+def bench_ingest(work_dir, num_runs, repeat=3):
+    """
+    Benchmark the ingest of synthetic CFS runs: crop, regrid, mask reduction and database write.
+
+    The basin averages of uniform fields are checked against their exact values first.
+    """
+    from benchmarks.fixtures import MASK_VARIABLES, cfs_runs, make_cfs_fields
+
+    check = ingest_basin_averages(work_dir)
+    if len(check) != 3 * len(MASK_VARIABLES) or not np.allclose(check['value [mm]'], check['expected [mm]'], rtol=1e-5):
+        raise AssertionError("ERROR: The ingest does not reproduce the basin averages of uniform fields.")
+
+    runs = cfs_runs(datetime(2025, 1, 1), num_runs)
+    fields = make_cfs_fields()
+    best, num_rows = float('inf'), 0
+    with synthetic_ingest(work_dir, runs) as ingest:
+        for attempt in range(repeat):
+            database = os.path.join(work_dir, f'ingest{attempt}.db')
+            start = time.perf_counter()
+            num_rows = ingest(fields, runs, database)
+            best = min(best, time.perf_counter() - start)
+
+    return {'benchmark': f'ingest {num_runs} runs', 'time [s]': best, 'rows': num_rows}
+
+def bench_feature_load(database, num_runs, repeat=3):
+    """Benchmark loading the feature matrix of every run of a synthetic CFS database."""
+    from benchmarks.fixtures import FORECAST_MONTHS
+    from src.data_processing import load_feature_matrix
+
+    elapsed, X = best_time(load_feature_matrix, database, repeat=repeat)
+    if len(X) != num_runs * FORECAST_MONTHS:
+        raise AssertionError(f"ERROR: load_feature_matrix returned {len(X)} rows instead of {num_runs * FORECAST_MONTHS}.")
+    return {'benchmark': f'feature_load {num_runs} runs', 'time [s]': elapsed, 'rows': len(X)}, X
+
+def bench_predict(X, models_info, x_scaler, y_scaler, repeat=3):
+    """Benchmark the GP and LR ensemble prediction of a feature matrix."""
+    from src.data_processing import predict_ensemble
+    from src.model_utils import ModelRegistry
+
+    registry = ModelRegistry()
+    registry.warm_up([x_scaler, y_scaler] + [model['path'] for model in models_info])
+    elapsed, df = best_time(lambda: predict_ensemble(X, x_scaler, y_scaler, models_info, registry=registry), repeat=repeat)
+    return {'benchmark': f'predict {len(X):,} rows', 'time [s]': elapsed, 'rows': len(df)}, df
+
+def bench_aggregate(work_dir, df, repeat=3):
+    """Benchmark the conversion to m3/s, the forecast upsert with the ensemble statistics, and add_df_to_db."""
+    from src.data_processing import add_df_to_db
+    from src.database_utils import open_cnbs_db, upsert_cnbs_forecast
+    from src.ensemble_utils import update_ensemble_summary
+
+    convert_time, converted = best_time(lambda: convert_mm_to_cms(df.copy()), repeat=repeat)
+
+    def upsert(attempt):
+        conn, _ = open_cnbs_db(os.path.join(work_dir, f'cnbs{attempt}.db'))
+        try:
+            months = upsert_cnbs_forecast(conn, converted)
+            update_ensemble_summary(conn, months)
+        finally:
+            conn.close()
+
+    def add_to_db(attempt):
+        add_df_to_db(os.path.join(work_dir, f'add{attempt}.db'), 'cnbs_forecast', converted)
+
+    timings = {}
+    for name, function in (('upsert+summary', upsert), ('add_df_to_db', add_to_db)):
+        timings[name] = float('inf')
+        for attempt in range(repeat):
+            start = time.perf_counter()
+            function(attempt)
+            timings[name] = min(timings[name], time.perf_counter() - start)
+
+    return [{'benchmark': f'mm_to_cms {len(df):,} rows', 'time [s]': convert_time, 'rows': len(df)}] + \
+           [{'benchmark': f'{name} {len(df):,} rows', 'time [s]': elapsed, 'rows': len(df)} for name, elapsed in timings.items()]
+
+def run_suite(days=30, ingest_runs=4, repeat=3, work_dir=None):
+    """
+    Run the pipeline benchmarks on synthetic inputs.
+
+    Parameters:
+    days (int): Days of 6-hourly CFS runs in the synthetic database (4 runs per day, so 3650 is a decade). Default = 30.
+    ingest_runs (int): CFS runs ingested by the ingest benchmark. Default = 4.
+    repeat (int): Timed calls per benchmark (the best is kept). Default = 3.
+    work_dir (str, optional): Directory for the synthetic files. Default = None (a temporary directory).
+
+    Returns:
+    pd.DataFrame: One row per benchmark with its time and the number of rows it processed.
+    """
+    from benchmarks.fixtures import make_cfs_database, make_trained_models
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as work_dir:
+        num_runs = 4 * days
+        database = os.path.join(work_dir, 'cfs.db')
+        make_cfs_database(database, num_runs)
+        models_info, x_scaler, y_scaler = make_trained_models(os.path.join(work_dir, 'models'))
+
+        results = [bench_ingest(work_dir, ingest_runs, repeat)]
+        result, X = bench_feature_load(database, num_runs, repeat)
+        results.append(result)
+        result, df = bench_predict(X, models_info, x_scaler, y_scaler, repeat)
+        results.append(result)
+        results += bench_aggregate(work_dir, df, repeat)
+
+    return pd.DataFrame(results).set_index('benchmark')
+
+def benchmark_environment():
+    """Describe the machine and library versions the benchmarks ran with."""
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'date': datetime.now().isoformat(timespec='seconds')}
+
+def save_baseline(results, path):
+    """
+    Save the times of a suite run as the baseline of later runs.
+
+    Parameters:
+    results (pd.DataFrame): The result of `run_suite`.
+    path (str): Path of the JSON baseline file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'environment': benchmark_environment(), 'times': results['time [s]'].to_dict()}, f, indent=2)
+
+def compare_baseline(results, path, tolerance=0.25):
+    """
+    Compare the times of a suite run with a saved baseline.
+
+    Benchmarks are matched by name (which includes their size); benchmarks missing from the baseline are not checked.
+
+    Parameters:
+    results (pd.DataFrame): The result of `run_suite`.
+    path (str): Path of the JSON baseline file.
+    tolerance (float): Allowed slowdown relative to the baseline (0.25 = 25% slower). Default = 0.25.
+
+    Returns:
+    pd.DataFrame: The results with the 'baseline [s]' and 'ratio' columns.
+
+    Raises:
+    AssertionError: If a benchmark is slower than its baseline by more than the tolerance.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+
+    results = results.copy()
+    results['baseline [s]'] = results.index.map(baseline['times']).astype(float)
+    results['ratio'] = results['time [s]'] / results['baseline [s]']
+    slower = results[results['ratio'] > 1 + tolerance]
+    if not slower.empty:
+        print(results.to_string(float_format=lambda x: f'{x:.4g}'))
+        details = '; '.join(f"{name} took {row['time [s]']:.4g} s (baseline {row['baseline [s]']:.4g} s)" for name, row in slower.iterrows())
+        raise AssertionError(f"ERROR: Performance regression beyond {tolerance:.0%} of the baseline: {details}.")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the cnbs-predictor micro-benchmarks.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 1_000_000], help="Numbers of rows for the conversion benchmarks.")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed calls per benchmark (the best is kept).")
+    parser.add_argument('--suite', action='store_true', help="Run the pipeline benchmarks on synthetic inputs instead.")
+    parser.add_argument('--days', type=int, default=30, help="Days of 6-hourly CFS runs in the synthetic database of the suite.")
+    parser.add_argument('--ingest-runs', type=int, default=4, help="CFS runs ingested by the suite.")
+    parser.add_argument('--baseline', help="Baseline JSON file the suite times are checked against.")
+    parser.add_argument('--save-baseline', help="Save the suite times to this baseline JSON file.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown relative to the baseline.")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        results = run_suite(args.days, args.ingest_runs, args.repeat)
+        if args.baseline:
+            results = compare_baseline(results, args.baseline, args.tolerance)
+        if args.save_baseline:
+            save_baseline(results, args.save_baseline)
+        print(results.to_string(float_format=lambda x: f'{x:.4g}'))
+        return
+
+    print(run_benchmarks(args.sizes, args.repeat).to_string(float_format=lambda x: f'{x:.4g}'))
+
+if __name__ == '__main__':
+    main()
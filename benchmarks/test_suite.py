@@ -0,0 +1,51 @@
+"""
+Checks of the benchmark suite run by pytest.
+
+The ingest check always runs. The timed comparison with the committed baseline depends on the machine, so it
+only runs when CNBS_BENCHMARKS is set (e.g. `CNBS_BENCHMARKS=1 python -m pytest benchmarks`), with the allowed
+slowdown in CNBS_BENCHMARK_TOLERANCE (default 0.5, as times of a few 100 ms vary between runs).
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import MASK_VARIABLES
+from benchmarks.suite import BASELINE, compare_baseline, ingest_basin_averages, run_suite, save_baseline
+
+def test_ingest_reproduces_basin_averages_of_uniform_fields(tmp_path):
+    df = ingest_basin_averages(str(tmp_path))
+
+    assert len(df) == 3 * len(MASK_VARIABLES)
+    assert sorted(df['component'].unique()) == ['air_temperature', 'evaporation', 'precipitation']
+    np.testing.assert_allclose(df['value [mm]'], df['expected [mm]'], rtol=1e-5)
+
+def suite_results(times):
+    return pd.DataFrame({'time [s]': times, 'rows': [1] * len(times)},
+                        index=pd.Index([f'stage{i}' for i in range(len(times))], name='benchmark'))
+
+def test_compare_baseline_flags_slower_stages(tmp_path):
+    path = str(tmp_path / 'baseline.json')
+    save_baseline(suite_results([1.0, 2.0]), path)
+
+    results = compare_baseline(suite_results([1.2, 1.0]), path, tolerance=0.25)
+    assert results['ratio'].tolist() == pytest.approx([1.2, 0.5])
+
+    with pytest.raises(AssertionError, match='stage0'):
+        compare_baseline(suite_results([1.3, 2.0]), path, tolerance=0.25)
+
+def test_committed_baseline_covers_the_default_suite():
+    with open(BASELINE) as f:
+        times = json.load(f)['times']
+
+    # Benchmark names include the default sizes of `run_suite` (30 days of runs, 4 ingested runs)
+    assert {'ingest 4 runs', 'feature_load 120 runs', 'predict 1,080 rows'} <= set(times)
+    assert all(elapsed > 0 for elapsed in times.values())
+
+@pytest.mark.skipif(not os.environ.get('CNBS_BENCHMARKS'), reason="Timed benchmarks only run when CNBS_BENCHMARKS is set.")
+def test_suite_against_baseline():
+    tolerance = float(os.environ.get('CNBS_BENCHMARK_TOLERANCE', 0.5))
+    results = compare_baseline(run_suite(), BASELINE, tolerance)
+    assert results['baseline [s]'].notna().all()
@@ -0,0 +1,311 @@
+import json
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from src.data_processing import FEATURE_COLUMNS
+
+# Axes of the variable dimension, in the order of the model features (component, surface, lake)
+ARCHIVE_COMPONENTS = ['precipitation', 'evaporation', 'air_temperature']
+ARCHIVE_SURFACES = ['lake', 'land']
+ARCHIVE_LAKES = ['superior', 'erie', 'ontario', 'michigan-huron']
+ARCHIVE_VARIABLES = FEATURE_COLUMNS[:len(ARCHIVE_COMPONENTS) * len(ARCHIVE_SURFACES) * len(ARCHIVE_LAKES)]
+
+class CFSArchive:
+    """
+    Columnar archive of the CFS basin averages, memory-mapped from `.npy` files.
+
+    The archive holds a dense cube of float32 values with one row per CFS run (sorted), one column
+    per lead month (0 = month of the run) and one entry per variable in the order of the model
+    features. The cube lives in 'values.npy' next to 'runs.npy' (the run of each row) and a
+    'meta.json' sidecar. Both arrays are memory-mapped, so a reader only touches the pages it
+    slices, and `select` returns views of the file rather than copies.
+
+    The files are allocated with spare capacity and grown geometrically, so appending a run is
+    a write into the mapped file plus an update of the sidecar. A run older than the last archived
+    run is merged in by writing new files that replace the old ones, since the rows after it move.
+    A reader that opened the archive before an append therefore keeps seeing the runs that were
+    there when it was opened, in the same rows. Values written into runs it already sees (e.g. the
+    missing leads of a partial run) do show up in its view.
+
+    Parameters:
+    - archive_dir (str): Directory of the archive. It is created if it does not exist and mode is 'r+'.
+    - n_leads (int): Number of lead months stored per run (only used when creating the archive). Default = 12.
+    - mode (str): 'r' to read only, 'r+' to read and append. Default = 'r+'.
+
+    Example:
+    archive = export_cfs_archive(database, '/data/cfs_archive')
+    runs, values = archive.select(start_run=2024010100, lake='erie', surface_type='lake')
+    """
+
+    def __init__(self, archive_dir, n_leads=12, mode='r+'):
+        if mode not in ('r', 'r+'):
+            raise ValueError("ERROR: mode must be 'r' or 'r+'.")
+        if not isinstance(n_leads, int) or n_leads < 1:
+            raise ValueError("ERROR: n_leads must be a positive integer.")
+
+        self.archive_dir = archive_dir
+        self.mode = mode
+        self._meta_path = os.path.join(archive_dir, 'meta.json')
+
+        if not os.path.exists(self._meta_path):
+            if mode == 'r':
+                raise FileNotFoundError(f"ERROR: No CFS archive found in '{archive_dir}'.")
+            os.makedirs(archive_dir, exist_ok=True)
+            self.n_leads = n_leads
+            self.n_runs = 0
+            self._allocate(0)
+            self._write_meta()
+        else:
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if meta['variables'] != ARCHIVE_VARIABLES:
+                raise ValueError("ERROR: The archive variables do not match the model features.")
+            self.n_leads = meta['n_leads']
+            self.n_runs = meta['n_runs']
+
+        self._open()
+
+    def _path(self, name):
+        return os.path.join(self.archive_dir, name)
+
+    def _allocate(self, capacity, copy_runs=0, tail_runs=None, tail_values=None):
+        """
+        Create new data files with room for `capacity` runs, keeping the first `copy_runs` runs and writing
+        the `tail_runs` after them. The files replace the old ones, which stay valid for open readers.
+        """
+        n_tail = 0 if tail_runs is None else len(tail_runs)
+        values = np.lib.format.open_memmap(self._path('values.npy.tmp'), mode='w+', dtype=np.float32,
+                                           shape=(capacity, self.n_leads, len(ARCHIVE_VARIABLES)))
+        runs = np.lib.format.open_memmap(self._path('runs.npy.tmp'), mode='w+', dtype=np.int64, shape=(capacity,))
+        values[copy_runs + n_tail:] = np.nan
+        if copy_runs:
+            values[:copy_runs] = self._values[:copy_runs]
+            runs[:copy_runs] = self._runs[:copy_runs]
+        if n_tail:
+            values[copy_runs:copy_runs + n_tail] = tail_values
+            runs[copy_runs:copy_runs + n_tail] = tail_runs
+        values.flush()
+        runs.flush()
+        del values, runs
+
+        os.replace(self._path('values.npy.tmp'), self._path('values.npy'))
+        os.replace(self._path('runs.npy.tmp'), self._path('runs.npy'))
+
+    def _open(self):
+        self._values = np.load(self._path('values.npy'), mmap_mode=self.mode)
+        self._runs = np.load(self._path('runs.npy'), mmap_mode=self.mode)
+
+    def _write_meta(self):
+        meta = {'n_runs': self.n_runs, 'n_leads': self.n_leads, 'variables': ARCHIVE_VARIABLES, 'dtype': 'float32'}
+        with open(self._meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(self._meta_path + '.tmp', self._meta_path)
+
+    def _reserve(self, n_runs):
+        """Grow the data files (doubling their capacity) so they can hold `n_runs` runs."""
+        capacity = len(self._runs)
+        if n_runs <= capacity:
+            return
+        self._allocate(max(n_runs, 2 * capacity, 64), copy_runs=self.n_runs)
+        self._open()
+
+    def __len__(self):
+        return self.n_runs
+
+    @property
+    def runs(self):
+        """The archived CFS runs (YYYYMMDDHH integers), sorted."""
+        return self._runs[:self.n_runs]
+
+    @property
+    def values(self):
+        """The archived values with shape (run, lead, variable)."""
+        return self._values[:self.n_runs]
+
+    def append_frame(self, data):
+        """
+        Add or update runs from a long DataFrame of basin averages.
+
+        Only the cells present in `data` are written, so a run can be completed over several calls.
+        Runs newer than the last archived run are appended; older runs are merged into new files
+        that replace the archive (see the class docstring).
+
+        Parameters:
+        - data (pd.DataFrame): Columns 'cfs_run', 'year', 'month', 'lake', 'surface_type', 'component'
+          and 'value [mm]' (as stored in `cfs_forecast_data`).
+
+        Returns:
+        - int: The number of values written (variables unknown to the archive and leads beyond
+          `n_leads` are skipped).
+        """
+        if self.mode == 'r':
+            raise ValueError("ERROR: The archive was opened read-only.")
+        if len(data) == 0:
+            return 0
+
+        cfs_run = data['cfs_run'].to_numpy(dtype=np.int64)
+        run_month = (cfs_run // 1000000) * 12 + (cfs_run // 10000) % 100 - 1
+        lead = data['year'].to_numpy(dtype=np.int64) * 12 + data['month'].to_numpy(dtype=np.int64) - 1 - run_month
+
+        var_codes, variables = pd.factorize(data['lake'] + '_' + data['surface_type'] + '_' + data['component'])
+        var_position = {name: i for i, name in enumerate(ARCHIVE_VARIABLES)}
+        var = np.array([var_position.get(name, -1) for name in variables], dtype=np.int64)[var_codes]
+
+        keep = (var >= 0) & (lead >= 0) & (lead < self.n_leads)
+        new_runs, run_codes = np.unique(cfs_run[keep], return_inverse=True)
+        block = np.full((len(new_runs), self.n_leads, len(ARCHIVE_VARIABLES)), np.nan, dtype=np.float32)
+        given = np.zeros(block.shape, dtype=bool)
+        block[run_codes, lead[keep], var[keep]] = data['value [mm]'].to_numpy(dtype=np.float32)[keep]
+        given[run_codes, lead[keep], var[keep]] = True
+
+        # Runs already archived are updated in place
+        runs = self.runs
+        position = np.searchsorted(runs, new_runs)
+        existing = position < len(runs)
+        existing[existing] = runs[position[existing]] == new_runs[existing]
+        for i in np.flatnonzero(existing):
+            row = self._values[position[i]]
+            row[given[i]] = block[i][given[i]]
+
+        added = ~existing
+        if added.any():
+            start = self.n_runs
+            n_added = int(added.sum())
+            first = int(position[added].min())
+            if first == start:
+                # Newer runs only: append at the end
+                self._reserve(self.n_runs + n_added)
+                self._runs[start:start + n_added] = new_runs[added]
+                self._values[start:start + n_added] = block[added]
+            else:
+                # Merge the older runs into the sorted tail, in new files so open readers keep their rows
+                tail_runs = np.concatenate([self._runs[first:start], new_runs[added]])
+                tail_values = np.concatenate([self._values[first:start], block[added]])
+                order = np.argsort(tail_runs, kind='stable')
+                capacity = max(len(self._runs), self.n_runs + n_added)
+                self._allocate(capacity, copy_runs=first, tail_runs=tail_runs[order], tail_values=tail_values[order])
+                self._open()
+            self.n_runs += n_added
+
+        self._values.flush()
+        self._runs.flush()
+        self._write_meta()
+        return int(keep.sum())
+
+    def append_rows(self, rows):
+        """
+        Add or update runs from rows as buffered by `CFSWriter`.
+
+        Parameters:
+        - rows (list): Tuples of (cfs_run, year, month, lake, surface_type, component, value).
+
+        Returns:
+        - int: The number of values written.
+        """
+        columns = ['cfs_run', 'year', 'month', 'lake', 'surface_type', 'component', 'value [mm]']
+        return self.append_frame(pd.DataFrame(rows, columns=columns).astype({'cfs_run': np.int64}))
+
+    def select(self, start_run=None, end_run=None, leads=None, lake=None, surface_type=None, component=None):
+        """
+        Slice the archive without copying it.
+
+        Parameters:
+        - start_run (int, optional): First CFS run (YYYYMMDDHH) to include. Default = None.
+        - end_run (int, optional): Last CFS run to include. Default = None.
+        - leads (int or slice, optional): Lead month(s), 0 being the month of the run. Default = None (all).
+        - lake (str, optional): Lake to select. Default = None (all, in ARCHIVE_LAKES order).
+        - surface_type (str, optional): 'lake' or 'land'. Default = None (both).
+        - component (str, optional): Component to select. Default = None (all, in ARCHIVE_COMPONENTS order).
+
+        Returns:
+        - tuple: (runs, values), views of the memory-mapped files. values has the axes
+          (run, lead, component, surface, lake), without the axes selected with a single value.
+        """
+        runs = self.runs
+        first = 0 if start_run is None else int(np.searchsorted(runs, int(start_run), side='left'))
+        last = len(runs) if end_run is None else int(np.searchsorted(runs, int(end_run), side='right'))
+
+        def axis_index(name, value, options):
+            if value is None:
+                return slice(None)
+            if value not in options:
+                raise ValueError(f"ERROR: {name} must be one of {options}.")
+            return options.index(value)
+
+        cube = self.values[first:last].reshape(last - first, self.n_leads, len(ARCHIVE_COMPONENTS),
+                                               len(ARCHIVE_SURFACES), len(ARCHIVE_LAKES))
+        values = cube[:, slice(None) if leads is None else leads,
+                      axis_index('component', component, ARCHIVE_COMPONENTS),
+                      axis_index('surface_type', surface_type, ARCHIVE_SURFACES),
+                      axis_index('lake', lake, ARCHIVE_LAKES)]
+        return runs[first:last], values
+
+    def feature_matrix(self, start_run=None, end_run=None):
+        """
+        Build the model input matrix (as `load_feature_matrix`) from the archive.
+
+        Parameters:
+        - start_run (int, optional): First CFS run to include. Default = None.
+        - end_run (int, optional): Last CFS run to include. Default = None.
+
+        Returns:
+        - pd.DataFrame: FEATURE_COLUMNS indexed by 'cfs_run', 'year' and 'month', without the
+          (run, lead) pairs that have missing values.
+        """
+        runs, values = self.select(start_run, end_run)
+        values = np.asarray(values).reshape(len(runs) * self.n_leads, len(ARCHIVE_VARIABLES))
+
+        run_month = (runs // 1000000) * 12 + (runs // 10000) % 100 - 1
+        valid_month = (run_month[:, None] + np.arange(self.n_leads)[None, :]).ravel()
+        complete = ~np.isnan(values).any(axis=1)
+
+        months = valid_month[complete] % 12 + 1
+        X = np.zeros((int(complete.sum()), len(FEATURE_COLUMNS)))
+        X[:, :len(ARCHIVE_VARIABLES)] = values[complete]
+        X[np.arange(len(X)), len(ARCHIVE_VARIABLES) + months - 1] = 1
+
+        index = pd.MultiIndex.from_arrays([np.repeat(runs, self.n_leads)[complete], valid_month[complete] // 12, months],
+                                          names=['cfs_run', 'year', 'month'])
+        return pd.DataFrame(X, columns=FEATURE_COLUMNS, index=index)
+
+def export_cfs_archive(database, archive_dir, table='cfs_forecast_data', since_run=None, n_leads=12, chunk_runs=500):
+    """
+    Exports the CFS basin averages of a database to a columnar archive, incrementally.
+
+    The runs are read in chunks of `chunk_runs` runs, so memory use does not grow with the database.
+    If the archive already exists, only the runs after its last run are exported, unless `since_run`
+    is given.
+
+    Parameters:
+    - database (str): Path to the SQLite database.
+    - archive_dir (str): Directory of the archive.
+    - table (str): The table holding the CFS basin averages. Default = 'cfs_forecast_data'.
+    - since_run (int, optional): Export the runs from this run on. Default = None (after the last archived run).
+    - n_leads (int): Number of lead months of a new archive. Default = 12.
+    - chunk_runs (int): Number of runs read from the database at once. Default = 500.
+
+    Returns:
+    - CFSArchive: The updated archive.
+    """
+    archive = CFSArchive(archive_dir, n_leads=n_leads)
+    if since_run is None:
+        since_run = int(archive.runs[-1]) + 1 if len(archive) else 0
+
+    conn = sqlite3.connect(database)
+    try:
+        runs = [row[0] for row in conn.execute(f'SELECT DISTINCT cfs_run FROM {table} WHERE cfs_run >= ? ORDER BY cfs_run',
+                                               (int(since_run),))]
+        for i in range(0, len(runs), chunk_runs):
+            chunk = runs[i:i + chunk_runs]
+            data = pd.read_sql_query(f'''
+            SELECT cfs_run, year, month, lake, surface_type, component, "value [mm]" FROM {table}
+            WHERE cfs_run >= ? AND cfs_run <= ?
+            ''', conn, params=[chunk[0], chunk[-1]])
+            archive.append_frame(data)
+    finally:
+        conn.close()
+
+    print(f"Exported {len(runs)} CFS runs to the archive ({len(archive)} runs archived).")
+    return archive
@@ -0,0 +1,199 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+
+class GribCache:
+    """
+    Content-addressed local cache for downloaded GRIB files.
+
+    Entries are keyed by the remote object key plus its ETag and size (and a variant, e.g. the subset
+    patterns used), so a file is only fetched again when the remote object changes. The cache keeps
+    its total size under a disk budget by evicting the least recently used entries, and records its
+    state in a small SQLite index so it survives restarts.
+
+    The budget covers every cached file. Files handed out with `link_cached_file` are hard links, so
+    while a download directory still links a file (st_nlink > 1) its bytes stay on disk whatever the
+    cache does; such entries are counted but skipped by the eviction, and become evictable once the
+    download directory releases them. The cache can only stay over budget while more than
+    `max_bytes` of its files are still linked from download directories.
+
+    Parameters:
+    - cache_dir (str): Directory holding the cached files and the 'cache_index.db' index.
+    - max_bytes (int, optional): Disk budget in bytes. Default = None (no limit).
+
+    Example:
+    cache = GribCache('/data/cfs_cache', max_bytes=50 * 1024**3)
+    download_grb2_aws('pgb', bucket_name, url_path, download_path, cache=cache)
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError("ERROR: max_bytes must be a positive number of bytes.")
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.index = os.path.join(cache_dir, 'cache_index.db')
+        with self._connect() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                object_key TEXT,
+                etag TEXT,
+                size INTEGER,
+                variant TEXT,
+                path TEXT,
+                nbytes INTEGER,
+                last_access REAL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Open the index in one transaction (committed on success) and close it afterwards."""
+        conn = sqlite3.connect(self.index, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(object_key, etag, size, variant=''):
+        """Return the content key of a remote object (hash of key, ETag, size and variant)."""
+        token = f"{object_key}\n{etag}\n{size}\n{variant}"
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.grb2")
+
+    def lookup(self, object_key, etag, size, variant=''):
+        """
+        Return the cached file of a remote object, or None if it is not cached or no longer valid.
+        A hit marks the entry as most recently used.
+        """
+        key = self.make_key(object_key, etag, size, variant)
+        with self._connect() as conn:
+            row = conn.execute('SELECT path, nbytes FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+
+            path, nbytes = row
+            if not os.path.exists(path) or os.path.getsize(path) != nbytes:
+                # The file was removed or truncated outside of the cache
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+
+            conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+        return path
+
+    def store(self, object_key, etag, size, src_path, variant=''):
+        """
+        Move a downloaded file into the cache and evict old entries if the budget is exceeded.
+
+        Returns:
+        - str: Path of the cached file.
+        """
+        key = self.make_key(object_key, etag, size, variant)
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+
+        with self._connect() as conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO entries (key, object_key, etag, size, variant, path, nbytes, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (key, object_key, etag, size, variant, path, os.path.getsize(path), time.time()))
+
+        self.evict(keep=key)
+        return path
+
+    def fetch(self, object_key, etag, size, download, variant=''):
+        """
+        Return the cached file of a remote object, downloading it only on a cache miss.
+
+        Parameters:
+        - object_key (str): Remote key or URL of the object.
+        - etag (str): ETag (or another version token such as Last-Modified) of the object.
+        - size (int): Size of the remote object in bytes.
+        - download (callable): Called with a temporary path to write the object to on a miss.
+        - variant (str): Extra token for different local versions of one object (e.g. subsets). Default = ''.
+
+        Returns:
+        - tuple: (path of the cached file, True if it was a cache hit)
+        """
+        path = self.lookup(object_key, etag, size, variant)
+        if path is not None:
+            return path, True
+
+        tmp_path = os.path.join(self.cache_dir, f".{self.make_key(object_key, etag, size, variant)}.{os.getpid()}.part")
+        try:
+            download(tmp_path)
+            return self.store(object_key, etag, size, tmp_path, variant), False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def total_bytes(self):
+        """Return the total size of the cached files in bytes."""
+        with self._connect() as conn:
+            return conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM entries').fetchone()[0]
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in its disk budget.
+
+        Entries whose file is still hard-linked elsewhere (e.g. into a download directory) are skipped,
+        since removing them would not free their bytes.
+
+        Parameters:
+        - keep (str, optional): Key of an entry that must not be evicted (e.g. the one just stored).
+
+        Returns:
+        - int: Number of bytes freed.
+        """
+        if self.max_bytes is None:
+            return 0
+
+        freed = 0
+        with self._connect() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM entries').fetchone()[0]
+            rows = conn.execute('SELECT key, path, nbytes FROM entries ORDER BY last_access').fetchall()
+            for key, path, nbytes in rows:
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                if os.path.exists(path):
+                    if os.stat(path).st_nlink > 1:
+                        continue
+                    os.remove(path)
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= nbytes
+                freed += nbytes
+        return freed
+
+def link_cached_file(cached_path, dest_path):
+    """
+    Make a cached file available at dest_path without copying it when possible.
+
+    A hard link is used so the file stays readable even if the cache later evicts its entry;
+    a copy is made if the two paths are on different file systems. While the link exists the
+    cache does not evict the entry (see `GribCache`), so remove dest_path once it is used.
+    """
+    if os.path.exists(dest_path):
+        if os.path.samefile(cached_path, dest_path):
+            return dest_path
+        os.remove(dest_path)
+
+    os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+    try:
+        os.link(cached_path, dest_path)
+    except OSError:
+        shutil.copy2(cached_path, dest_path)
+    return dest_path
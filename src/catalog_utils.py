@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+# L2SWBM file prefix of each lake and file name of each component
+L2SWBM_LAKES = {'superior': 'superior', 'erie': 'erie', 'ontario': 'ontario', 'michigan-huron': 'miHuron'}
+L2SWBM_COMPONENTS = {'evaporation': 'Evap', 'precipitation': 'Precip', 'runoff': 'Runoff', 'cnbs': 'NBSC'}
+
+# CFSR basin average file and mask column prefix of the training features
+CFSR_FILES = {'precipitation': 'CFSR_APCP_Basin_Avgs.csv', 'evaporation': 'CFSR_EVAP_Basin_Avgs.csv',
+              'air_temperature': 'CFSR_TMP_Basin_Avgs.csv'}
+CFSR_LAKES = {'superior': 'sup', 'erie': 'eri', 'ontario': 'ont', 'michigan-huron': 'mih'}
+CFSR_SURFACE_TYPES = ('basin', 'lake', 'land')
+
+# GLCC monthly net basin supply file of each lake (m3/s)
+GLCC_FILES = {
+    'superior': 'LakeSuperior_MonthlyNetBasinSupply_1900to2025.csv',
+    'michigan-huron': 'LakeMichiganHuron_MonthlyNetBasinSupply_1900to2025.csv',
+    'stclair': 'LakeStClair_MonthlyNetBasinSupply_1900to2025.csv',
+    'erie': 'LakeErie_MonthlyNetBasinSupply_1900to2025.csv',
+    'ontario': 'LakeOntario_MonthlyNetBasinSupply_1900to2025.csv',
+}
+
+# Values at or below this are the GLCC missing data flags (-9999, -99990)
+GLCC_MISSING = -9999
+
+# Sub-directory of the data directory holding each source
+CATALOG_SOURCES = {'l2swbm': 'l2swbm', 'cfsr': 'training', 'glcc': 'glcc'}
+
+# Bumped when a parser changes, so the cached arrays are rebuilt
+CATALOG_VERSION = 1
+
+def _source_files(source):
+    """File names of a source, in the order they are parsed."""
+    if source == 'l2swbm':
+        return [f'{prefix}{name}_MonthlyRun.csv' for prefix in L2SWBM_LAKES.values() for name in L2SWBM_COMPONENTS.values()]
+    if source == 'cfsr':
+        return list(CFSR_FILES.values())
+    if source == 'glcc':
+        return list(GLCC_FILES.values())
+    raise ValueError(f"ERROR: Unknown data source '{source}'. Sources must be {', '.join(CATALOG_SOURCES)}.")
+
+def _parse_l2swbm(directory):
+    """Yields (lake, component, years, months, values) for the median of every L2SWBM file."""
+    for lake, prefix in L2SWBM_LAKES.items():
+        for component, name in L2SWBM_COMPONENTS.items():
+            l2swbm = pd.read_csv(os.path.join(directory, f'{prefix}{name}_MonthlyRun.csv'), usecols=['Year', 'Month', 'Median'])
+            yield lake, component, l2swbm['Year'].to_numpy(), l2swbm['Month'].to_numpy(), l2swbm['Median'].to_numpy()
+
+def _parse_cfsr(directory):
+    """Yields (lake, '<surface type>_<component>', years, months, values) for every column of the CFSR files."""
+    for component, filename in CFSR_FILES.items():
+        cfsr = pd.read_csv(os.path.join(directory, filename))
+        for surface_type in CFSR_SURFACE_TYPES:
+            for lake, prefix in CFSR_LAKES.items():
+                yield lake, f'{surface_type}_{component}', cfsr['year'].to_numpy(), cfsr['month'].to_numpy(), cfsr[f'{prefix}_{surface_type}'].to_numpy()
+
+def _parse_glcc(directory):
+    """Yields (lake, 'nbs', years, months, values) for every GLCC file, with the missing data flags as NaN."""
+    for lake, filename in GLCC_FILES.items():
+        glcc = pd.read_csv(os.path.join(directory, filename), comment='#', skipinitialspace=True)
+        glcc.columns = [column.strip() for column in glcc.columns]
+        values = glcc.iloc[:, 1:13].to_numpy(dtype=np.float64)
+        values[values <= GLCC_MISSING] = np.nan
+        years = np.repeat(glcc['Year'].to_numpy(), 12)
+        yield lake, 'nbs', years, np.tile(np.arange(1, 13), len(glcc)), values.ravel()
+
+_PARSERS = {'l2swbm': _parse_l2swbm, 'cfsr': _parse_cfsr, 'glcc': _parse_glcc}
+
+def parse_source(source, directory):
+    """
+    Parses every file of a source into one aligned monthly array.
+
+    Parameters:
+    - source (str): 'l2swbm', 'cfsr' or 'glcc'.
+    - directory (str): Directory of the source's files.
+
+    Returns:
+    - dict: 'values' (float64 array of shape (lakes, components, years, 12), NaN where a file has no value),
+      'lakes', 'components' and 'years' (the labels of the first three axes).
+    """
+    _source_files(source)
+    series = list(_PARSERS[source](directory))
+
+    lakes = list(dict.fromkeys(lake for lake, *_ in series))
+    components = list(dict.fromkeys(component for _, component, *_ in series))
+    first_year = int(min(np.min(years) for _, _, years, _, _ in series))
+    last_year = int(max(np.max(years) for _, _, years, _, _ in series))
+
+    values = np.full((len(lakes), len(components), last_year - first_year + 1, 12), np.nan)
+    for lake, component, years, months, data in series:
+        values[lakes.index(lake), components.index(component),
+               np.asarray(years, dtype=np.int64) - first_year, np.asarray(months, dtype=np.int64) - 1] = data
+    return {'values': values, 'lakes': lakes, 'components': components, 'years': list(range(first_year, last_year + 1))}
+
+class DataCatalog:
+    """
+    Parse-once catalog of the static inputs of the training and the verification: the L2SWBM components
+    ('l2swbm'), the CFSR basin averages ('cfsr') and the GLCC net basin supplies ('glcc').
+
+    Each source is parsed from its CSV files once, into a (lake, component, year, month) float64 array saved
+    as a '.npy' file (with its labels in a '.json' file) in the cache directory. The cache is keyed by the
+    modification time and size of every file of the source; when they changed, the SHA-1 of the files decides
+    whether the source really has to be parsed again. Loaded arrays are also kept in memory, so after the
+    first run loading every input takes a few milliseconds.
+
+    Parameters:
+    - data_dir (str): The data directory, holding the l2swbm/, training/ and glcc/ folders.
+    - cache_dir (str, optional): Directory of the cached arrays. Default = None (DATA_DIR/.catalog).
+    - directories (dict, optional): Directory of a source, overriding its folder in the data directory,
+      e.g. {'glcc': '/data/GLCC'}. Default = None.
+
+    Example:
+    catalog = DataCatalog('data')
+    observed = catalog.frame('glcc', columns='{lake}')
+    """
+
+    def __init__(self, data_dir, cache_dir=None, directories=None):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(data_dir, '.catalog')
+        self.directories = {source: os.path.join(data_dir, folder) for source, folder in CATALOG_SOURCES.items()}
+        self.directories.update(directories or {})
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def _stamps(self, source):
+        """Modification time and size of every file of a source."""
+        stamps = {}
+        for filename in _source_files(source):
+            stat = os.stat(os.path.join(self.directories[source], filename))
+            stamps[filename] = [stat.st_mtime_ns, stat.st_size]
+        return stamps
+
+    def _hashes(self, source):
+        hashes = {}
+        for filename in _source_files(source):
+            with open(os.path.join(self.directories[source], filename), 'rb') as f:
+                hashes[filename] = hashlib.sha1(f.read()).hexdigest()
+        return hashes
+
+    def _write(self, path, write):
+        """Writes a cache file through a temporary file, so a crash never leaves a partial file."""
+        handle, temporary = tempfile.mkstemp(dir=self.cache_dir, suffix=os.path.splitext(path)[1])
+        try:
+            os.chmod(temporary, 0o644)
+            with os.fdopen(handle, 'wb') as f:
+                write(f)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def load(self, source):
+        """
+        Returns the aligned monthly array of a source, parsing its files only if they changed since they were cached.
+
+        Parameters:
+        - source (str): 'l2swbm', 'cfsr' or 'glcc'.
+
+        Returns:
+        - dict: 'values' (read-only float64 array of shape (lakes, components, years, 12)), 'lakes',
+          'components' and 'years' (see `parse_source`).
+
+        Raises:
+        - FileNotFoundError: If a file of the source is missing.
+        """
+        stamps = self._stamps(source)
+        with self._lock:
+            loaded = self._loaded.get(source)
+            if loaded is not None and loaded[0] == stamps:
+                return loaded[1]
+
+            array_path = os.path.join(self.cache_dir, f'{source}.npy')
+            meta_path = os.path.join(self.cache_dir, f'{source}.json')
+            meta = None
+            if os.path.exists(array_path) and os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                if meta.get('version') != CATALOG_VERSION or meta.get('directory') != os.path.abspath(self.directories[source]):
+                    meta = None
+
+            hashes = None
+            if meta is not None and meta['stamps'] != stamps:
+                # Touched or copied files keep their cached array as long as their content is the same
+                hashes = self._hashes(source)
+                if meta['hashes'] != hashes:
+                    meta = None
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if meta is None:
+                parsed = parse_source(source, self.directories[source])
+                meta = {'version': CATALOG_VERSION, 'directory': os.path.abspath(self.directories[source]),
+                        'lakes': parsed['lakes'], 'components': parsed['components'], 'years': parsed['years']}
+                hashes = hashes if hashes is not None else self._hashes(source)
+                self._write(array_path, lambda f: np.save(f, parsed['values']))
+            if meta.get('stamps') != stamps:
+                meta.update(stamps=stamps, hashes=hashes)
+                self._write(meta_path, lambda f: f.write(json.dumps(meta).encode()))
+
+            result = {'values': np.load(array_path, mmap_mode='r'), 'lakes': meta['lakes'],
+                      'components': meta['components'], 'years': meta['years']}
+            self._loaded[source] = (stamps, result)
+            return result
+
+    def frame(self, source, lakes=None, components=None, columns='{lake}_{component}'):
+        """
+        Returns series of a source as a monthly DataFrame, from the first to the last month with a value.
+
+        Parameters:
+        - source (str): 'l2swbm', 'cfsr' or 'glcc'.
+        - lakes (list, optional): Lakes to return. Default = None (all).
+        - components (list, optional): Components to return. Default = None (all).
+        - columns (str): Format of the column names, with the {lake} and {component} fields. Default = '{lake}_{component}'.
+
+        Returns:
+        - pd.DataFrame: One row per month (DatetimeIndex) and one column per lake and component, NaN where
+          a file has no value.
+        """
+        loaded = self.load(source)
+        lakes = lakes if lakes is not None else loaded['lakes']
+        components = components if components is not None else loaded['components']
+        lake_index = [loaded['lakes'].index(lake) for lake in lakes]
+        component_index = [loaded['components'].index(component) for component in components]
+
+        values = loaded['values'][np.ix_(lake_index, component_index)].reshape(len(lakes) * len(components), -1).T
+        index = pd.date_range(f"{loaded['years'][0]}-01-01", periods=len(values), freq='MS')
+        names = [columns.format(lake=lake, component=component) for lake in lakes for component in components]
+        df = pd.DataFrame(values, index=index, columns=names)
+
+        observed = np.flatnonzero(~np.isnan(values).all(axis=1))
+        return df.iloc[observed[0]:observed[-1] + 1] if len(observed) else df.iloc[:0]
+
+# Catalogs shared by the training and verification functions, one per data directory
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(data_dir, cache_dir=None, directories=None):
+    """
+    Returns the shared catalog of a data directory, so that arrays loaded once stay in memory.
+
+    Parameters:
+    - data_dir (str): The data directory.
+    - cache_dir (str, optional): Directory of the cached arrays. Default = None (DATA_DIR/.catalog).
+    - directories (dict, optional): Directory of a source, overriding its folder in the data directory. Default = None.
+
+    Returns:
+    - DataCatalog: The catalog.
+    """
+    key = (os.path.abspath(data_dir), cache_dir, tuple(sorted((directories or {}).items())))
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = DataCatalog(data_dir, cache_dir, directories)
+        return _catalogs[key]
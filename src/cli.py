@@ -0,0 +1,378 @@
+"""
+Command line interface of the production pipeline, replacing the download/preprocess and forecast notebooks.
+
+Usage:
+python -m src.cli download --auto
+python -m src.cli ingest --start 05-01-2025 --end 05-18-2025 --workers 4
+python -m src.cli forecast
+python -m src.cli run --auto
+python -m src.cli run --daemon --poll-interval 600
+python -m src.cli train --workers 8
+python -m src.cli verify --max-lead 6
+python -m src.cli --metrics metrics.json --log-level INFO run --auto
+
+Every path defaults to the repository's data/ directory (or $CNBS_DATA_DIR). The heavy modules are only
+imported by the subcommand that needs them, so `--help` and the argument checks stay instant.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from src.metrics_utils import METRICS_ENV
+
+# Mask variables of the GL mask file, one per lake and surface type
+MASK_VARIABLES = ['eri_lake', 'eri_land', 'ont_lake', 'ont_land', 'mih_lake', 'mih_land', 'sup_lake', 'sup_land']
+
+# Models used by the forecast, with the file names they are saved under in the input directory
+MODEL_NAMES = ['GP', 'RF', 'LR', 'NN']
+
+def default_data_dir():
+    """Returns the data directory: $CNBS_DATA_DIR, or data/ in the repository."""
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.environ.get('CNBS_DATA_DIR', os.path.join(repo_dir, 'data'))
+
+def default_models_info(input_dir):
+    """
+    Lists the trained models found in the input directory, preferring a NumPy export ('.npz') over the joblib file.
+
+    Parameters:
+    input_dir (str): Directory holding the '<MODEL>_trained_model' files.
+
+    Returns:
+    list: A list of dictionaries containing model information ({'model': name, 'path': path}).
+    """
+    models_info = []
+    for model_name in MODEL_NAMES:
+        for extension in ('.npz', '.joblib'):
+            path = os.path.join(input_dir, f'{model_name}_trained_model{extension}')
+            if os.path.exists(path):
+                models_info.append({'model': model_name, 'path': path})
+                break
+    return models_info
+
+def _paths(args):
+    """Fill in the paths not given on the command line from the data directory."""
+    input_dir = args.input_dir or os.path.join(args.data_dir, 'input')
+    args.input_dir = input_dir
+    args.database = args.database or os.path.join(input_dir, 'cfs_forecast_data.db')
+    if hasattr(args, 'download_dir'):
+        args.download_dir = args.download_dir or os.path.join(args.data_dir, 'CFS')
+    if hasattr(args, 'mask_file'):
+        args.mask_file = args.mask_file or os.path.join(input_dir, 'GL_mask.nc')
+    if hasattr(args, 'cnbs_database'):
+        args.cnbs_database = args.cnbs_database or os.path.join(args.data_dir, 'forecast', 'cnbs_forecast.db')
+    if hasattr(args, 'x_scaler'):
+        args.csv = args.csv or os.path.join(args.data_dir, 'forecast', 'CNBS_forecast.csv')
+        args.x_scaler = args.x_scaler or os.path.join(input_dir, 'x_scaler.joblib')
+        args.y_scaler = args.y_scaler or os.path.join(input_dir, 'y_scaler.joblib')
+    return args
+
+def resolve_run_range(args, now=None):
+    """
+    Returns the (start, end) CFS runs to process.
+
+    In auto mode (no --start) the start is the run after the last one in the database and the end
+    is yesterday's 18Z run, as in the download/preprocess notebook.
+
+    Parameters:
+    args (argparse.Namespace): The parsed arguments (start, end, database, table).
+    now (datetime, optional): The current date. Default = None (now).
+
+    Returns:
+    tuple: (start, end) as datetimes, or None if the database is already up to date.
+
+    Raises:
+    ValueError: If no start date is given and the database is empty.
+    """
+    from src.data_processing import parse_cfs_date
+
+    now = now if now is not None else datetime.now()
+    if args.start:
+        start = parse_cfs_date(args.start)
+    else:
+        from src.database_utils import get_next_cfs_run
+        next_run = get_next_cfs_run(args.database, args.table) if os.path.exists(args.database) else None
+        if next_run is None:
+            raise ValueError("ERROR: The CFS database is empty, a start date (--start) is required.")
+        start = parse_cfs_date(next_run)
+
+    if args.end:
+        end = parse_cfs_date(args.end)
+        if len(args.end) == 10:
+            end = end.replace(hour=18)
+    else:
+        end = (now - timedelta(days=1)).replace(hour=18, minute=0, second=0, microsecond=0)
+
+    if start > end:
+        print("The CFS database is up-to-date.")
+        return None
+    print(f"Starting from: {start.strftime('%m-%d-%Y %H')}Z and continuing through: {end.strftime('%m-%d-%Y %H')}Z")
+    return start, end
+
+def _grib_cache(args):
+    if not args.cache_dir:
+        return None
+    from src.cache_utils import GribCache
+    max_bytes = int(args.cache_max_gb * 1e9) if args.cache_max_gb else None
+    return GribCache(args.cache_dir, max_bytes=max_bytes)
+
+def _archive(args):
+    if not args.archive_dir:
+        return None
+    from src.archive_utils import CFSArchive
+    return CFSArchive(args.archive_dir)
+
+def _models_info(args):
+    """Returns the models_info list from --model NAME=PATH, or the models found in the input directory."""
+    if args.model:
+        models_info = []
+        for spec in args.model:
+            name, sep, path = spec.partition('=')
+            if not sep or not name or not path:
+                raise ValueError(f"ERROR: --model must be given as NAME=PATH, got '{spec}'.")
+            models_info.append({'model': name, 'path': path})
+    else:
+        models_info = default_models_info(args.input_dir)
+    if not models_info:
+        raise ValueError(f"ERROR: No trained models found in '{args.input_dir}'.")
+    return models_info
+
+def cmd_download(args):
+    """Download the GRIB files of every CFS run of the range."""
+    from src.data_processing import cfs_run_dates
+    from src.database_utils import download_cfs_run
+
+    run_range = resolve_run_range(args)
+    if run_range is None:
+        return 0
+    cache = _grib_cache(args)
+    missing = []
+    for date in cfs_run_dates(*run_range):
+        print(f"Beginning Files for {date}.")
+        download_path = os.path.join(args.download_dir, date.strftime('%Y%m%d'))
+        if not download_cfs_run(date, download_path, source=args.source, bucket_name=args.bucket, subset=args.subset,
+                                cache=cache, endpoint_url=args.endpoint_url):
+            missing.append(date.strftime('%Y%m%d%H'))
+    if missing:
+        print(f"ERROR: {len(missing)} CFS runs were not available: {', '.join(missing)}")
+    return 0 if not missing else 1
+
+def cmd_ingest(args):
+    """Decode the downloaded GRIB files of every CFS run of the range into the database."""
+    from src.data_processing import process_cfs_range
+
+    run_range = resolve_run_range(args)
+    if run_range is None:
+        return 0
+    result = process_cfs_range(*run_range, args.download_dir, args.database, args.mask_file, MASK_VARIABLES,
+                               table=args.table, workers=args.workers, runs_per_commit=args.runs_per_commit,
+                               regrid_dir=args.regrid_dir, index_dir=args.index_dir, archive=_archive(args))
+    return 0 if not result['failed'] else 1
+
+def _forecast(args, registry=None):
+    from src.data_processing import forecast_new_runs, write_forecast_csv
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.cnbs_database)), exist_ok=True)
+    result = forecast_new_runs(args.database, args.cnbs_database, args.x_scaler, args.y_scaler, _models_info(args),
+                               registry=registry, table=args.table, full=args.full, workers=args.forecast_workers)
+    if args.csv != '-' and (result['rows'] or not os.path.exists(args.csv)):
+        write_forecast_csv(args.cnbs_database, args.csv)
+    return result
+
+def cmd_forecast(args):
+    """Forecast CNBS for the CFS runs not forecast yet and update the CSV file."""
+    _forecast(args)
+    return 0
+
+def cmd_run(args):
+    """Download, ingest and forecast the range, or serve new CFS cycles as they appear with --daemon."""
+    if args.daemon:
+        return _serve(args)
+
+    from src.pipeline import stream_cfs_runs
+
+    run_range = resolve_run_range(args)
+    failed = {}
+    if run_range is not None:
+        result = stream_cfs_runs(*run_range, args.download_dir, args.database, args.mask_file, MASK_VARIABLES,
+                                 table=args.table, source=args.source, bucket_name=args.bucket,
+                                 delete_files=not args.keep_files, runs_per_commit=args.runs_per_commit,
+                                 subset=args.subset, cache=_grib_cache(args), endpoint_url=args.endpoint_url,
+                                 regrid_dir=args.regrid_dir, index_dir=args.index_dir, archive=_archive(args))
+        failed = result['failed']
+    _forecast(args)
+    return 0 if not failed else 1
+
+def _serve(args):
+    from src.pipeline import CFSForecastDaemon
+
+    models_info = _models_info(args)
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        print(f"Received signal {signum}, stopping after the current poll.")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.cnbs_database)), exist_ok=True)
+    with CFSForecastDaemon(args.download_dir, args.database, args.mask_file, MASK_VARIABLES, args.cnbs_database,
+                           args.x_scaler, args.y_scaler, models_info, table=args.table, start=args.start,
+                           source=args.source, bucket_name=args.bucket, subset=args.subset, cache=_grib_cache(args),
+                           endpoint_url=args.endpoint_url, regrid_dir=args.regrid_dir, index_dir=args.index_dir,
+                           archive=_archive(args), delete_files=not args.keep_files, max_wait_hours=args.max_wait_hours,
+                           forecast_workers=args.forecast_workers, csv_path=None if args.csv == '-' else args.csv,
+                           metrics_path=args.metrics) as daemon:
+        daemon.serve(poll_interval=args.poll_interval, stop_event=stop_event, max_polls=args.max_polls)
+    return 0
+
+def cmd_train(args):
+    """Cross-validate the candidate models, then train the best ones and save them for the forecast."""
+    from src.training_utils import run_training
+
+    run_training(args.data_dir, args.output_dir or args.input_dir, models=tuple(args.models), first_test=args.first_test,
+                 test_months=args.test_months, step_months=args.test_months, train_end=args.train_end,
+                 n_restarts_optimizer=args.restarts, workers=args.workers, cache_dir=args.cache_dir)
+    return 0
+
+def cmd_verify(args):
+    """Verify the forecasts against the GLCC observations and write the skill scores."""
+    from src.verification_utils import skill_scores, update_verification
+
+    glcc_dir = args.glcc_dir or os.path.join(args.data_dir, 'glcc')
+    update_verification(args.cnbs_database, glcc_dir, max_lead=args.max_lead)
+    scores = skill_scores(args.cnbs_database, glcc_dir=glcc_dir)
+    output = args.output or os.path.join(args.data_dir, 'forecast', 'CNBS_skill_scores.csv')
+    scores.to_csv(output, index=False)
+    print(f"Skill scores written to '{output}'.")
+    return 0
+
+def build_parser():
+    """Returns the argument parser of the `cnbs` command."""
+    parser = argparse.ArgumentParser(prog='cnbs', description="Download CFS forecasts, ingest them and forecast CNBS for the Great Lakes.")
+    parser.add_argument('--data-dir', default=default_data_dir(), help="Data directory (default: data/ in the repository or $CNBS_DATA_DIR).")
+    parser.add_argument('--input-dir', help="Directory of the mask, the CFS database and the trained models (default: DATA_DIR/input).")
+    parser.add_argument('--database', help="CFS forecast database (default: INPUT_DIR/cfs_forecast_data.db).")
+    parser.add_argument('--table', default='cfs_forecast_data', help="Table of the CFS basin averages.")
+    parser.add_argument('--metrics', default=os.environ.get(METRICS_ENV),
+                        help=f"JSON file the stage timings and counters of the command are written to (default: ${METRICS_ENV}).")
+    parser.add_argument('--log-level', default=os.environ.get('CNBS_LOG_LEVEL', 'WARNING'),
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Level of the structured (JSON) pipeline events logged to stderr (default: WARNING, or $CNBS_LOG_LEVEL).")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_range(subparser):
+        subparser.add_argument('--start', help="First CFS run, 'MM-DD-YYYY [HH]' (default: the run after the last one in the database).")
+        subparser.add_argument('--end', help="Last CFS run, 'MM-DD-YYYY [HH]' (default: yesterday 18Z).")
+        subparser.add_argument('--auto', action='store_true', help="Bring the database up to date (the default when --start is not given).")
+
+    def add_download(subparser):
+        subparser.add_argument('--download-dir', help="Directory the GRIB files are downloaded to (default: DATA_DIR/CFS).")
+        subparser.add_argument('--source', choices=['aws', 'ncei'], default='aws', help="Source of the CFS data.")
+        subparser.add_argument('--bucket', default='noaa-cfs-pds', help="AWS bucket holding the CFS data.")
+        subparser.add_argument('--endpoint-url', help="S3 endpoint to use instead of AWS.")
+        subparser.add_argument('--subset', action='store_true', help="Only download the GRIB messages used by the forecast.")
+        subparser.add_argument('--cache-dir', help="Local GRIB download cache.")
+        subparser.add_argument('--cache-max-gb', type=float, help="Disk budget of the download cache, in GB.")
+
+    def add_ingest(subparser):
+        subparser.add_argument('--mask-file', help="GL mask netCDF file (default: INPUT_DIR/GL_mask.nc).")
+        subparser.add_argument('--runs-per-commit', type=int, default=1, help="CFS runs written per database transaction.")
+        subparser.add_argument('--regrid-dir', help="Directory to cache the regrid weights in.")
+        subparser.add_argument('--index-dir', help="Directory for the persistent GRIB index files.")
+        subparser.add_argument('--archive-dir', help="Columnar archive the runs are also appended to.")
+
+    def add_forecast(subparser):
+        subparser.add_argument('--cnbs-database', help="CNBS forecast database (default: DATA_DIR/forecast/cnbs_forecast.db).")
+        subparser.add_argument('--csv', help="Forecast CSV file, '-' to skip it (default: DATA_DIR/forecast/CNBS_forecast.csv).")
+        subparser.add_argument('--x-scaler', help="Input scaler (default: INPUT_DIR/x_scaler.joblib).")
+        subparser.add_argument('--y-scaler', help="Target scaler (default: INPUT_DIR/y_scaler.joblib).")
+        subparser.add_argument('--model', action='append', metavar='NAME=PATH',
+                               help="Trained model, can be repeated (default: the GP, RF, LR and NN models found in INPUT_DIR).")
+        subparser.add_argument('--full', action='store_true', help="Forecast every CFS run again, ignoring the watermarks.")
+        subparser.add_argument('--forecast-workers', type=int, default=1, help="Threads used to run the models.")
+
+    download = subparsers.add_parser('download', help="Download the GRIB files of a range of CFS runs.")
+    add_range(download)
+    add_download(download)
+    download.set_defaults(func=cmd_download)
+
+    ingest = subparsers.add_parser('ingest', help="Decode downloaded GRIB files into the CFS database.")
+    add_range(ingest)
+    ingest.add_argument('--download-dir', help="Directory of the downloaded GRIB files (default: DATA_DIR/CFS).")
+    add_ingest(ingest)
+    ingest.add_argument('--workers', type=int, default=1, help="Worker processes decoding the runs.")
+    ingest.set_defaults(func=cmd_ingest)
+
+    forecast = subparsers.add_parser('forecast', help="Forecast CNBS for the CFS runs not forecast yet.")
+    add_forecast(forecast)
+    forecast.set_defaults(func=cmd_forecast)
+
+    train = subparsers.add_parser('train', help="Cross-validate and train the models on the CFSR and L2SWBM data.")
+    train.add_argument('--output-dir', help="Directory the trained models and scalers are saved to (default: INPUT_DIR).")
+    train.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=MODEL_NAMES, help="Models to train.")
+    train.add_argument('--first-test', default='2005-01-01', help="First month of the first cross-validation test window.")
+    train.add_argument('--test-months', type=int, default=12, help="Length of the cross-validation test windows, in months.")
+    train.add_argument('--train-end', help="Last month used by the final fit (default: all the data).")
+    train.add_argument('--restarts', type=int, default=10, help="Restarts of the GP kernel optimizer in the final fit.")
+    train.add_argument('--workers', type=int, default=1, help="Worker processes running the folds, candidates and GP restarts.")
+    train.add_argument('--cache-dir', help="Directory to keep the scaled fold matrices in between runs.")
+    train.set_defaults(func=cmd_train)
+
+    verify = subparsers.add_parser('verify', help="Score the forecasts against the GLCC net basin supply.")
+    verify.add_argument('--cnbs-database', help="CNBS forecast database (default: DATA_DIR/forecast/cnbs_forecast.db).")
+    verify.add_argument('--glcc-dir', help="Directory of the GLCC files (default: DATA_DIR/glcc).")
+    verify.add_argument('--max-lead', type=int, help="Longest lead to verify, in months (default: all).")
+    verify.add_argument('--output', help="Skill score CSV file (default: DATA_DIR/forecast/CNBS_skill_scores.csv).")
+    verify.set_defaults(func=cmd_verify)
+
+    run = subparsers.add_parser('run', help="Download, ingest and forecast, once or as a daemon.")
+    add_range(run)
+    add_download(run)
+    add_ingest(run)
+    add_forecast(run)
+    run.add_argument('--keep-files', action='store_true', help="Keep the GRIB files once their rows are committed.")
+    run.add_argument('--daemon', action='store_true', help="Keep running and process each new CFS cycle as soon as it is published.")
+    run.add_argument('--poll-interval', type=float, default=600, help="Seconds between two polls of the daemon.")
+    run.add_argument('--max-wait-hours', type=float, default=48, help="Hours after its cycle time before the daemon skips a missing run.")
+    run.add_argument('--max-polls', type=int, help="Stop the daemon after this many polls.")
+    run.set_defaults(func=cmd_run)
+
+    return parser
+
+def main(argv=None):
+    """
+    Entry point of the `cnbs` command.
+
+    Parameters:
+    argv (list, optional): The command line arguments. Default = None (sys.argv).
+
+    Returns:
+    int: The exit status.
+    """
+    args = _paths(build_parser().parse_args(argv))
+    if getattr(args, 'auto', False) and args.start:
+        print("ERROR: --auto and --start cannot be used together.")
+        return 2
+
+    from src.metrics_utils import metrics, profiled
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    try:
+        # Profiled with cProfile when $CNBS_PROFILE names a directory
+        with profiled(args.command):
+            return args.func(args)
+    except ValueError as e:
+        print(e)
+        return 2
+    finally:
+        if args.metrics:
+            metrics.write_json(args.metrics, command=args.command)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,45 @@
 import pandas as pd
-import cfgrib
 import sqlite3
 import os
+import hashlib
+import logging
 import numpy as np
 import calendar
-from datetime import datetime
-import joblib
-import netCDF4 as nc
-
-from src.hydro_utils import calculate_evaporation
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from src.hydro_utils import calculate_evaporation, calculate_grid_cell_areas, convert_mm_to_cms
+from src.database_utils import CFSWriter, open_cfs_db, is_compact_cfs_db, CFS_CODE_TABLES, CFS_COMPACT_TABLE, \
+    open_cnbs_db, get_forecast_watermarks, get_forecast_months, set_forecast_watermarks, upsert_cnbs_forecast
+from src.model_utils import default_registry
+from src.feature_utils import FeatureSchema, feature_schema_path, lagged_column_names, lagged_matrix
+from src.ensemble_utils import ENSEMBLE_ALL, ENSEMBLE_QUANTILES, read_ensemble_summary, update_ensemble_summary
+from src.mask_utils import MaskSet
+from src.metrics_utils import log_event, log_skip, metrics
+
+# GRIB short names of the CFS fields used by the forecast, in order of preference (the names changed between ecCodes versions)
+CFS_GRIB_FIELDS = {
+    'pgbf': {'precipitation': ['tp']},
+    'flxf': {'air_temperature': ['avg_2t', 'mean2t'], 'latent_heat_flux': ['avg_slhtf', 'mslhf']},
+}
+
+# Columns of the model output, in the order of the targets during training
+CNBS_COLUMNS = ['superior_evaporation', 'superior_precipitation', 'superior_runoff', 'superior_cnbs',
+                'erie_evaporation', 'erie_precipitation', 'erie_runoff', 'erie_cnbs',
+                'ontario_evaporation', 'ontario_precipitation', 'ontario_runoff', 'ontario_cnbs',
+                'michigan-huron_evaporation', 'michigan-huron_precipitation', 'michigan-huron_runoff', 'michigan-huron_cnbs']
+
+# Input features of the models, in the order of the variables during training
+FEATURE_COLUMNS = ['superior_lake_precipitation', 'erie_lake_precipitation', 'ontario_lake_precipitation', 'michigan-huron_lake_precipitation',
+                   'superior_land_precipitation', 'erie_land_precipitation', 'ontario_land_precipitation', 'michigan-huron_land_precipitation',
+                   'superior_lake_evaporation', 'erie_lake_evaporation', 'ontario_lake_evaporation', 'michigan-huron_lake_evaporation',
+                   'superior_land_evaporation', 'erie_land_evaporation', 'ontario_land_evaporation', 'michigan-huron_land_evaporation',
+                   'superior_lake_air_temperature', 'erie_lake_air_temperature', 'ontario_lake_air_temperature', 'michigan-huron_lake_air_temperature',
+                   'superior_land_air_temperature', 'erie_land_air_temperature', 'ontario_land_air_temperature', 'michigan-huron_land_air_temperature'
+                   ] + [f'month_{i}' for i in range(1, 13)]
+
+# Days before the newest CFS run during which the forecast waits for missing or incomplete runs
+FORECAST_RECHECK_DAYS = 7
 
 def create_directory(directory):
     """Create a directory if it doesn't already exist."""
@@ -60,22 +91,12 @@ def shift_variables(df, lag=0, lead=0):
     Returns:
     - pd.DataFrame: The DataFrame with added variable columns for lags and leading.
     """
-    df = df.copy()  # To avoid modifying the original DataFrame
-
-    new_columns = []  # List to store the new lag and lead columns
-
-    # Generate target columns for the lag and lead months
-    for column in df.columns:
-        for lag_month in range(1, lag + 1):
-            new_columns.append(df[column].shift(lag_month).rename(f'{column}_mo-{lag_month}'))
-        for lead_month in range(1, lead + 1):
-            new_columns.append(df[column].shift(-lead_month).rename(f'{column}_mo{lead_month}'))
-
-    # Concatenate the new columns with the original DataFrame
-    df = pd.concat([df] + new_columns, axis=1)
+    # Build every shifted column in one pass (see `lagged_matrix`) rather than one Series per column and shift
+    values = lagged_matrix(df.to_numpy(dtype=np.float64), lag, lead)
+    df = pd.DataFrame(values, columns=lagged_column_names(df.columns, lag, lead), index=df.index)
 
     # Drop rows with any NaN values generated by shifting for the target
-    df = df.dropna()
+    df = df[~np.isnan(values).any(axis=1)]
 
     return df
 
@@ -99,39 +120,89 @@ def add_cfs_to_db(database, table, cfs_run, year, month, lake, surface_type, com
     sqlite3.DatabaseError: If there is an error interacting with the database.
     """
 
-    # Input validation
-    if not isinstance(year, int):
-        raise ValueError(f"ERROR: Year must be an integer.")
-    if not (1 <= month <= 12):
-        raise ValueError(f"ERROR: Month must be between 1 and 12.")
-    if not isinstance(cfs_run, str) or not isinstance(lake, str) or not isinstance(surface_type, str) or not isinstance(component, str):
-        raise ValueError("ERROR: cfs_run, lake, surface type, and CNBS must be strings.")
-    if not isinstance(value, (float, int)):
-        raise ValueError(f"ERROR: Value must be a numeric type.")
+    # Buffer the single row and commit it in one transaction
+    with CFSWriter(database, table) as writer:
+        writer.add(cfs_run, year, month, lake, surface_type, component, value)
 
-    try:
-        # Connect to the database
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
+def grib_index_path(grib_file, index_dir=None):
+    """
+    Get the path of the persistent cfgrib index for a GRIB file.
 
-        # Properly insert the table name using f-string (escaped) or str.format() outside of the SQL statement
-        query = f'''
-        INSERT OR REPLACE INTO {table} (
-            cfs_run, year, month, lake, surface_type, component, "value [mm]"
-        ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        '''
+    The index name is stamped with the size and modification time of the GRIB file, so a file that is
+    re-downloaded gets a fresh index while an unchanged file reuses the index from earlier runs. cfgrib
+    ignores an index that is older than its GRIB file without replacing it, so stale indexes of the same
+    file are removed here.
 
-        # Insert the data into the table
-        cursor.execute(query, (cfs_run, year, month, lake, surface_type, component, value))
+    Parameters:
+    grib_file (str): Path to the GRIB file.
+    index_dir (str, optional): Directory where the index files are kept. Default = None (next to the GRIB file).
 
-        # Commit the transaction and close the connection
-        conn.commit()
-        conn.close()
+    Returns:
+    str: The index path template to pass to cfgrib as 'indexpath'.
+    """
+    grib_file = os.path.abspath(grib_file)
+    index_dir = index_dir if index_dir else os.path.dirname(grib_file)
+    os.makedirs(index_dir, exist_ok=True)
+
+    stat = os.stat(grib_file)
+    prefix = f"{os.path.basename(grib_file)}.{hashlib.sha1(grib_file.encode()).hexdigest()[:8]}."
+    current = f"{prefix}{stat.st_size}-{stat.st_mtime_ns}."
 
-    except sqlite3.DatabaseError as e:
-        raise sqlite3.DatabaseError(f"Database error occurred: {e}")
+    # Remove indexes built for an earlier version of the file
+    for idx_file in os.listdir(index_dir):
+        if idx_file.startswith(prefix) and idx_file.endswith('.idx') and not idx_file.startswith(current):
+            os.remove(os.path.join(index_dir, idx_file))
 
-def process_grib_files(download_dir, database, table, cfs_run, mask_lat, mask_lon, mask_ds, mask_variables, area):
+    return os.path.join(index_dir, current + '{short_hash}.idx')
+
+def read_grib_fields(grib_file, fields, mask_lat, mask_lon, index_dir=None):
+    """
+    Reads only the requested fields from a GRIB file, cut to the mask domain.
+
+    The file is indexed once (the index is kept on disk, see `grib_index_path`) and only the messages
+    whose short name is requested are decoded. Each field is cut to the mask lat/lon window and kept as float32.
+
+    Parameters:
+    grib_file (str): Path to the GRIB file.
+    fields (dict): Output field name mapped to a list of GRIB short names to try, in order of preference.
+    mask_lat (array): Latitude values for the domain.
+    mask_lon (array): Longitude values for the domain.
+    index_dir (str, optional): Directory for the persistent GRIB index files. Default = None (next to the GRIB file).
+
+    Returns:
+    dict: Field name mapped to an in-memory xr.DataArray. Fields not found in the file are left out.
+    """
+    # Imported here so only the ingest stage loads cfgrib, eccodes and xarray
+    import cfgrib
+
+    grib_file = os.path.abspath(grib_file)
+    short_names = [name for candidates in fields.values() for name in candidates]
+    backend_kwargs = {'indexpath': grib_index_path(grib_file, index_dir), 'filter_by_keys': {'shortName': short_names}}
+
+    with metrics.stage('grib_open'):
+        datasets = cfgrib.open_datasets(grib_file, backend_kwargs=backend_kwargs, decode_timedelta=False)
+    metrics.count('grib_files_read')
+    metrics.count('grib_bytes_read', os.path.getsize(grib_file))
+    try:
+        found = {}
+        for field, candidates in fields.items():
+            da = next((ds[name] for name in candidates for ds in datasets if name in ds.data_vars), None)
+            if da is None:
+                continue
+
+            # Cut the variable to the mask domain before it is loaded into memory
+            with metrics.stage('crop'):
+                found[field] = da.sel(
+                    latitude=slice(mask_lat.max(), mask_lat.min()),
+                    longitude=slice(mask_lon.min(), mask_lon.max())
+                ).astype(np.float32).load()
+    finally:
+        for ds in datasets:
+            ds.close()
+
+    return found
+
+def process_grib_files(download_dir, database, table, cfs_run, mask_lat, mask_lon, mask_ds, mask_variables, area, regrid_dir=None, index_dir=None, writer=None, archive=None, mask_set=None):
     """
     Processes GRIB files for a given CFS run, extracting precipitation, temperature, and evaporation data,
     then inserts the processed data into a SQLite database.
@@ -146,6 +217,14 @@ def process_grib_files(download_dir, database, table, cfs_run, mask_lat, mask_lo
     mask_ds (array): A dataset containing mask variables.
     mask_variables (list): A list of mask variables to process.
     area (array): Area values corresponding to the grid.
+    regrid_dir (str, optional): Directory to cache the CFS-to-mask regrid weights in. Default = None (memory only).
+    index_dir (str, optional): Directory for the persistent GRIB index files. Default = None (next to the GRIB files).
+    writer (CFSWriter, optional): An open writer session to buffer the rows into. Its `end_run` is called once
+        the run is processed. Default = None (a writer is opened on `database`/`table` and committed once for the run).
+    archive (CFSArchive, optional): A columnar archive the rows of the run are also appended to, once they are
+        committed to the database. Default = None.
+    mask_set (MaskSet, optional): The stacked weights of the mask variables, to build once for many runs.
+        Default = None (built from `mask_ds`, `mask_variables` and `area` for this run).
 
     Raises:
     ValueError: If any of the input parameters are invalid.
@@ -160,22 +239,43 @@ def process_grib_files(download_dir, database, table, cfs_run, mask_lat, mask_lo
     
     if not isinstance(mask_lat, (np.ndarray, list)) or not isinstance(mask_lon, (np.ndarray, list)):
         raise ValueError("ERROR: mask_lat and mask_lon must be arrays or lists.")
-    if not isinstance(mask_ds, (nc.Dataset, type(None))):
+    if mask_ds is not None and not hasattr(mask_ds, 'variables'):
         raise ValueError("ERROR: mask_ds must be a netCDF (nc) dataset.")
     if not isinstance(mask_variables, list):
         raise ValueError("ERROR: mask_variables must be a list of strings.")
     if not isinstance(area, (np.ndarray, list)):
         raise ValueError("ERROR: area must be an array or list.")
-
-    # Remove outdated index files (optional step)
-    for idx_file in [f for f in os.listdir(download_dir) if f.endswith('.idx')]:
-        os.remove(os.path.join(download_dir, idx_file))
+    if mask_set is None:
+        mask_set = MaskSet(mask_ds, mask_variables, area)
+
+    if writer is None:
+        with CFSWriter(database, table) as writer:
+            with metrics.stage('ingest_run'):
+                _ingest_grib_files(download_dir, cfs_run, mask_lat, mask_lon, mask_set, regrid_dir, index_dir, writer)
+            rows = list(writer.rows)
+            if archive is not None and rows:
+                writer.after_commit(lambda: archive.append_rows(rows))
+    else:
+        rows_before = len(writer.rows)
+        with metrics.stage('ingest_run'):
+            _ingest_grib_files(download_dir, cfs_run, mask_lat, mask_lon, mask_set, regrid_dir, index_dir, writer)
+        rows = writer.rows[rows_before:]
+        if archive is not None and rows:
+            # The run may only be committed by a later end_run or flush (runs_per_commit > 1)
+            writer.after_commit(lambda: archive.append_rows(rows))
+        writer.end_run()
+    metrics.count('rows_extracted', len(rows))
+
+def _ingest_grib_files(download_dir, cfs_run, mask_lat, mask_lon, mask_set, regrid_dir, index_dir, writer):
+    """Extract the basin averages of every GRIB file of a CFS run into a writer (see `process_grib_files`)."""
+    from src.regrid_utils import get_regrid_operator
 
     # Find all the .grb2 files in the directory
     pgb_list = sorted(file for file in os.listdir(download_dir) if file.startswith(f'pgbf.01.{cfs_run}') and file.endswith('grb2'))
 
     if not pgb_list:
         print(f"ERROR: PGB files not found for CFS run {cfs_run} in {download_dir}. Skipping forecast.")
+        log_skip('runs_skipped', cfs_run=cfs_run, reason='pgb_files_missing')
         return
 
     # Process each GRIB2 file
@@ -192,33 +292,26 @@ def process_grib_files(download_dir, database, table, cfs_run, mask_lat, mask_lo
 
         ## Precipitation ##
         try:
-            pgb_surface = cfgrib.open_dataset(pgb_file, engine='cfgrib', filter_by_keys={'typeOfLevel': 'surface'}, decode_timedelta=False)
-            pcp = pgb_surface['tp']  # Total precipitation
-
-            # Cut the variable to the mask domain
-            pcp_cut = pcp.sel(
-                latitude=slice(mask_lat.max(), mask_lat.min()),
-                longitude=slice(mask_lon.min(), mask_lon.max())
-            )
+            # Read only the total precipitation, cut to the mask domain
+            pgb_fields = read_grib_fields(pgb_file, CFS_GRIB_FIELDS['pgbf'], mask_lat, mask_lon, index_dir=index_dir)
+            pcp_cut = pgb_fields['precipitation']
 
             # Remap and upscale the variable to match the mask domain
-            pcp_remap = pcp_cut.interp(latitude=mask_lat, longitude=mask_lon, method='linear')
+            with metrics.stage('regrid'):
+                regrid = get_regrid_operator(pcp_cut['latitude'].values, pcp_cut['longitude'].values, mask_lat, mask_lon, cache_dir=regrid_dir)
+                pcp_remap = regrid(pcp_cut.values)
 
-            for mask_var in mask_variables:
-                mask = mask_ds.variables[mask_var][:]
-                total_pcp = (np.sum(pcp_remap * mask * area)) * 4 * num_days  # Convert 6-hour data to monthly
-                pcp_mm = total_pcp / np.sum(mask * area)  # Convert to mm
+            with metrics.stage('mask_reduction'):
+                # Area-weighted average of every region, converted from 6-hour data to monthly mm
+                pcp_mm = mask_set.area_mean(pcp_remap) * 4 * num_days
 
-                lake_abv, surface_type = mask_var.split('_')
-                lake = {'eri': 'erie', 'ont': 'ontario', 'sup': 'superior', 'mih': 'michigan-huron'}.get(lake_abv)
-                if lake is None:
-                    raise ValueError(f"ERROR: The mask variables need to begin with 'eri', 'ont', 'sup', or 'mih'. Check the mask file.")
-
-                # Insert precipitation data into the database
-                add_cfs_to_db(database, table, cfs_run, forecast_year, forecast_month, lake, surface_type, 'precipitation', pcp_mm.item())
+            # Insert precipitation data into the database
+            for (lake, surface_type), value in zip(mask_set.regions, pcp_mm.tolist()):
+                writer.add(cfs_run, forecast_year, forecast_month, lake, surface_type, 'precipitation', value)
 
         except Exception as e:
             print(f"ERROR processing precipitation data. Skipping forecast.")
+            log_skip('forecast_months_skipped', e, cfs_run=cfs_run, forecast=forecast, stage='precipitation')
             continue # Try the flux file
         
         ## 2 m Temperature ##
@@ -226,93 +319,259 @@ def process_grib_files(download_dir, database, table, cfs_run, mask_lat, mask_lo
 
         if not os.path.exists(flx_file):
             print(f"ERROR: FLX file {flx_file} not found. Skipping forecast.")
+            log_skip('runs_skipped', cfs_run=cfs_run, forecast=forecast, reason='flx_file_missing')
             return
         
         try:
-            flx_2mabove = cfgrib.open_dataset(flx_file, engine='cfgrib', filter_by_keys={'typeOfLevel': 'heightAboveGround', 'level': 2}, decode_timedelta=False)
-            try:
-                mean2t = flx_2mabove['avg_2t']
-            except KeyError:
-                print("'avg_2t' not found in flux file, trying 'mean2t'.")
-                mean2t = flx_2mabove['mean2t']
-
-            # Cut the variable to the mask domain
-            mean2t_cut = mean2t.sel(
-                latitude=slice(mask_lat.max(), mask_lat.min()),
-                longitude=slice(mask_lon.min(), mask_lon.max())
-            )
+            # Read the 2 m temperature and latent heat flux in a single pass, cut to the mask domain
+            flx_fields = read_grib_fields(flx_file, CFS_GRIB_FIELDS['flxf'], mask_lat, mask_lon, index_dir=index_dir)
+            mean2t_cut = flx_fields['air_temperature']
 
             # Remap and upscale the variable to match the mask domain
-            mean2t_remap = mean2t_cut.interp(latitude=mask_lat, longitude=mask_lon, method='linear')
+            with metrics.stage('regrid'):
+                regrid = get_regrid_operator(mean2t_cut['latitude'].values, mean2t_cut['longitude'].values, mask_lat, mask_lon, cache_dir=regrid_dir)
+                mean2t_remap = regrid(mean2t_cut.values)
 
-            for mask_var in mask_variables:
-                mask = np.ma.masked_where(np.isnan(mask_ds.variables[mask_var][:]), np.ones_like(mask_ds.variables[mask_var][:]))
-                tmp_avg = np.mean(mean2t_remap * mask)
+            with metrics.stage('mask_reduction'):
+                # Mean over the cells of every region
+                tmp_avg = mask_set.mean(mean2t_remap)
 
-                lake_abv, surface_type = mask_var.split('_')
-                lake = {'eri': 'erie', 'ont': 'ontario', 'sup': 'superior', 'mih': 'michigan-huron'}.get(lake_abv)
-                if lake is None:
-                    raise ValueError(f"ERROR: The mask variables need to begin with 'eri', 'ont', 'sup', or 'mih'. Check the mask file.")
-
-                # Insert air temperature data into the database
-                add_cfs_to_db(database, table, cfs_run, forecast_year, forecast_month, lake, surface_type, 'air_temperature', tmp_avg.item())
+            # Insert air temperature data into the database
+            for (lake, surface_type), value in zip(mask_set.regions, tmp_avg.tolist()):
+                writer.add(cfs_run, forecast_year, forecast_month, lake, surface_type, 'air_temperature', value)
 
         except Exception as e:
             print(f"ERROR processing temperature data. Skipping forecast.")
+            log_skip('runs_skipped', e, cfs_run=cfs_run, forecast=forecast, stage='air_temperature')
             return
 
         ## Evaporation ##
         try:
-            flx_surface = cfgrib.open_dataset(flx_file, engine='cfgrib', filter_by_keys={'typeOfLevel': 'surface'}, decode_timedelta=False)
-            try:
-                mslhf = flx_surface['avg_slhtf']
-            except KeyError:
-                print("'avg_slhtf' not found in flux file, trying 'mslhf'.")
-                mslhf = flx_surface['mslhf']
-
-            # Cut the variable to the mask domain
-            mslhf_cut = mslhf.sel(
-                latitude=slice(mask_lat.max(), mask_lat.min()),
-                longitude=slice(mask_lon.min(), mask_lon.max())
-            )
+            mslhf_cut = flx_fields['latent_heat_flux']
 
             # Remap and upscale the variable to match the mask domain
-            mslhf_remap = mslhf_cut.interp(latitude=mask_lat, longitude=mask_lon, method='linear')
+            with metrics.stage('regrid'):
+                regrid = get_regrid_operator(mslhf_cut['latitude'].values, mslhf_cut['longitude'].values, mask_lat, mask_lon, cache_dir=regrid_dir)
+                mslhf_remap = regrid(mslhf_cut.values)
 
             # Calculate evaporation using air temp and latent heat flux
             evap = calculate_evaporation(mean2t_remap, mslhf_remap)
 
-            for mask_var in mask_variables:
-                mask = mask_ds.variables[mask_var][:]
-                total_evap = (np.sum(evap * area * mask)) * num_days * 86400  # Convert to mm
-                evap_mm = total_evap / np.sum(mask * area)
-
-                lake_abv, surface_type = mask_var.split('_')
-                lake = {'eri': 'erie', 'ont': 'ontario', 'sup': 'superior', 'mih': 'michigan-huron'}.get(lake_abv)
-                if lake is None:
-                    raise ValueError(f"ERROR: The mask variables need to begin with 'eri', 'ont', 'sup', or 'mih'. Check the mask file.")
+            with metrics.stage('mask_reduction'):
+                # Area-weighted average of every region, converted to monthly mm
+                evap_mm = mask_set.area_mean(evap) * num_days * 86400
 
-                # Insert evaporation data into the database
-                add_cfs_to_db(database, table, cfs_run, forecast_year, forecast_month, lake, surface_type, 'evaporation', evap_mm.item())
+            # Insert evaporation data into the database
+            for (lake, surface_type), value in zip(mask_set.regions, evap_mm.tolist()):
+                writer.add(cfs_run, forecast_year, forecast_month, lake, surface_type, 'evaporation', value)
 
         except Exception as e:
             print(f"ERROR processing evaporation data. Skipping forecast.")
+            log_skip('runs_skipped', e, cfs_run=cfs_run, forecast=forecast, stage='evaporation')
             return
 
-        except FileNotFoundError:
-            print(f"ERROR: The flx file corresponding to {pgb_file} does not exist. Skipping forecast.")
+class _RowCollector(CFSWriter):
+    """A CFSWriter that only buffers rows, so worker processes never write to the database."""
+
+    def __init__(self):
+        super().__init__(database=None)
+
+    def end_run(self):
+        pass
+
+    def flush(self):
+        return 0
+
+# Mask, areas and settings of a worker process, set once by `_init_cfs_worker`
+_CFS_WORKER = {}
+
+def _init_cfs_worker(mask_file, mask_variables, regrid_dir, index_dir):
+    """Open the mask file and compute the grid cell areas and mask weights once per worker process."""
+    import netCDF4 as nc
+
+    mask_ds = nc.Dataset(mask_file)
+    mask_lat = mask_ds.variables['latitude'][:]
+    mask_lon = mask_ds.variables['longitude'][:]
+
+    area = calculate_grid_cell_areas(mask_lon, mask_lat)
+
+    _CFS_WORKER.update({
+        'mask_ds': mask_ds,
+        'mask_lat': mask_lat,
+        'mask_lon': mask_lon,
+        'area': area,
+        'mask_variables': mask_variables,
+        'mask_set': MaskSet(mask_ds, mask_variables, area),
+        'regrid_dir': regrid_dir,
+        'index_dir': index_dir,
+    })
+
+def _extract_cfs_run(download_path, cfs_run, collect_metrics=False):
+    """
+    Decode one CFS run in a worker process and return its rows for the writer, with the worker's metrics
+    of the run if `collect_metrics` is set (they would be lost with the process otherwise).
+    """
+    if collect_metrics:
+        metrics.reset()
+    collector = _RowCollector()
+    process_grib_files(download_path, None, None, cfs_run,
+                       _CFS_WORKER['mask_lat'], _CFS_WORKER['mask_lon'], _CFS_WORKER['mask_ds'],
+                       _CFS_WORKER['mask_variables'], _CFS_WORKER['area'],
+                       regrid_dir=_CFS_WORKER['regrid_dir'], index_dir=_CFS_WORKER['index_dir'], writer=collector,
+                       mask_set=_CFS_WORKER['mask_set'])
+    return (collector.rows, metrics.snapshot()) if collect_metrics else collector.rows
+
+def parse_cfs_date(date):
+    """Parse a CFS run date given as a datetime or as 'MM-DD-YYYY HH' / 'MM-DD-YYYY' (as used by the notebooks)."""
+    if isinstance(date, str):
+        for date_format in ("%m-%d-%Y %H", "%m-%d-%Y"):
+            try:
+                return datetime.strptime(date, date_format)
+            except ValueError:
+                continue
+        raise ValueError(f"ERROR: Date '{date}' must be formatted as 'MM-DD-YYYY HH' or 'MM-DD-YYYY'.")
+    return pd.Timestamp(date).to_pydatetime()
+
+def cfs_run_dates(start, end):
+    """
+    Lists the 6-hourly CFS runs between two dates.
+
+    Parameters:
+    start (str or datetime): First CFS run ('MM-DD-YYYY HH' or 'MM-DD-YYYY' for 00Z).
+    end (str or datetime): Last CFS run ('MM-DD-YYYY HH' or 'MM-DD-YYYY' for 18Z).
+
+    Returns:
+    pd.DatetimeIndex: The CFS run dates, every 6 hours.
+    """
+    start_date = parse_cfs_date(start)
+    end_date = parse_cfs_date(end)
+    if isinstance(end, str) and len(end) == 10:
+        end_date = end_date.replace(hour=18)
+    if start_date > end_date:
+        raise ValueError("ERROR: The start date must not be after the end date.")
+
+    return pd.date_range(start=start_date, end=end_date, freq='6h')
+
+def process_cfs_range(start, end, download_dir, database, mask_file, mask_variables, table='cfs_forecast_data',
+                      workers=1, runs_per_commit=1, regrid_dir=None, index_dir=None, archive=None):
+    """
+    Processes every 6-hourly CFS run between two dates, decoding the runs in parallel.
+
+    The GRIB files of each run are decoded in a pool of worker processes, each of which opens the mask
+    file once. The decoded rows are sent back to this process, which is the only one writing to the
+    database, so SQLite never sees concurrent writers. A run that fails is reported and skipped without
+    stopping the others.
+
+    Parameters:
+    start (str or datetime): First CFS run ('MM-DD-YYYY HH' or 'MM-DD-YYYY' for 00Z).
+    end (str or datetime): Last CFS run ('MM-DD-YYYY HH' or 'MM-DD-YYYY' for 18Z).
+    download_dir (str): Directory containing one 'YYYYMMDD' folder of GRIB files per day.
+    database (str): Path to the SQLite database.
+    mask_file (str): Path to the GL mask netCDF file.
+    mask_variables (list): A list of mask variables to process.
+    table (str): The table where the data will be inserted. Default = 'cfs_forecast_data'.
+    workers (int): Number of worker processes. Default = 1 (process the runs in this process).
+    runs_per_commit (int): Number of runs written per database transaction. Default = 1.
+    regrid_dir (str, optional): Directory to cache the regrid weights in. Default = None.
+    index_dir (str, optional): Directory for the persistent GRIB index files. Default = None.
+    archive (CFSArchive, optional): A columnar archive the runs are also appended to, once they are committed. Default = None.
+
+    Returns:
+    dict: {'processed': list of CFS runs committed, 'failed': dict of CFS run -> error message}.
+    """
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError("ERROR: workers must be a positive integer.")
+
+    jobs = [(os.path.join(download_dir, date.strftime('%Y%m%d')), date.strftime('%Y%m%d%H'))
+            for date in cfs_run_dates(start, end)]
+
+    # Make sure the table exists before any rows are written
+    conn, _ = open_cfs_db(database)
+    if conn is not None:
+        conn.close()
+
+    processed, failed = [], {}
+
+    def write_result(cfs_run, get_rows):
+        try:
+            rows = get_rows()
+        except Exception as e:
+            print(f"ERROR processing CFS run {cfs_run}: {e}. Skipping.")
+            log_skip('runs_failed', e, cfs_run=cfs_run)
+            failed[cfs_run] = str(e)
+            return
+        if not rows:
+            log_skip('runs_failed', cfs_run=cfs_run, reason='no_data')
+            failed[cfs_run] = "No data extracted from the GRIB files."
             return
+        writer.extend(rows)
+        # The run is archived and reported once it is committed, which may be several runs later
+        writer.after_commit(lambda: committed(cfs_run, rows))
+        writer.end_run()
+
+    def committed(cfs_run, rows):
+        if archive is not None:
+            archive.append_rows(rows)
+        processed.append(cfs_run)
+        metrics.count('runs_processed')
+
+    def worker_rows(future):
+        rows, snapshot = future.result()
+        metrics.merge(snapshot)
+        return rows
+
+    with CFSWriter(database, table, runs_per_commit=runs_per_commit) as writer:
+        if workers == 1:
+            _init_cfs_worker(mask_file, mask_variables, regrid_dir, index_dir)
+            try:
+                for download_path, cfs_run in jobs:
+                    write_result(cfs_run, lambda: _extract_cfs_run(download_path, cfs_run))
+            finally:
+                _CFS_WORKER.pop('mask_ds').close()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_cfs_worker,
+                                     initargs=(mask_file, mask_variables, regrid_dir, index_dir)) as executor:
+                futures = {executor.submit(_extract_cfs_run, download_path, cfs_run, True): cfs_run
+                           for download_path, cfs_run in jobs}
+                for future in as_completed(futures):
+                    write_result(futures[future], lambda: worker_rows(future))
+
+    print(f"Processed {len(processed)} of {len(jobs)} CFS runs ({len(failed)} failed).")
+    return {'processed': sorted(processed), 'failed': failed}
+
+def resolve_feature_schema(x_scaler, schema=None):
+    """
+    Returns the feature schema to check the model inputs against.
+
+    Parameters:
+    x_scaler (str or scaler): The file path to the input scaler, or the loaded scaler.
+    schema (FeatureSchema or str, optional): The schema or the path of its JSON file. Default = None.
 
-def predict_cnbs(X, x_scaler, y_scaler, models_info, model_name):
+    Returns:
+    FeatureSchema or None: The given schema, else the one saved next to the x_scaler file, else None.
+    """
+    if isinstance(schema, FeatureSchema):
+        return schema
+    if isinstance(schema, str):
+        return FeatureSchema.load(schema)
+    if isinstance(x_scaler, str) and os.path.exists(feature_schema_path(x_scaler)):
+        return FeatureSchema.load(feature_schema_path(x_scaler))
+    return None
+
+def predict_cnbs(X, x_scaler, y_scaler, models_info, model_name, registry=None, schema=None):
     """
     Predicts Components of Net Basin Supply for the lakes.
     
     Parameters:
     X (pd.DataFrame): The input data to predict the CNBS values. It should be a DataFrame.
-    x_scaler (str): The file path to the scaler used for the input data.
-    y_scaler (str): The file path to the scaler used for the target data.
+    x_scaler (str or scaler): The file path to the scaler used for the input data, or the loaded scaler.
+    y_scaler (str or scaler): The file path to the scaler used for the target data, or the loaded scaler.
     models_info (list): A list of dictionaries containing model information.
     model_name (str): The name of the model to be used for prediction.
+    registry (ModelRegistry, optional): Registry the scalers and models are loaded from, so each file is
+        only deserialized once per process. Default = None (the shared default registry).
+    schema (FeatureSchema or str, optional): Feature schema (or its path) X is checked against. Default = None
+        (the 'feature_schema.json' next to x_scaler, if any).
 
     Returns:
     pd.DataFrame: A DataFrame containing the predicted CNBS values for each lake.
@@ -321,11 +580,21 @@ def predict_cnbs(X, x_scaler, y_scaler, models_info, model_name):
     if not isinstance(X, pd.DataFrame):
         raise ValueError("ERROR: X must be a pandas DataFrame.")
     
-    # Load scalers from the provided file paths
+    registry = registry if registry is not None else default_registry
+    schema = resolve_feature_schema(x_scaler, schema)
+
+    # Load scalers from the provided file paths (cached by the registry)
     try:
-        x_scaler, y_scaler = joblib.load(x_scaler), joblib.load(y_scaler)
+        if isinstance(x_scaler, str):
+            x_scaler = registry.get(x_scaler)
+        if isinstance(y_scaler, str):
+            y_scaler = registry.get(y_scaler)
     except FileNotFoundError as e:
         raise FileNotFoundError(f"ERROR loading scalers: {e}")
+
+    # Check the input columns against the training features
+    if schema is not None:
+        X = schema.check(X, x_scaler)
     
     # Standardize the input data using the loaded scaler
     X_scaled = x_scaler.transform(X)
@@ -335,29 +604,406 @@ def predict_cnbs(X, x_scaler, y_scaler, models_info, model_name):
     if not model_info:
         raise ValueError(f"ERROR: Model name '{model_name}' is not recognized in the provided models_info list.")
     
-    # Load the model
+    # Load the model (cached by the registry)
     try:
-        model_loaded = joblib.load(model_info['path'])
+        model_loaded = registry.get(model_info['path'])
     except FileNotFoundError as e:
         raise FileNotFoundError(f"ERROR loading model from {model_info['path']}: {e}")
 
     # Predict the scaled output
-    y_pred_scaled = model_loaded.predict(X_scaled)
+    with metrics.stage('predict'):
+        y_pred_scaled = model_loaded.predict(X_scaled)
 
     # Inverse transform to get the original scale
     y_pred = y_scaler.inverse_transform(y_pred_scaled)
 
-    # Define column names for the predictions
-    column_names = ['superior_evaporation', 'superior_precipitation', 'superior_runoff', 'superior_cnbs',
-                    'erie_evaporation', 'erie_precipitation', 'erie_runoff', 'erie_cnbs',
-                    'ontario_evaporation', 'ontario_precipitation', 'ontario_runoff', 'ontario_cnbs',
-                    'michigan-huron_evaporation', 'michigan-huron_precipitation', 'michigan-huron_runoff', 'michigan-huron_cnbs']
-    
     # Create DataFrame from predictions and reset index
-    df = pd.DataFrame(y_pred, columns=column_names, index=X.index)
+    df = pd.DataFrame(y_pred, columns=CNBS_COLUMNS, index=X.index)
 
     return df
 
+def predict_ensemble(X, x_scaler, y_scaler, models_info, models=None, registry=None, workers=1, schema=None):
+    """
+    Predicts Components of Net Basin Supply with several models and returns the forecasts in long format.
+
+    The input data is scaled once and shared by every model. The models can run in a thread pool, since
+    scikit-learn and numpy release the GIL for most of the work. The long-format output is built directly
+    from the prediction arrays, without melting or splitting the column names row by row.
+
+    Parameters:
+    X (pd.DataFrame): The input data, indexed by 'cfs_run', 'year' and 'month'.
+    x_scaler (str or scaler): The file path to the scaler used for the input data, or the loaded scaler.
+    y_scaler (str or scaler): The file path to the scaler used for the target data, or the loaded scaler.
+    models_info (list): A list of dictionaries containing model information.
+    models (list, optional): Names of the models to run. Default = None (every model in models_info).
+    registry (ModelRegistry, optional): Registry the scalers and models are loaded from. Default = None (shared registry).
+    workers (int): Number of threads used to run the models. Default = 1.
+    schema (FeatureSchema or str, optional): Feature schema (or its path) X is checked against. Default = None
+        (the 'feature_schema.json' next to x_scaler, if any).
+
+    Returns:
+    pd.DataFrame: One row per (cfs_run, month, year, model, lake, component) with the 'value [mm]', indexed by
+    'cfs_run', 'month' and 'year' (the layout of the 'cnbs_forecast' table).
+    """
+    # Input validation
+    if not isinstance(X, pd.DataFrame):
+        raise ValueError("ERROR: X must be a pandas DataFrame.")
+    if not all(level in X.index.names for level in ['cfs_run', 'year', 'month']):
+        raise ValueError("ERROR: The DataFrame index must have 'cfs_run', 'year' and 'month' as levels.")
+
+    registry = registry if registry is not None else default_registry
+    models = models if models is not None else [model['model'] for model in models_info]
+    schema = resolve_feature_schema(x_scaler, schema)
+
+    try:
+        if isinstance(x_scaler, str):
+            x_scaler = registry.get(x_scaler)
+        if isinstance(y_scaler, str):
+            y_scaler = registry.get(y_scaler)
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"ERROR loading scalers: {e}")
+
+    if schema is not None:
+        X = schema.check(X, x_scaler)
+
+    paths = {model['model']: model['path'] for model in models_info}
+    for model_name in models:
+        if model_name not in paths:
+            raise ValueError(f"ERROR: Model name '{model_name}' is not recognized in the provided models_info list.")
+
+    # Scale the input data once for all the models
+    X_scaled = x_scaler.transform(X)
+
+    def run_model(model_name):
+        try:
+            with metrics.stage('model_load'):
+                model_loaded = registry.get(paths[model_name])
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"ERROR loading model from {paths[model_name]}: {e}")
+        with metrics.stage('predict'):
+            return y_scaler.inverse_transform(model_loaded.predict(X_scaled))
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            predictions = list(executor.map(run_model, models))
+    else:
+        predictions = [run_model(model_name) for model_name in models]
+
+    # (run, model, target) cube flattened in that order
+    values = np.stack(predictions, axis=1).reshape(-1)
+    num_rows, num_models, num_targets = len(X), len(models), len(CNBS_COLUMNS)
+
+    lakes, components = zip(*(column.split('_', 1) for column in CNBS_COLUMNS))
+    lake_names, lake_codes = np.unique(lakes, return_inverse=True)
+    component_names, component_codes = np.unique(components, return_inverse=True)
+
+    row_index = np.repeat(np.arange(num_rows), num_models * num_targets)
+    df = pd.DataFrame({
+        'cfs_run': X.index.get_level_values('cfs_run').values[row_index],
+        'month': X.index.get_level_values('month').values[row_index],
+        'year': X.index.get_level_values('year').values[row_index],
+        'model': pd.Categorical.from_codes(np.tile(np.repeat(np.arange(num_models), num_targets), num_rows), models),
+        'lake': pd.Categorical.from_codes(np.tile(lake_codes, num_rows * num_models), lake_names),
+        'component': pd.Categorical.from_codes(np.tile(component_codes, num_rows * num_models), component_names),
+        'value [mm]': values,
+    })
+
+    return df.set_index(['cfs_run', 'month', 'year'])
+
+def load_feature_matrix(database, since_run=None, valid_from=None, table='cfs_forecast_data', as_array=False, dropna=True):
+    """
+    Loads the model input matrix (one row per CFS run and forecast month) straight from the database.
+
+    The run and forecast date filters are applied in SQL (using the primary key and the (year, month)
+    index), and the 36 feature columns are written in training order into a preallocated array,
+    without building variable names or pivoting in pandas. On a database in the compact schema the
+    integer codes are read from the compact table directly.
+
+    Parameters:
+    database (str): Path to the SQLite database.
+    since_run (int or str, optional): Only load CFS runs at or after this run (YYYYMMDDHH). Default = None.
+    valid_from (tuple or datetime, optional): Only load forecast months at or after this (year, month). Default = None.
+    table (str): The table holding the CFS basin averages. Default = 'cfs_forecast_data'.
+    as_array (bool): Return a numpy array and its index instead of a DataFrame. Default = False.
+    dropna (bool): Drop the rows with missing features (counted and logged). Default = True.
+
+    Returns:
+    pd.DataFrame: The feature matrix with FEATURE_COLUMNS, indexed by 'cfs_run', 'year' and 'month';
+    or a tuple (np.ndarray, pd.MultiIndex) if as_array is True.
+    """
+    conditions, params = [], []
+    if since_run is not None:
+        conditions.append('cfs_run >= ?')
+        params.append(int(since_run))
+    if valid_from is not None:
+        valid_year, valid_month = (valid_from.year, valid_from.month) if hasattr(valid_from, 'year') else valid_from
+        conditions.append('(year, month) >= (?, ?)')
+        params.extend([int(valid_year), int(valid_month)])
+
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    conn = sqlite3.connect(database)
+    try:
+        feature_position = {name: i for i, name in enumerate(FEATURE_COLUMNS)}
+        if is_compact_cfs_db(conn, table):
+            # Read the integer codes straight from the compact table and map the few code triples to columns
+            data = pd.read_sql_query(f'''
+            SELECT cfs_run, year, month, lake_id, surface_id, component_id, "value [mm]" FROM {CFS_COMPACT_TABLE} {where}
+            ''', conn, params=params)
+            names = [dict(conn.execute(f'SELECT {code_column}, {column} FROM {code_table}').fetchall())
+                     for column, (code_table, code_column, _) in CFS_CODE_TABLES.items()]
+            code_columns = ['lake_id', 'surface_id', 'component_id']
+        else:
+            data = pd.read_sql_query(f'''
+            SELECT cfs_run, year, month, lake, surface_type, component, "value [mm]" FROM {table} {where}
+            ''', conn, params=params)
+            names = None
+            code_columns = ['lake', 'surface_type', 'component']
+    finally:
+        conn.close()
+
+    # Row of each record: one per (cfs_run, year, month), factorized on a single integer key
+    run_month = data['cfs_run'].to_numpy(dtype=np.int64) * 100000 + data['year'].to_numpy(dtype=np.int64) * 12 + data['month'].to_numpy(dtype=np.int64) - 1
+    keys, row_codes = np.unique(run_month, return_inverse=True)
+    index = pd.MultiIndex.from_arrays([keys // 100000, (keys % 100000) // 12, (keys % 100000) % 12 + 1],
+                                      names=['cfs_run', 'year', 'month'])
+
+    # Column of each record: factorize the few distinct (lake, surface, component) triples and map them to features
+    var_codes, variables = pd.factorize(pd.MultiIndex.from_arrays([data[column] for column in code_columns]))
+    if names is not None:
+        variables = [tuple(names[i].get(code) for i, code in enumerate(variable)) for variable in variables]
+    var_columns = np.array([feature_position.get('_'.join(map(str, variable)), -1) for variable in variables], dtype=np.int64)
+
+    X = np.full((len(index), len(FEATURE_COLUMNS)), np.nan)
+    col_codes = var_columns[var_codes] if len(var_codes) else np.empty(0, dtype=np.int64)
+    used = col_codes >= 0
+    X[row_codes[used], col_codes[used]] = data['value [mm]'].to_numpy()[used]
+
+    # One-hot encode the forecast month
+    months = index.get_level_values('month').to_numpy(dtype=np.int64)
+    X[:, FEATURE_COLUMNS.index('month_1'):] = 0
+    X[np.arange(len(index)), FEATURE_COLUMNS.index('month_1') + months - 1] = 1
+
+    if dropna:
+        missing = np.isnan(X).any(axis=1)
+        if missing.any():
+            metrics.count('feature_rows_dropped', int(missing.sum()))
+            log_event('feature_rows_dropped', level=logging.WARNING, rows=int(missing.sum()),
+                      cfs_runs=sorted(set(index[missing].get_level_values('cfs_run').tolist())))
+            X, index = X[~missing], index[~missing]
+
+    if as_array:
+        return X, index
+    return pd.DataFrame(X, columns=FEATURE_COLUMNS, index=index)
+
+def settled_cfs_run(runs, incomplete_runs, start, newest, recheck_days=FORECAST_RECHECK_DAYS, include_start=False):
+    """
+    Finds the last CFS run up to which every 6-hourly run has been forecast in full.
+
+    The 6-hourly runs after `start` are walked in order until the first run that is missing from `runs` or
+    listed in `incomplete_runs`. Such runs more than `recheck_days` older than `newest` are not waited for
+    anymore (they are logged and passed).
+
+    Parameters:
+    runs (set): The CFS runs (YYYYMMDDHH integers) that were loaded.
+    incomplete_runs (set): The loaded CFS runs with missing features.
+    start (int): The previous watermark, or the first loaded run if there is none.
+    newest (int): The newest loaded CFS run.
+    recheck_days (float): Days before `newest` during which missing and incomplete runs are waited for.
+        Default = FORECAST_RECHECK_DAYS.
+    include_start (bool): Check `start` itself too (when it is not a watermark). Default = False.
+
+    Returns:
+    int: The new watermark, or None if not even the first run is settled.
+    """
+    start_date = datetime.strptime(str(start), '%Y%m%d%H')
+    newest_date = datetime.strptime(str(newest), '%Y%m%d%H')
+    cutoff = newest_date - timedelta(days=recheck_days)
+
+    settled = None if include_start else int(start)
+    for date in pd.date_range(start_date if include_start else start_date + timedelta(hours=6), newest_date, freq='6h'):
+        cfs_run = int(date.strftime('%Y%m%d%H'))
+        if cfs_run in runs and cfs_run not in incomplete_runs:
+            settled = cfs_run
+        elif date < cutoff:
+            log_skip('forecast_runs_abandoned', cfs_run=cfs_run, reason='incomplete' if cfs_run in runs else 'missing')
+            settled = cfs_run
+        else:
+            break
+    return settled
+
+def forecast_new_runs(cfs_database, cnbs_database, x_scaler, y_scaler, models_info, models=None, registry=None,
+                      table='cfs_forecast_data', forecast_table='cnbs_forecast', mean_table='cnbs_forecast_model_mean',
+                      full=False, workers=1, summary_table='cnbs_forecast_summary', quantiles=ENSEMBLE_QUANTILES,
+                      recheck_days=FORECAST_RECHECK_DAYS):
+    """
+    Predicts CNBS only for the CFS runs that were not predicted yet and upserts them into the forecast database.
+
+    A watermark is kept per model in the forecast database: every 6-hourly CFS run up to it has been predicted
+    in full. Only the runs after the oldest watermark are loaded (see `load_feature_matrix`, with the same first
+    forecast month as `filter_predictions`), and each model predicts the forecast months it has not predicted
+    yet. A run that is missing (e.g. committed out of order by a parallel ingest) or incomplete (missing
+    features) holds the watermark back, so it is picked up once it is complete; runs more than `recheck_days`
+    older than the newest run are not waited for anymore. The forecasts, the model means of the affected
+    forecast months and the watermarks are written in one transaction, and the ensemble statistics of the
+    affected forecast months are then recomputed into the summary table (see `update_ensemble_summary`).
+    Running it twice does nothing the second time, so the cost of a cron job follows the new data, not the
+    size of the table.
+
+    Parameters:
+    cfs_database (str): Path to the CFS forecast database.
+    cnbs_database (str): Path to the CNBS forecast database.
+    x_scaler (str or scaler): The file path to the scaler used for the input data, or the loaded scaler.
+    y_scaler (str or scaler): The file path to the scaler used for the target data, or the loaded scaler.
+    models_info (list): A list of dictionaries containing model information.
+    models (list, optional): Names of the models to run. Default = None (every model in models_info).
+    registry (ModelRegistry, optional): Registry the scalers and models are loaded from. Default = None (shared registry).
+    table (str): The table holding the CFS basin averages. Default = 'cfs_forecast_data'.
+    forecast_table (str): The CNBS forecast table. Default = 'cnbs_forecast'.
+    mean_table (str): The CNBS model mean table. Default = 'cnbs_forecast_model_mean'.
+    full (bool): Ignore the watermarks and predict every run again (e.g. after a backfill of older runs). Default = False.
+    workers (int): Number of threads used to run the models. Default = 1.
+    summary_table (str): The table of the ensemble statistics. Default = 'cnbs_forecast_summary'.
+    quantiles (tuple): Quantiles of the ensemble statistics. Default = ENSEMBLE_QUANTILES.
+    recheck_days (float): Days before the newest CFS run during which missing and incomplete runs are waited for.
+        Default = FORECAST_RECHECK_DAYS.
+
+    Returns:
+    dict: {'runs': list of CFS runs predicted, 'rows': number of forecast rows written,
+    'months': list of (year, month) groups whose model means were updated}.
+    """
+    models = models if models is not None else [model['model'] for model in models_info]
+
+    conn, _ = open_cnbs_db(cnbs_database, forecast_table, mean_table, summary_table)
+    if conn is None:
+        raise sqlite3.DatabaseError(f"ERROR: Could not open the forecast database '{cnbs_database}'.")
+
+    try:
+        watermarks = {} if full else get_forecast_watermarks(conn)
+        last_runs = [watermarks.get(model_name) for model_name in models]
+        since_run = None if None in last_runs else min(last_runs) + 1
+
+        with metrics.stage('feature_load'):
+            X = load_feature_matrix(cfs_database, since_run=since_run, valid_from=first_forecast_month(), table=table, dropna=False)
+        if X.empty:
+            print("No new CFS runs to forecast.")
+            return {'runs': [], 'rows': 0, 'months': []}
+
+        # The complete months of an incomplete run are predicted, the run itself is checked again on the next call
+        missing = X.isna().any(axis=1).to_numpy()
+        incomplete_runs = set(X.index[missing].get_level_values('cfs_run').tolist())
+        if missing.any():
+            log_skip('forecast_months_incomplete', rows=int(missing.sum()), cfs_runs=sorted(incomplete_runs))
+        loaded_runs = X.index.get_level_values('cfs_run')
+        first_run, newest_run = int(loaded_runs.min()), int(loaded_runs.max())
+        X = X[~missing]
+
+        # Forecast months each model already predicted (none when every run is predicted again)
+        predicted = {} if full else get_forecast_months(conn, forecast_table, since_run)
+        keys = list(zip(X.index.get_level_values('cfs_run').tolist(), X.index.get_level_values('year').tolist(),
+                        X.index.get_level_values('month').tolist()))
+        pending = np.array([any(key not in predicted.get(model_name, ()) for model_name in models) for key in keys], dtype=bool)
+
+        df = None
+        if pending.any():
+            df = predict_ensemble(X[pending], x_scaler, y_scaler, models_info, models=models, registry=registry, workers=workers)
+
+            # Each model only keeps the forecast months it did not predict yet
+            row_keys = zip(df.index.get_level_values('cfs_run').tolist(), df.index.get_level_values('year').tolist(),
+                           df.index.get_level_values('month').tolist(), df['model'].astype(str).tolist())
+            keep = np.array([(cfs_run, year, month) not in predicted.get(model_name, ())
+                             for cfs_run, year, month, model_name in row_keys], dtype=bool)
+            df = convert_mm_to_cms(df[keep].copy())
+
+        # Watermarks move up to the last run before the first run still missing or incomplete
+        previous = min(last_runs) if since_run is not None else None
+        settled = settled_cfs_run(set(loaded_runs.tolist()), incomplete_runs, previous if previous is not None else first_run,
+                                  newest_run, recheck_days, include_start=previous is None)
+        new_watermarks = {model_name: max(settled, watermarks.get(model_name, settled)) for model_name in models} \
+            if settled is not None else {}
+
+        months = []
+        with metrics.stage('forecast_write'):
+            if df is not None and not df.empty:
+                months = upsert_cnbs_forecast(conn, df, forecast_table, mean_table, watermarks=new_watermarks)
+            elif new_watermarks:
+                with conn:
+                    set_forecast_watermarks(conn, new_watermarks)
+        if months:
+            with metrics.stage('ensemble_summary'):
+                update_ensemble_summary(conn, months, quantiles, forecast_table, summary_table)
+    finally:
+        conn.close()
+
+    num_rows = 0 if df is None else len(df)
+    runs = [] if df is None else sorted(set(df.index.get_level_values('cfs_run').tolist()))
+    metrics.count('runs_forecast', len(runs))
+    metrics.count('forecast_rows_written', num_rows)
+    print(f"Forecast {len(runs)} new CFS runs ({num_rows} rows, {len(months)} forecast months updated).")
+    return {'runs': runs, 'rows': num_rows, 'months': months}
+
+def write_forecast_csv(cnbs_database, csv_path, table='cnbs_forecast', summary_table='cnbs_forecast_summary', now=None):
+    """
+    Writes the ensemble mean of every forecast month to the tab-separated CNBS_forecast.csv file.
+
+    The means are read from the ensemble summary table kept up to date by `forecast_new_runs` (the mean over
+    all the models and CFS runs of each forecast month), from the first forecast month on (see
+    `first_forecast_month`). If the summary has none of these months yet, it is built for them from the forecast table.
+
+    Parameters:
+    cnbs_database (str): Path to the CNBS forecast database.
+    csv_path (str): Path of the CSV file to write.
+    table (str): The CNBS forecast table. Default = 'cnbs_forecast'.
+    summary_table (str): The table of the ensemble statistics. Default = 'cnbs_forecast_summary'.
+    now (datetime, optional): The current date. Default = None (now).
+
+    Returns:
+    pd.DataFrame: The rows written to the CSV file.
+    """
+    valid_from = first_forecast_month(now)
+    conn, _ = open_cnbs_db(cnbs_database, table, summary_table=summary_table)
+    if conn is None:
+        raise sqlite3.DatabaseError(f"ERROR: Could not open the forecast database '{cnbs_database}'.")
+    try:
+        summary = read_ensemble_summary(conn, statistics=['mean'], models=[ENSEMBLE_ALL], valid_from=valid_from,
+                                        summary_table=summary_table)
+        if summary.empty:
+            # Only the forecast months written to the file are summarized
+            months = conn.execute(f'SELECT DISTINCT year, month FROM "{table}" WHERE (year, month) >= (?, ?)', valid_from).fetchall()
+            update_ensemble_summary(conn, months, table=table, summary_table=summary_table)
+            summary = read_ensemble_summary(conn, statistics=['mean'], models=[ENSEMBLE_ALL], valid_from=valid_from,
+                                            summary_table=summary_table)
+    finally:
+        conn.close()
+
+    if summary.empty:
+        print("ERROR: No forecast to write to the CSV file.")
+        return summary
+
+    df_mean = summary.rename(columns={'year': 'forecast_year', 'month': 'forecast_month'})
+    df_mean[['value [mm]', 'value [cms]']] = df_mean[['value [mm]', 'value [cms]']].round(3)
+    df_mean.insert(0, 'current_year', df_mean['forecast_year'].iloc[0])
+    df_mean.insert(1, 'current_month', df_mean['forecast_month'].iloc[0])
+    df_mean = df_mean[['current_year', 'current_month', 'forecast_year', 'forecast_month', 'lake', 'component',
+                       'value [mm]', 'value [cms]']]
+    df_mean.to_csv(csv_path, sep='\t', index=False)
+    return df_mean
+
+def first_forecast_month(now=None):
+    """
+    Returns the first month to forecast: the current month, or the next one from the 26th on (a request by USACE).
+
+    Parameters:
+    now (datetime, optional): The current date. Default = None (now).
+
+    Returns:
+    tuple: (year, month) of the first forecast month.
+    """
+    now = now if now is not None else datetime.now()
+    if now.day >= 26:
+        return (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+    return (now.year, now.month)
+
 def filter_predictions(df):
     """
     Filters the predictions DataFrame based on the current date. If the current day is greater than or equal to the 26th,
@@ -377,30 +1023,19 @@ def filter_predictions(df):
     if not all(col in df.index.names for col in ['year', 'month']):
         raise ValueError("ERROR: The DataFrame index must have 'year' and 'month' as levels.")
     
-    # Get the current date
-    current_day = datetime.now().day
-    current_month = datetime.now().month
-    current_year = datetime.now().year
+    # First forecast month based on the current date
+    first_year, first_month = first_forecast_month()
 
     # Extract year and month from the DataFrame index
     pred_year = df.index.get_level_values('year')
     pred_month = df.index.get_level_values('month')
 
-    # Determine filtering condition based on the current day of the month
-    if current_day >= 26:
-        # Remove this month and all previous months
-        filtered_df = df[
-            (pred_year > current_year) |
-            ((pred_year == current_year) & (pred_month > current_month))
-        ]
-        print(f"First month forecast: {current_month + 1}")
-    else:
-        # Keep this month and all future months
-        filtered_df = df[
-            (pred_year > current_year) |
-            ((pred_year == current_year) & (pred_month >= current_month))
-        ]
-        print(f"First month forecast: {current_month}")
+    # Remove the months before the first forecast month
+    filtered_df = df[
+        (pred_year > first_year) |
+        ((pred_year == first_year) & (pred_month >= first_month))
+    ]
+    print(f"First month forecast: {first_month}")
 
     return filtered_df
 
@@ -1,14 +1,175 @@
 import urllib.request
-from bs4 import BeautifulSoup
-import boto3
-from botocore import UNSIGNED
-from botocore.client import Config
+import urllib.error
 import os
-import requests
 import sqlite3
 from datetime import datetime, timedelta
 
-def download_grb2_ncei(product, url_path, download_dir):
+from src.cache_utils import link_cached_file
+from src.metrics_utils import log_skip, metrics
+
+# Inventory (.idx) patterns of the GRIB messages used by the forecast for each product. An entry
+# matches an inventory line if it is found in the line, e.g. '1:0:d=2025050100:TMP:2 m above ground:...'
+GRIB_SUBSET_PATTERNS = {
+    'pgb': [':APCP:surface:'],
+    'flx': [':TMP:2 m above ground:', ':LHTFL:surface:'],
+}
+
+def parse_grib_idx(idx_text):
+    """
+    Parses a wgrib2-style GRIB inventory (.idx file).
+
+    Parameters:
+    - idx_text (str): Content of the .idx file, one 'number:offset:date:variable:level:...' line per message.
+
+    Returns:
+    - list: One dictionary per message with 'line', 'start' and 'end' byte offsets ('end' is inclusive
+      and None for the last message, which runs to the end of the file).
+    """
+    messages = []
+    for line in idx_text.splitlines():
+        parts = line.split(':')
+        if len(parts) < 3 or not parts[1].isdigit():
+            continue
+        messages.append({'line': line, 'start': int(parts[1]), 'end': None})
+
+    # A message ends where the next message with a different offset begins (sub-messages share an offset)
+    for i, message in enumerate(messages):
+        next_start = next((m['start'] for m in messages[i + 1:] if m['start'] > message['start']), None)
+        message['end'] = next_start - 1 if next_start is not None else None
+
+    return messages
+
+def select_grib_ranges(messages, patterns):
+    """
+    Selects the byte ranges of the inventory messages matching any of the patterns.
+
+    Parameters:
+    - messages (list): Messages as returned by `parse_grib_idx`.
+    - patterns (list): Substrings to look for in the inventory lines.
+
+    Returns:
+    - list: Sorted, merged (start, end) byte ranges ('end' inclusive, None for end of file).
+    """
+    ranges = sorted({(m['start'], m['end']) for m in messages if any(p in m['line'] for p in patterns)},
+                    key=lambda r: r[0])
+
+    # Merge contiguous ranges so adjacent messages are fetched with one request
+    merged = []
+    for start, end in ranges:
+        if merged and merged[-1][1] is not None and merged[-1][1] + 1 >= start:
+            merged[-1] = (merged[-1][0], end if end is None else max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _byte_range(start, end):
+    """Format an HTTP/S3 Range header value."""
+    return f"bytes={start}-" if end is None else f"bytes={start}-{end}"
+
+def _write_grib_subset(local_file_path, ranges, read_range):
+    """Write the requested byte ranges to a local GRIB file (atomically). Returns the number of bytes written."""
+    tmp_path = local_file_path + '.part'
+    num_bytes = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            for start, end in ranges:
+                chunk = read_range(start, end)
+                f.write(chunk)
+                num_bytes += len(chunk)
+        os.replace(tmp_path, local_file_path)
+    finally:
+        # Do not leave a partial file behind if a range request failed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return num_bytes
+
+def _count_download(path):
+    """Count a downloaded file and its size in the pipeline metrics."""
+    metrics.count('files_downloaded')
+    metrics.count('bytes_downloaded', os.path.getsize(path))
+
+def _subset_patterns(product, patterns):
+    """Return the subset patterns to use for a product ('pgb'/'pgbf' or 'flx'/'flxf')."""
+    if patterns is not None:
+        return patterns
+    return GRIB_SUBSET_PATTERNS['pgb' if product.startswith('pgb') else 'flx']
+
+def _cache_variant(product, subset, patterns):
+    """Return the cache variant describing how a file is downloaded (whole file or subset patterns)."""
+    if not subset:
+        return 'full'
+    return 'subset:' + '|'.join(_subset_patterns(product, patterns))
+
+def download_grb2_subset_http(file_url, local_file_path, patterns):
+    """
+    Downloads only the GRIB messages matching the patterns from an HTTP server, using the file's .idx inventory.
+
+    Parameters:
+    - file_url (str): URL of the GRIB file. The inventory is expected at file_url + '.idx'.
+    - local_file_path (str): Path of the local GRIB file to write.
+    - patterns (list): Inventory patterns of the messages to keep (see GRIB_SUBSET_PATTERNS).
+
+    Returns:
+    - int: Number of bytes downloaded, or None if no inventory or no matching message was found.
+    """
+    try:
+        with urllib.request.urlopen(file_url + '.idx') as response:
+            ranges = select_grib_ranges(parse_grib_idx(response.read().decode('utf-8')), patterns)
+    except urllib.error.HTTPError:
+        return None
+    if not ranges:
+        return None
+
+    def read_range(start, end):
+        request = urllib.request.Request(file_url, headers={'Range': _byte_range(start, end)})
+        with urllib.request.urlopen(request) as response:
+            if response.status != 206:
+                raise IOError(f"Server ignored the byte range request for {file_url}.")
+            return response.read()
+
+    return _write_grib_subset(local_file_path, ranges, read_range)
+
+def download_grb2_subset_s3(s3, bucket_name, key, local_file_path, patterns):
+    """
+    Downloads only the GRIB messages matching the patterns from S3, using the object's .idx inventory.
+
+    Parameters:
+    - s3 (boto3 S3 client): Client used for the ranged GET requests.
+    - bucket_name (str): Name of the bucket.
+    - key (str): Key of the GRIB object. The inventory is expected at key + '.idx'.
+    - local_file_path (str): Path of the local GRIB file to write.
+    - patterns (list): Inventory patterns of the messages to keep (see GRIB_SUBSET_PATTERNS).
+
+    Returns:
+    - int: Number of bytes downloaded, or None if no inventory or no matching message was found.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        idx_text = s3.get_object(Bucket=bucket_name, Key=key + '.idx')['Body'].read().decode('utf-8')
+    except ClientError:
+        return None
+    ranges = select_grib_ranges(parse_grib_idx(idx_text), patterns)
+    if not ranges:
+        return None
+
+    def read_range(start, end):
+        return s3.get_object(Bucket=bucket_name, Key=key, Range=_byte_range(start, end))['Body'].read()
+
+    return _write_grib_subset(local_file_path, ranges, read_range)
+
+def _listing_version(link):
+    """
+    Return the version token of a file from its row in an Apache-style directory listing (the last
+    modified date and size columns), or '' if the listing has no such columns.
+    """
+    row = link.find_parent('tr')
+    if row is None:
+        return ''
+    cells = [cell.get_text(' ', strip=True) for cell in row.find_all('td') if cell.find('a') is None]
+    return ' '.join(cell for cell in cells if cell)
+
+def download_grb2_ncei(product, url_path, download_dir, subset=False, patterns=None, cache=None):
     """
     Downloads GRB2 CFS forecast files from the National Centers for Environmental Information (NCEI).
 
@@ -16,10 +177,20 @@ def download_grb2_ncei(product, url_path, download_dir):
     product (str): The product type (e.g., 'pgbf', 'flxf') used to filter GRB2 files.
     url_path (str): The URL path to the NCEI directory containing the GRB2 files.
     download_dir (str): The local directory where the files should be downloaded.
+    subset (bool): Only download the GRIB messages used by the forecast, using the .idx inventories
+        with HTTP Range requests. Files without an inventory are downloaded in full. Default = False.
+    patterns (list, optional): Inventory patterns of the messages to keep. Default = None (GRIB_SUBSET_PATTERNS).
+    cache (GribCache, optional): Local cache to reuse files already fetched. Files are validated against the
+        last modified date and size of their row in the directory listing, or against the ETag (or
+        Last-Modified) and size from a HEAD request if the listing has no such columns. Default = None
+        (always download).
 
     Returns:
     None
     """
+    # Imported here so only the download stage loads the HTTP and HTML parsing stack
+    from bs4 import BeautifulSoup
+    import requests
 
     try:
         response = urllib.request.urlopen(url_path)
@@ -31,14 +202,35 @@ def download_grb2_ncei(product, url_path, download_dir):
             file_url = url_path + link['href']
             filename = link['href'].split('/')[-1]
             file_path = os.path.join(download_dir, filename)
-            urllib.request.urlretrieve(file_url, file_path)
+
+            def fetch_file(path):
+                # Download only the needed messages if requested, otherwise the whole file
+                if not (subset and download_grb2_subset_http(file_url, path, _subset_patterns(product, patterns)) is not None):
+                    urllib.request.urlretrieve(file_url, path)
+                _count_download(path)
+
+            if cache is not None:
+                # The listing already gives the version of the file, so a cached copy needs no request
+                etag, size = _listing_version(link), 0
+                if not etag:
+                    head = requests.head(file_url, allow_redirects=True)
+                    etag = head.headers.get('ETag') or head.headers.get('Last-Modified', '')
+                    size = int(head.headers.get('Content-Length', 0))
+                cached_path, hit = cache.fetch(file_url, etag, size, fetch_file, _cache_variant(product, subset, patterns))
+                link_cached_file(cached_path, file_path)
+                metrics.count('cache_hits' if hit else 'cache_misses')
+                print(f"{'Found in cache' if hit else 'Downloaded'}: {filename}")
+                continue
+
+            fetch_file(file_path)
             print(f"Downloaded: {filename}")
 
     except Exception as e:
         print(f"ERROR: {e}")
+        log_skip('download_errors', e, url=url_path, product=product)
 
 
-def download_grb2_aws(product, bucket_name, url_path, download_dir):
+def download_grb2_aws(product, bucket_name, url_path, download_dir, subset=False, patterns=None, endpoint_url=None, cache=None):
     """
     Download the CFS forecast from AWS
 
@@ -47,12 +239,22 @@ def download_grb2_aws(product, bucket_name, url_path, download_dir):
     - bucket_name: for CFS data it is 'noaa-cfs-pds'
     - url_path: the url path to data
     - download_dir: location to download data to
+    - subset: only download the GRIB messages used by the forecast, using the .idx inventories with
+      ranged GET requests. Objects without an inventory are downloaded in full. Default = False
+    - patterns: inventory patterns of the messages to keep. Default = None (GRIB_SUBSET_PATTERNS)
+    - endpoint_url: S3 endpoint to use instead of AWS (e.g. a local S3-compatible server). Default = None
+    - cache: GribCache used to skip objects already fetched (validated by ETag and size). Default = None
     """
+    # Imported here so only the download stage loads the AWS SDK
+    import boto3
+    from botocore import UNSIGNED
+    from botocore.client import Config
+
     num_files_downloaded = 0
 
     # Create a boto3 client for S3
     s3_config = Config(signature_version=UNSIGNED)
-    s3 = boto3.client('s3', config=s3_config)
+    s3 = boto3.client('s3', config=s3_config, endpoint_url=endpoint_url)
 
     # List all objects in the specified folder path
     continuation_token = None
@@ -82,12 +284,112 @@ def download_grb2_aws(product, bucket_name, url_path, download_dir):
             # Ensure the directory structure exists
             os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
 
-            # Download the file
-            s3.download_file(bucket_name, key, local_file_path)
+            def fetch_object(path):
+                # Download only the needed messages if requested, otherwise the whole file
+                if not (subset and download_grb2_subset_s3(s3, bucket_name, key, path, _subset_patterns(product, patterns)) is not None):
+                    s3.download_file(bucket_name, key, path)
+                _count_download(path)
+
+            if cache is not None:
+                cached_path, hit = cache.fetch(f"s3://{bucket_name}/{key}", obj.get('ETag', '').strip('"'), obj.get('Size', 0), fetch_object,
+                                               _cache_variant(product, subset, patterns))
+                link_cached_file(cached_path, local_file_path)
+                metrics.count('cache_hits' if hit else 'cache_misses')
+                if hit:
+                    print(f"Found in cache: {key}")
+                    continue
+            else:
+                fetch_object(local_file_path)
             num_files_downloaded += 1
 
             print(f"Downloaded: {key}")
 
+def download_cfs_run(date, download_path, source='aws', bucket_name='noaa-cfs-pds', products=('pgb', 'flx'),
+                     subset=False, cache=None, endpoint_url=None):
+    """
+    Downloads the monthly-mean GRIB files of one CFS run from AWS or NCEI.
+
+    Parameters:
+    - date (datetime): The CFS run (year, month, day and hour).
+    - download_path (str): Directory the files are downloaded to.
+    - source (str): 'aws' or 'ncei'. Default = 'aws'
+    - bucket_name (str): AWS bucket holding the CFS data. Default = 'noaa-cfs-pds'
+    - products (tuple): Products to download. Default = ('pgb', 'flx')
+    - subset (bool): Only download the GRIB messages used by the forecast. Default = False
+    - cache (GribCache, optional): Local cache to reuse files already fetched. Default = None
+    - endpoint_url (str, optional): S3 endpoint to use instead of AWS. Default = None
+
+    Returns:
+    - bool: False if the run is not available from the source, True otherwise.
+    """
+    YYYY, MM, DD, HH = date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"), date.strftime("%H")
+    os.makedirs(download_path, exist_ok=True)
+
+    if source == 'aws':
+        url_path = f'cfs.{YYYY}{MM}{DD}/{HH}/monthly_grib_01/'
+        with metrics.stage('download'):
+            for product in products:
+                download_grb2_aws(product, bucket_name, url_path, download_path, subset=subset, endpoint_url=endpoint_url, cache=cache)
+    elif source == 'ncei':
+        base_url = 'https://www.ncei.noaa.gov/data/climate-forecast-system/access/operational-9-month-forecast/monthly-means/'
+        url_path = f'{base_url}/{YYYY}/{YYYY}{MM}/{YYYY}{MM}{DD}/{YYYY}{MM}{DD}{HH}/'
+        if not check_url_exists(url_path):
+            print(f"No files available for {date}. Skipping.")
+            log_skip('runs_unavailable', cfs_run=date.strftime('%Y%m%d%H'), source=source)
+            return False
+        with metrics.stage('download'):
+            for product in products:
+                download_grb2_ncei(product, url_path, download_path, subset=subset, cache=cache)
+    else:
+        raise ValueError("ERROR: Input source does not exist. Source must be aws or ncei.")
+
+    return True
+
+def cfs_run_available(date, source='aws', bucket_name='noaa-cfs-pds', products=('pgb', 'flx'), endpoint_url=None):
+    """
+    Checks whether the monthly-mean GRIB files of one CFS run are published, without downloading them.
+
+    On AWS the run is only reported as available once every product lists the same, non-zero number of
+    GRIB files, so a run whose files are still being uploaded is picked up on a later check.
+
+    Parameters:
+    - date (datetime): The CFS run (year, month, day and hour).
+    - source (str): 'aws' or 'ncei'. Default = 'aws'
+    - bucket_name (str): AWS bucket holding the CFS data. Default = 'noaa-cfs-pds'
+    - products (tuple): Products the run must provide. Default = ('pgb', 'flx')
+    - endpoint_url (str, optional): S3 endpoint to use instead of AWS. Default = None
+
+    Returns:
+    - bool: True if the run can be downloaded, False otherwise.
+    """
+    YYYY, MM, DD, HH = date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"), date.strftime("%H")
+
+    if source == 'aws':
+        import boto3
+        from botocore import UNSIGNED
+        from botocore.client import Config
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        s3 = boto3.client('s3', config=Config(signature_version=UNSIGNED), endpoint_url=endpoint_url)
+        url_path = f'cfs.{YYYY}{MM}{DD}/{HH}/monthly_grib_01/'
+        counts = []
+        try:
+            paginator = s3.get_paginator('list_objects_v2')
+            for product in products:
+                count = 0
+                for page in paginator.paginate(Bucket=bucket_name, Prefix=url_path + product):
+                    count += sum(1 for obj in page.get('Contents', []) if obj['Key'].endswith('grib.grb2'))
+                counts.append(count)
+        except (BotoCoreError, ClientError) as e:
+            print(f"ERROR occurred while listing the CFS run {date}: {e}")
+            return False
+        return len(set(counts)) == 1 and counts[0] > 0
+    elif source == 'ncei':
+        base_url = 'https://www.ncei.noaa.gov/data/climate-forecast-system/access/operational-9-month-forecast/monthly-means/'
+        return check_url_exists(f'{base_url}/{YYYY}/{YYYY}{MM}/{YYYY}{MM}{DD}/{YYYY}{MM}{DD}{HH}/')
+    else:
+        raise ValueError("ERROR: Input source does not exist. Source must be aws or ncei.")
+
 def check_url_exists(url):
     """
     Check if a URL exists by sending a HEAD request.
@@ -98,6 +400,8 @@ def check_url_exists(url):
     Returns:
     - bool: True if the URL returns a status code 200 (OK), False otherwise.
     """
+    import requests
+
     try:
         response = requests.head(url, allow_redirects=True)  # Allow redirects in case of URL redirection
         # Check if the response is OK (status code 200)
@@ -108,13 +412,115 @@ def check_url_exists(url):
         return False
     
 
-def open_cfs_db(database):
+# Lookup tables of the compact schema, with the codes of the known names (new names get the next code)
+CFS_CODE_TABLES = {
+    'lake': ('cfs_lakes', 'lake_id', ['superior', 'erie', 'ontario', 'michigan-huron']),
+    'surface_type': ('cfs_surface_types', 'surface_id', ['lake', 'land']),
+    'component': ('cfs_components', 'component_id', ['precipitation', 'evaporation', 'air_temperature']),
+}
+
+# Table holding the integer-coded rows of the compact schema
+CFS_COMPACT_TABLE = 'cfs_forecast_compact'
+
+def is_compact_cfs_db(conn, table='cfs_forecast_data'):
+    """
+    Checks whether `table` is the compatibility view of the compact schema.
+
+    Parameters:
+    - conn (sqlite3.Connection): An open connection to the database.
+    - table (str): Name of the CFS table or view. Default = 'cfs_forecast_data'.
+
+    Returns:
+    - bool: True if `table` is a view over the compact table.
+    """
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+    return row is not None and row[0] == 'view'
+
+def _create_compact_schema(cursor, table='cfs_forecast_data'):
+    """
+    Creates the compact CFS schema: the code lookup tables, the integer-coded table and a
+    view named `table` that exposes the original long columns. INSTEAD OF triggers on the view
+    translate inserts and deletes, so existing queries and writers keep working unchanged.
+    """
+    for column, (code_table, code_column, names) in CFS_CODE_TABLES.items():
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {code_table} (
+            {code_column} INTEGER PRIMARY KEY,
+            {column} TEXT UNIQUE NOT NULL
+        )
+        ''')
+        cursor.executemany(f'INSERT OR IGNORE INTO {code_table} ({code_column}, {column}) VALUES (?, ?)',
+                           list(enumerate(names)))
+
+    # WITHOUT ROWID stores the rows in the primary key b-tree, so there is no separate rowid table
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS {CFS_COMPACT_TABLE} (
+        cfs_run INTEGER,
+        year INTEGER,
+        month INTEGER,
+        lake_id INTEGER,
+        surface_id INTEGER,
+        component_id INTEGER,
+        "value [mm]" REAL,
+        PRIMARY KEY (cfs_run, year, month, lake_id, surface_id, component_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{CFS_COMPACT_TABLE}_valid ON {CFS_COMPACT_TABLE} (year, month)')
+
+    cursor.execute(f'''
+    CREATE VIEW IF NOT EXISTS {table} AS
+    SELECT d.cfs_run, d.year, d.month, l.lake, s.surface_type, c.component, d."value [mm]"
+    FROM {CFS_COMPACT_TABLE} d
+    JOIN cfs_lakes l ON l.lake_id = d.lake_id
+    JOIN cfs_surface_types s ON s.surface_id = d.surface_id
+    JOIN cfs_components c ON c.component_id = d.component_id
+    ''')
+
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS {table}_insert INSTEAD OF INSERT ON {table}
+    BEGIN
+        -- New names are only added when missing: an outer INSERT OR REPLACE overrides the conflict
+        -- clause of the statements below, and replacing a lookup row would change its code
+        INSERT INTO cfs_lakes (lake) SELECT NEW.lake WHERE NOT EXISTS (SELECT 1 FROM cfs_lakes WHERE lake = NEW.lake);
+        INSERT INTO cfs_surface_types (surface_type) SELECT NEW.surface_type
+            WHERE NOT EXISTS (SELECT 1 FROM cfs_surface_types WHERE surface_type = NEW.surface_type);
+        INSERT INTO cfs_components (component) SELECT NEW.component
+            WHERE NOT EXISTS (SELECT 1 FROM cfs_components WHERE component = NEW.component);
+        INSERT OR REPLACE INTO {CFS_COMPACT_TABLE} (cfs_run, year, month, lake_id, surface_id, component_id, "value [mm]")
+        VALUES (
+            NEW.cfs_run, NEW.year, NEW.month,
+            (SELECT lake_id FROM cfs_lakes WHERE lake = NEW.lake),
+            (SELECT surface_id FROM cfs_surface_types WHERE surface_type = NEW.surface_type),
+            (SELECT component_id FROM cfs_components WHERE component = NEW.component),
+            NEW."value [mm]"
+        );
+    END
+    ''')
+
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS {table}_delete INSTEAD OF DELETE ON {table}
+    BEGIN
+        DELETE FROM {CFS_COMPACT_TABLE}
+        WHERE cfs_run = OLD.cfs_run AND year = OLD.year AND month = OLD.month
+          AND lake_id = (SELECT lake_id FROM cfs_lakes WHERE lake = OLD.lake)
+          AND surface_id = (SELECT surface_id FROM cfs_surface_types WHERE surface_type = OLD.surface_type)
+          AND component_id = (SELECT component_id FROM cfs_components WHERE component = OLD.component);
+    END
+    ''')
+
+def open_cfs_db(database, compact=False):
     """
     Opens a connection to the database. If the database does not exist, it creates a new one.
     It also creates a table `forecast_data` if it does not already exist.
 
+    With `compact=True` a new database uses the compact schema instead: lake, surface type and
+    component are stored as small integer codes in `cfs_forecast_compact`, and `cfs_forecast_data`
+    is a view with the original columns (see `migrate_cfs_db` to convert an existing database).
+    A database already in the compact schema is opened as such whatever the value of `compact`.
+
     Parameters:
     - database (str): The path to the SQLite database file.
+    - compact (bool): Create the compact schema for a new database. Default = False.
 
     Returns:
     - conn (sqlite3.Connection): The connection object to the database.
@@ -129,19 +535,27 @@ def open_cfs_db(database):
         conn = sqlite3.connect(database)
         cursor = conn.cursor()
 
-        # Create the forecast_data table if it doesn't exist
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cfs_forecast_data (
-            cfs_run INTEGER,
-            year INTEGER,
-            month INTEGER,
-            lake TEXT,
-            surface_type TEXT,
-            component TEXT,
-            "value [mm]" REAL,
-            PRIMARY KEY (cfs_run, year, month, lake, surface_type, component)
-        )
-        ''')
+        exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'cfs_forecast_data'").fetchone() is not None
+        if is_compact_cfs_db(conn) or (compact and not exists):
+            _create_compact_schema(cursor)
+        else:
+            # Create the forecast_data table if it doesn't exist
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cfs_forecast_data (
+                cfs_run INTEGER,
+                year INTEGER,
+                month INTEGER,
+                lake TEXT,
+                surface_type TEXT,
+                component TEXT,
+                "value [mm]" REAL,
+                PRIMARY KEY (cfs_run, year, month, lake, surface_type, component)
+            )
+            ''')
+
+            # Index on the forecast month so loaders can filter on the valid date in SQL (databases created
+            # before it was added get it the next time they are opened)
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_cfs_forecast_data_valid ON cfs_forecast_data (year, month)')
 
         # Commit the changes (though nothing to commit here since it's a table creation)
         conn.commit()
@@ -153,6 +567,479 @@ def open_cfs_db(database):
         print(f"ERROR opening/creating database: {e}")
         return None, None
 
+def migrate_cfs_db(database, table='cfs_forecast_data', keep_legacy=False, vacuum=True):
+    """
+    Migrates an existing long `cfs_forecast_data` table to the compact integer-coded schema.
+
+    The rows are copied into `cfs_forecast_compact` in one transaction, the original table is
+    dropped (or renamed to '<table>_legacy') and replaced by a view of the same name, so existing
+    queries, `CFSWriter` and the notebooks keep working on the migrated database.
+
+    Parameters:
+    - database (str): Path to the SQLite database file.
+    - table (str): Name of the long CFS table. Default = 'cfs_forecast_data'.
+    - keep_legacy (bool): Keep the original table as '<table>_legacy' instead of dropping it. Default = False.
+    - vacuum (bool): Run VACUUM afterwards to give the freed pages back to the file system. Default = True.
+
+    Returns:
+    - dict: Number of rows migrated and the database size in bytes before and after.
+
+    Raises:
+    - ValueError: If the database has no such table or it is already migrated.
+    - sqlite3.DatabaseError: If the migration fails (the database is left unchanged).
+    """
+    if not os.path.exists(database):
+        raise ValueError(f"ERROR: Database '{database}' does not exist.")
+
+    size_before = os.path.getsize(database)
+    conn = sqlite3.connect(database)
+    try:
+        if is_compact_cfs_db(conn, table):
+            raise ValueError(f"ERROR: '{table}' is already in the compact schema.")
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is None:
+            raise ValueError(f"ERROR: Table '{table}' does not exist in '{database}'.")
+
+        legacy = f'{table}_legacy'
+        try:
+            with conn:
+                # Explicit transaction so the schema changes are rolled back too on error
+                conn.execute('BEGIN')
+                conn.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+                conn.execute(f'DROP INDEX IF EXISTS idx_{table}_valid')
+                cursor = conn.cursor()
+                _create_compact_schema(cursor, table)
+
+                # Register every name in use, then copy the rows with their codes
+                for column, (code_table, _, _) in CFS_CODE_TABLES.items():
+                    conn.execute(f'INSERT OR IGNORE INTO {code_table} ({column}) SELECT DISTINCT {column} FROM {legacy}')
+                conn.execute(f'''
+                INSERT OR REPLACE INTO {CFS_COMPACT_TABLE} (cfs_run, year, month, lake_id, surface_id, component_id, "value [mm]")
+                SELECT o.cfs_run, o.year, o.month, l.lake_id, s.surface_id, c.component_id, o."value [mm]"
+                FROM {legacy} o
+                JOIN cfs_lakes l ON l.lake = o.lake
+                JOIN cfs_surface_types s ON s.surface_type = o.surface_type
+                JOIN cfs_components c ON c.component = o.component
+                ''')
+                num_rows = conn.execute(f'SELECT COUNT(*) FROM {CFS_COMPACT_TABLE}').fetchone()[0]
+
+                if not keep_legacy:
+                    conn.execute(f'DROP TABLE {legacy}')
+        except sqlite3.DatabaseError as e:
+            raise sqlite3.DatabaseError(f"Database error occurred during the migration: {e}")
+
+        if vacuum:
+            conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+    size_after = os.path.getsize(database)
+    print(f"Migrated {num_rows} rows to the compact schema ({size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB).")
+    return {'rows': num_rows, 'bytes_before': size_before, 'bytes_after': size_after}
+
+
+# Primary keys of the CNBS forecast tables (the layout written by the forecast notebook)
+CNBS_FORECAST_KEY = ['cfs_run', 'year', 'month', 'model', 'lake', 'component']
+CNBS_MODEL_MEAN_KEY = ['year', 'month', 'model', 'lake', 'component']
+
+# Table of the ensemble statistics of each forecast month (see `src.ensemble_utils`)
+CNBS_SUMMARY_TABLE = 'cnbs_forecast_summary'
+
+def _ensure_primary_key(conn, table, create_sql, columns):
+    """
+    Creates `table`, or rebuilds a table created without a primary key (e.g. by `DataFrame.to_sql`).
+    Duplicated keys are collapsed to the row inserted last.
+    """
+    info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+    if info and any(column[5] for column in info):
+        return
+    if not info:
+        conn.execute(create_sql.format(table=table))
+        return
+
+    print(f"Adding a primary key to '{table}' (duplicated rows are removed).")
+    quoted = ', '.join(f'"{column}"' for column in columns)
+    conn.execute(f'ALTER TABLE "{table}" RENAME TO "{table}_old"')
+    conn.execute(create_sql.format(table=table))
+    conn.execute(f'INSERT OR REPLACE INTO "{table}" ({quoted}) SELECT {quoted} FROM "{table}_old" ORDER BY rowid')
+    conn.execute(f'DROP TABLE "{table}_old"')
+
+def open_cnbs_db(database, table='cnbs_forecast', mean_table='cnbs_forecast_model_mean', summary_table=CNBS_SUMMARY_TABLE):
+    """
+    Opens the CNBS forecast database, creating the forecast, model mean, ensemble summary and watermark tables.
+
+    The forecast tables are keyed on their natural keys so forecasts can be upserted. Tables written
+    by earlier versions of the forecast step (appended without a key) are rebuilt with one, keeping the
+    latest row of each key.
+
+    Parameters:
+    - database (str): The path to the SQLite database file.
+    - table (str): Name of the forecast table. Default = 'cnbs_forecast'.
+    - mean_table (str): Name of the model mean table. Default = 'cnbs_forecast_model_mean'.
+    - summary_table (str): Name of the ensemble summary table. Default = 'cnbs_forecast_summary'.
+
+    Returns:
+    - conn (sqlite3.Connection): The connection object to the database.
+    - cursor (sqlite3.Cursor): The cursor object to execute SQL commands.
+    """
+    try:
+        if not os.path.exists(database):
+            print(f"Creating new database: '{database}'.")
+
+        conn = sqlite3.connect(database)
+        with conn:
+            conn.execute('BEGIN')
+            _ensure_primary_key(conn, table, '''
+            CREATE TABLE "{table}" (
+                cfs_run INTEGER,
+                month INTEGER,
+                year INTEGER,
+                model TEXT,
+                lake TEXT,
+                component TEXT,
+                "value [mm]" REAL,
+                "value [cms]" REAL,
+                PRIMARY KEY (cfs_run, year, month, model, lake, component)
+            )
+            ''', ['cfs_run', 'month', 'year', 'model', 'lake', 'component', 'value [mm]', 'value [cms]'])
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table}_valid" ON "{table}" (year, month)')
+
+            _ensure_primary_key(conn, mean_table, '''
+            CREATE TABLE "{table}" (
+                year INTEGER,
+                month INTEGER,
+                model TEXT,
+                lake TEXT,
+                component TEXT,
+                "value [mm]" REAL,
+                "value [cms]" REAL,
+                PRIMARY KEY (year, month, model, lake, component)
+            )
+            ''', ['year', 'month', 'model', 'lake', 'component', 'value [mm]', 'value [cms]'])
+
+            # Ensemble statistics of each forecast month, over all models ('all') and per model
+            conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS "{summary_table}" (
+                year INTEGER,
+                month INTEGER,
+                model TEXT,
+                lake TEXT,
+                component TEXT,
+                statistic TEXT,
+                members INTEGER,
+                "value [mm]" REAL,
+                "value [cms]" REAL,
+                PRIMARY KEY (year, month, model, lake, component, statistic)
+            )
+            ''')
+
+            # Last CFS run predicted by each model
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS cnbs_forecast_watermarks (
+                model TEXT PRIMARY KEY,
+                last_cfs_run INTEGER,
+                updated TEXT
+            )
+            ''')
+
+        return conn, conn.cursor()
+
+    except sqlite3.Error as e:
+        print(f"ERROR opening/creating database: {e}")
+        return None, None
+
+def get_forecast_watermarks(conn):
+    """
+    Returns the last CFS run predicted by each model.
+
+    Parameters:
+    - conn (sqlite3.Connection): An open connection to the CNBS forecast database.
+
+    Returns:
+    - dict: Model name -> last predicted CFS run (YYYYMMDDHH integer).
+    """
+    return dict(conn.execute('SELECT model, last_cfs_run FROM cnbs_forecast_watermarks').fetchall())
+
+def set_forecast_watermarks(conn, watermarks):
+    """
+    Records the last CFS run predicted by each model.
+
+    Parameters:
+    - conn (sqlite3.Connection): An open connection to the CNBS forecast database.
+    - watermarks (dict): Model name -> last predicted CFS run (YYYYMMDDHH integer).
+    """
+    now = datetime.now().isoformat(timespec='seconds')
+    conn.executemany('''
+    INSERT OR REPLACE INTO cnbs_forecast_watermarks (model, last_cfs_run, updated) VALUES (?, ?, ?)
+    ''', [(model, int(cfs_run), now) for model, cfs_run in watermarks.items()])
+
+def get_forecast_months(conn, table='cnbs_forecast', since_run=None):
+    """
+    Returns the forecast months already predicted by each model, for the CFS runs at or after `since_run`.
+
+    Parameters:
+    - conn (sqlite3.Connection): An open connection to the CNBS forecast database.
+    - table (str): Name of the forecast table. Default = 'cnbs_forecast'.
+    - since_run (int, optional): First CFS run (YYYYMMDDHH). Default = None (every run).
+
+    Returns:
+    - dict: Model name -> set of (cfs_run, year, month).
+    """
+    where, params = ('WHERE cfs_run >= ?', [int(since_run)]) if since_run is not None else ('', [])
+    predicted = {}
+    for model, cfs_run, year, month in conn.execute(f'SELECT DISTINCT model, cfs_run, year, month FROM "{table}" {where}', params):
+        predicted.setdefault(model, set()).add((cfs_run, year, month))
+    return predicted
+
+def upsert_cnbs_forecast(conn, df, table='cnbs_forecast', mean_table='cnbs_forecast_model_mean', watermarks=None):
+    """
+    Upserts CNBS forecasts and refreshes the model means of the forecast months they touch.
+
+    The forecasts, the model means and the watermarks are written in one transaction, so a run is
+    either fully recorded or not at all and re-running a forecast never duplicates rows. Only the
+    (year, month) groups present in `df` are recomputed in the mean table.
+
+    Parameters:
+    - conn (sqlite3.Connection): An open connection to the CNBS forecast database (see `open_cnbs_db`).
+    - df (pd.DataFrame): Forecasts with the 'model', 'lake', 'component', 'value [mm]' and 'value [cms]'
+      columns, indexed by 'cfs_run', 'month' and 'year'.
+    - table (str): Name of the forecast table. Default = 'cnbs_forecast'.
+    - mean_table (str): Name of the model mean table. Default = 'cnbs_forecast_model_mean'.
+    - watermarks (dict, optional): Model name -> last predicted CFS run to record. Default = None.
+
+    Returns:
+    - list: The (year, month) groups whose model means were updated.
+
+    Raises:
+    - sqlite3.DatabaseError: If there is an error interacting with the database.
+    """
+    data = df.reset_index()
+    columns = ['cfs_run', 'month', 'year', 'model', 'lake', 'component', 'value [mm]', 'value [cms]']
+    rows = list(zip(data['cfs_run'].astype(int).tolist(), data['month'].astype(int).tolist(), data['year'].astype(int).tolist(),
+                    data['model'].astype(str).tolist(), data['lake'].astype(str).tolist(), data['component'].astype(str).tolist(),
+                    data['value [mm]'].astype(float).tolist(), data['value [cms]'].astype(float).tolist()))
+    groups = sorted(set(zip(data['year'].astype(int).tolist(), data['month'].astype(int).tolist())))
+    quoted = ', '.join(f'"{column}"' for column in columns)
+
+    try:
+        with conn:
+            conn.executemany(f'INSERT OR REPLACE INTO "{table}" ({quoted}) VALUES ({", ".join("?" * len(columns))})', rows)
+
+            # Recompute the means of the affected forecast months only
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS affected_months (year INTEGER, month INTEGER, PRIMARY KEY (year, month))')
+            conn.execute('DELETE FROM affected_months')
+            conn.executemany('INSERT INTO affected_months (year, month) VALUES (?, ?)', groups)
+            conn.execute(f'DELETE FROM "{mean_table}" WHERE (year, month) IN (SELECT year, month FROM affected_months)')
+            conn.execute(f'''
+            INSERT INTO "{mean_table}" (year, month, model, lake, component, "value [mm]", "value [cms]")
+            SELECT year, month, model, lake, component, ROUND(AVG("value [mm]"), 3), ROUND(AVG("value [cms]"), 3)
+            FROM "{table}"
+            WHERE (year, month) IN (SELECT year, month FROM affected_months)
+            GROUP BY year, month, model, lake, component
+            ''')
+
+            if watermarks:
+                set_forecast_watermarks(conn, watermarks)
+    except sqlite3.DatabaseError as e:
+        raise sqlite3.DatabaseError(f"Database error occurred: {e}")
+
+    return groups
+
+def upsert_ensemble_summary(conn, summary, months, summary_table=CNBS_SUMMARY_TABLE):
+    """
+    Replaces the ensemble statistics of some forecast months in one transaction.
+
+    Parameters:
+    - conn (sqlite3.Connection): An open connection to the CNBS forecast database (see `open_cnbs_db`).
+    - summary (pd.DataFrame): Statistics from `src.ensemble_utils.compute_ensemble_statistics`.
+    - months (list): The (year, month) forecast months replaced (months without statistics are cleared).
+    - summary_table (str): Name of the summary table. Default = 'cnbs_forecast_summary'.
+
+    Raises:
+    - sqlite3.DatabaseError: If there is an error interacting with the database.
+    """
+    columns = ['year', 'month', 'model', 'lake', 'component', 'statistic', 'members', 'value [mm]', 'value [cms]']
+    rows = list(zip(summary['year'].astype(int).tolist(), summary['month'].astype(int).tolist(),
+                    summary['model'].astype(str).tolist(), summary['lake'].astype(str).tolist(),
+                    summary['component'].astype(str).tolist(), summary['statistic'].astype(str).tolist(),
+                    summary['members'].astype(int).tolist(), summary['value [mm]'].astype(float).tolist(),
+                    summary['value [cms]'].astype(float).tolist()))
+    quoted = ', '.join(f'"{column}"' for column in columns)
+
+    try:
+        with conn:
+            conn.executemany(f'DELETE FROM "{summary_table}" WHERE year = ? AND month = ?', [(int(year), int(month)) for year, month in months])
+            conn.executemany(f'INSERT INTO "{summary_table}" ({quoted}) VALUES ({", ".join("?" * len(columns))})', rows)
+    except sqlite3.DatabaseError as e:
+        raise sqlite3.DatabaseError(f"Database error occurred: {e}")
+
+
+class CFSWriter:
+    """
+    Buffered writer session for CFS basin averages.
+
+    Rows are validated and buffered in memory, then written with a single `executemany`
+    inside one transaction per flush. By default a flush happens at the end of every CFS run
+    (see `end_run`) and when the writer is closed, so a run costs one commit instead of one
+    connect/commit cycle per value. Work that must only happen once rows are in the database
+    (e.g. appending them to an archive) is registered with `after_commit`.
+
+    Parameters:
+    - database (str): Path to the SQLite database file.
+    - table (str): Name of the table the rows are inserted into. Default = 'cfs_forecast_data'.
+    - runs_per_commit (int): Number of CFS runs to buffer before committing. Default = 1.
+    - wal (bool): Switch the database to write-ahead logging. WAL needs shared memory between
+      processes, so only use it when every reader and writer runs on the same host. Default = False.
+    - synchronous (str, optional): SQLite `synchronous` level ('OFF', 'NORMAL', 'FULL' or 'EXTRA').
+      'NORMAL' is safe with WAL and avoids an fsync per commit. Default = None (SQLite default).
+
+    Example:
+    with CFSWriter(database, 'cfs_forecast_data', runs_per_commit=4, wal=True, synchronous='NORMAL') as writer:
+        process_grib_files(download_dir, database, 'cfs_forecast_data', cfs_run, ..., writer=writer)
+    """
+
+    def __init__(self, database, table='cfs_forecast_data', runs_per_commit=1, wal=False, synchronous=None):
+        if not isinstance(runs_per_commit, int) or runs_per_commit < 1:
+            raise ValueError("ERROR: runs_per_commit must be a positive integer.")
+        if synchronous is not None and str(synchronous).upper() not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError("ERROR: synchronous must be 'OFF', 'NORMAL', 'FULL' or 'EXTRA'.")
+
+        self.database = database
+        self.table = table
+        self.runs_per_commit = runs_per_commit
+        self.wal = wal
+        self.synchronous = synchronous
+        self.rows = []
+        self.rows_written = 0
+        self._runs_pending = 0
+        self._after_commit = []
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Do not commit a partially buffered run if an error escaped
+            self.rows = []
+            self._after_commit = []
+            self.close()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.database)
+            if self.wal:
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            if self.synchronous is not None:
+                self._conn.execute(f'PRAGMA synchronous={str(self.synchronous).upper()}')
+        return self._conn
+
+    def add(self, cfs_run, year, month, lake, surface_type, component, value):
+        """
+        Validate a record and add it to the buffer.
+
+        Parameters:
+        cfs_run (str): The CFS run identifier.
+        year (int): Forecast year (2024, 2025, etc.).
+        month (int): Forecast month (should be between 1 and 12).
+        lake (str): The lake related to the data.
+        surface_type (str): Surface type over 'lake' or 'land'.
+        component (str): NBS Component ('precipitation', 'evaporation', 'runoff', or 'cnbs').
+        value (float): The value in millimeters [mm].
+
+        Raises:
+        ValueError: If year is not an integer, month is not between 1 and 12, or any other input is invalid.
+        """
+        if not isinstance(year, int):
+            raise ValueError(f"ERROR: Year must be an integer.")
+        if not (1 <= month <= 12):
+            raise ValueError(f"ERROR: Month must be between 1 and 12.")
+        if not isinstance(cfs_run, str) or not isinstance(lake, str) or not isinstance(surface_type, str) or not isinstance(component, str):
+            raise ValueError("ERROR: cfs_run, lake, surface type, and CNBS must be strings.")
+        if not isinstance(value, (float, int)):
+            raise ValueError(f"ERROR: Value must be a numeric type.")
+
+        self.rows.append((cfs_run, year, month, lake, surface_type, component, value))
+
+    def extend(self, rows):
+        """
+        Validate and buffer several records at once.
+
+        Parameters:
+        rows (iterable): Tuples of (cfs_run, year, month, lake, surface_type, component, value).
+        """
+        for row in rows:
+            self.add(*row)
+
+    def after_commit(self, callback):
+        """
+        Register a function to call once the rows buffered so far are committed.
+
+        The callbacks run in order after the next successful flush. They are dropped without being
+        called if the buffered rows are discarded because an error escaped the writer session.
+
+        Parameters:
+        callback (callable): Called without arguments.
+        """
+        self._after_commit.append(callback)
+
+    def end_run(self):
+        """Mark the end of a CFS run and commit if `runs_per_commit` runs are buffered."""
+        self._runs_pending += 1
+        if self._runs_pending >= self.runs_per_commit:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered rows in a single transaction.
+
+        Returns:
+        int: The number of rows written.
+
+        Raises:
+        sqlite3.DatabaseError: If there is an error interacting with the database.
+        """
+        self._runs_pending = 0
+        if not self.rows:
+            self._run_after_commit()
+            return 0
+
+        query = f'''
+        INSERT OR REPLACE INTO {self.table} (
+            cfs_run, year, month, lake, surface_type, component, "value [mm]"
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        '''
+
+        try:
+            conn = self._connect()
+            # The connection context manager commits on success and rolls back on error
+            with metrics.stage('db_write'), conn:
+                conn.executemany(query, self.rows)
+        except sqlite3.DatabaseError as e:
+            raise sqlite3.DatabaseError(f"Database error occurred: {e}")
+
+        num_rows = len(self.rows)
+        self.rows_written += num_rows
+        metrics.count('rows_written', num_rows)
+        self.rows = []
+        self._run_after_commit()
+        return num_rows
+
+    def _run_after_commit(self):
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        """Flush any buffered rows and close the database connection."""
+        try:
+            self.flush()
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
 
 def pull_from_db(database, table, cfs_run, year, month, lake, surface_type, component):
     """
@@ -183,7 +1070,7 @@ def pull_from_db(database, table, cfs_run, year, month, lake, surface_type, comp
         '''
 
         # Execute the query with the provided parameters
-        cursor.execute(query, (cfs_run, year, month, lake, surface_type, cnbs))
+        cursor.execute(query, (cfs_run, year, month, lake, surface_type, component))
 
         # Fetch the result (None if not found)
         result = cursor.fetchone()
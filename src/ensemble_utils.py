@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+
+from src.database_utils import CNBS_SUMMARY_TABLE, upsert_ensemble_summary
+from src.hydro_utils import lake_surface_areas, seconds_in_months
+
+# Quantiles of the ensemble written to the summary table (the 95% band of the forecast plots)
+ENSEMBLE_QUANTILES = (0.025, 0.975)
+
+# Model name of the statistics over every model and CFS run
+ENSEMBLE_ALL = 'all'
+
+def quantile_name(quantile):
+    """Returns the statistic name of a quantile, e.g. 'q0.025'."""
+    return f'q{quantile:g}'
+
+def forecast_cube(df):
+    """
+    Arranges long-format forecasts into a (run, model, forecast month, target) cube.
+
+    Parameters:
+    - df (pd.DataFrame): Forecasts with the 'cfs_run', 'year', 'month', 'model', 'lake', 'component' and
+      'value [mm]' columns (or index levels), as in the cnbs_forecast table.
+
+    Returns:
+    - dict: 'cube' (np.ndarray of shape (runs, models, months, targets), NaN where a run did not forecast
+      a month), 'runs', 'models', 'months' ((year, month) tuples) and 'targets' ((lake, component) tuples).
+    """
+    data = df.reset_index() if any(name in ('cfs_run', 'year', 'month') for name in df.index.names) else df
+
+    runs, run_codes = np.unique(data['cfs_run'].to_numpy(dtype=np.int64), return_inverse=True)
+    models, model_codes = np.unique(data['model'].astype(str).to_numpy(), return_inverse=True)
+    month_keys, month_codes = np.unique(data['year'].to_numpy(dtype=np.int64) * 12 + data['month'].to_numpy(dtype=np.int64) - 1,
+                                        return_inverse=True)
+    target_keys, target_codes = np.unique(data['lake'].astype(str).to_numpy() + '|' + data['component'].astype(str).to_numpy(),
+                                          return_inverse=True)
+
+    cube = np.full((len(runs), len(models), len(month_keys), len(target_keys)), np.nan)
+    cube[run_codes, model_codes, month_codes, target_codes] = data['value [mm]'].to_numpy(dtype=np.float64)
+
+    return {'cube': cube, 'runs': runs.tolist(), 'models': models.tolist(),
+            'months': [(int(key) // 12, int(key) % 12 + 1) for key in month_keys],
+            'targets': [tuple(key.split('|')) for key in target_keys]}
+
+def member_statistics(values, quantiles=ENSEMBLE_QUANTILES):
+    """
+    Computes the statistics of every column of a (members, cells) array in a few vectorized passes, ignoring NaN.
+
+    The members are sorted once; the median, the quantiles (linear interpolation, as `pd.Series.quantile`),
+    the minimum and the maximum are all read from the sorted array.
+
+    Parameters:
+    - values (np.ndarray): 2D array with the ensemble members on the first axis.
+    - quantiles (tuple): Quantiles to compute. Default = ENSEMBLE_QUANTILES.
+
+    Returns:
+    - dict: Statistic name ('members', 'mean', 'median', 'std', 'min', 'max' and one 'q<quantile>' per
+      quantile) mapped to a 1D array with one value per cell. 'std' uses one degree of freedom, as pandas.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    safe_counts = np.maximum(counts, 1)
+
+    mean = np.where(valid, values, 0).sum(axis=0) / safe_counts
+    squares = np.where(valid, values - mean, 0) ** 2
+    std = np.sqrt(squares.sum(axis=0) / np.maximum(counts - 1, 1))
+
+    # NaN are sorted last, so the valid members of each cell are the first `counts` rows
+    ordered = np.sort(values, axis=0)
+    levels = np.array([0.5, 0.0, 1.0] + list(quantiles))
+    positions = levels[:, None] * (safe_counts - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, safe_counts - 1)
+    low_values = np.take_along_axis(ordered, lower, axis=0)
+    high_values = np.take_along_axis(ordered, upper, axis=0)
+    order_statistics = low_values + (high_values - low_values) * (positions - lower)
+
+    empty = counts == 0
+    statistics = {'members': counts, 'mean': mean, 'median': order_statistics[0], 'std': np.where(counts > 1, std, np.nan),
+                  'min': order_statistics[1], 'max': order_statistics[2]}
+    for quantile, row in zip(quantiles, order_statistics[3:]):
+        statistics[quantile_name(quantile)] = row
+    for name in statistics:
+        if name != 'members':
+            statistics[name] = np.where(empty, np.nan, statistics[name])
+    return statistics
+
+def compute_ensemble_statistics(df, quantiles=ENSEMBLE_QUANTILES):
+    """
+    Computes the ensemble statistics of each forecast month and target, over every model and run ('all')
+    and over the runs of each model.
+
+    Parameters:
+    - df (pd.DataFrame): Forecasts as in the cnbs_forecast table (see `forecast_cube`).
+    - quantiles (tuple): Quantiles to compute. Default = ENSEMBLE_QUANTILES.
+
+    Returns:
+    - pd.DataFrame: One row per forecast month, model, target and statistic with the 'year', 'month', 'model',
+      'lake', 'component', 'statistic', 'members', 'value [mm]' and 'value [cms]' columns.
+    """
+    columns = ['year', 'month', 'model', 'lake', 'component', 'statistic', 'members', 'value [mm]', 'value [cms]']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    arranged = forecast_cube(df)
+    cube = arranged['cube']
+    num_runs, num_models, num_months, num_targets = cube.shape
+
+    # Cells are (model, month, target), with the 'all' ensemble as model 0
+    pooled = member_statistics(cube.reshape(num_runs * num_models, num_months * num_targets), quantiles)
+    per_model = member_statistics(cube.reshape(num_runs, num_models * num_months * num_targets), quantiles)
+    statistics = {name: np.concatenate([pooled[name], per_model[name]]) for name in pooled}
+
+    models = np.array([ENSEMBLE_ALL] + arranged['models'])
+    years = np.array([year for year, _ in arranged['months']])
+    months = np.array([month for _, month in arranged['months']])
+    lakes = np.array([lake for lake, _ in arranged['targets']])
+    components = np.array([component for _, component in arranged['targets']])
+
+    num_cells = len(models) * num_months * num_targets
+    model_index = np.repeat(np.arange(len(models)), num_months * num_targets)
+    month_index = np.tile(np.repeat(np.arange(num_months), num_targets), len(models))
+    target_index = np.tile(np.arange(num_targets), len(models) * num_months)
+
+    names = [name for name in statistics if name != 'members']
+    values = np.concatenate([statistics[name] for name in names])
+    cell = np.tile(np.arange(num_cells), len(names))
+
+    summary = pd.DataFrame({
+        'year': years[month_index][cell],
+        'month': months[month_index][cell],
+        'model': models[model_index][cell],
+        'lake': lakes[target_index][cell],
+        'component': components[target_index][cell],
+        'statistic': np.repeat(names, num_cells),
+        'members': statistics['members'][cell],
+        'value [mm]': values,
+    })
+    # Every statistic scales linearly with the value, so it converts to m3/s like a forecast
+    summary['value [cms]'] = (values / 1000) * lake_surface_areas(summary['lake']) / seconds_in_months(summary['year'], summary['month'])
+    return summary[summary['members'] > 0].reset_index(drop=True)[columns]
+
+def update_ensemble_summary(conn, months=None, quantiles=ENSEMBLE_QUANTILES, table='cnbs_forecast', summary_table=CNBS_SUMMARY_TABLE):
+    """
+    Recomputes the ensemble statistics of some forecast months from the forecast table and stores them in the summary table.
+
+    The forecast months are read and summarized one at a time, so the memory used follows the forecasts of
+    one month, not the size of the forecast table.
+
+    Parameters:
+    - conn (sqlite3.Connection): An open connection to the CNBS forecast database (see `open_cnbs_db`).
+    - months (list, optional): (year, month) forecast months to update. Default = None (every month of the forecast table).
+    - quantiles (tuple): Quantiles to compute. Default = ENSEMBLE_QUANTILES.
+    - table (str): The CNBS forecast table. Default = 'cnbs_forecast'.
+    - summary_table (str): The summary table. Default = 'cnbs_forecast_summary'.
+
+    Returns:
+    - pd.DataFrame: The statistics written.
+    """
+    if months is None:
+        months = conn.execute(f'SELECT DISTINCT year, month FROM "{table}"').fetchall()
+    months = sorted(set((int(year), int(month)) for year, month in months))
+
+    query = f'SELECT cfs_run, year, month, model, lake, component, "value [mm]" FROM "{table}" WHERE year = ? AND month = ?'
+    summaries = []
+    for year, month in months:
+        summary = compute_ensemble_statistics(pd.read_sql(query, conn, params=(year, month)), quantiles)
+        upsert_ensemble_summary(conn, summary, [(year, month)], summary_table)
+        summaries.append(summary)
+
+    if not summaries:
+        return compute_ensemble_statistics(pd.DataFrame())
+    return pd.concat(summaries, ignore_index=True)
+
+def read_ensemble_summary(conn, statistics=None, models=None, valid_from=None, summary_table=CNBS_SUMMARY_TABLE):
+    """
+    Reads ensemble statistics from the summary table.
+
+    Parameters:
+    - conn (sqlite3.Connection): An open connection to the CNBS forecast database.
+    - statistics (list, optional): Statistics to read, e.g. ['mean', 'q0.025']. Default = None (all).
+    - models (list, optional): Models to read ('all' for the whole ensemble). Default = None (all).
+    - valid_from (tuple, optional): First (year, month) forecast month to read. Default = None (all).
+    - summary_table (str): The summary table. Default = 'cnbs_forecast_summary'.
+
+    Returns:
+    - pd.DataFrame: The statistics, sorted by forecast month, model, lake, component and statistic.
+    """
+    conditions, params = [], []
+    for column, wanted in (('statistic', statistics), ('model', models)):
+        if wanted is not None:
+            conditions.append(f'{column} IN ({", ".join("?" * len(wanted))})')
+            params += list(wanted)
+    if valid_from is not None:
+        conditions.append('(year, month) >= (?, ?)')
+        params += [int(valid_from[0]), int(valid_from[1])]
+    where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+    return pd.read_sql(f'SELECT * FROM "{summary_table}"{where} ORDER BY year, month, model, lake, component, statistic',
+                       conn, params=params)
+
+def summary_wide(summary, statistic, model=ENSEMBLE_ALL, unit='value [mm]'):
+    """
+    Pivots one statistic of one model to the layout of the forecast plots: one row per forecast month and
+    one '<lake>_<component>' column per target.
+
+    Parameters:
+    - summary (pd.DataFrame): Statistics read with `read_ensemble_summary`.
+    - statistic (str): The statistic, e.g. 'mean' or 'q0.975'.
+    - model (str): The model, or 'all' for the whole ensemble. Default = 'all'.
+    - unit (str): 'value [mm]' or 'value [cms]'. Default = 'value [mm]'.
+
+    Returns:
+    - pd.DataFrame: The statistic indexed by 'year' and 'month'.
+    """
+    rows = summary[(summary['statistic'] == statistic) & (summary['model'] == model)]
+    wide = rows.assign(column=rows['lake'] + '_' + rows['component']).pivot(index=['year', 'month'], columns='column', values=unit)
+    wide.columns.name = None
+    return wide
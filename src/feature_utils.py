@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# File name of the feature schema saved next to the scalers
+FEATURE_SCHEMA_FILE = 'feature_schema.json'
+
+def lagged_column_names(columns, lag=0, lead=0):
+    """
+    Returns the names of the lagged and lead columns, in the order of `shift_variables`:
+    the base columns, then for each column its lags ('_mo-1', ...) followed by its leads ('_mo1', ...).
+    """
+    names = list(columns)
+    for column in columns:
+        names += [f'{column}_mo-{lag_month}' for lag_month in range(1, lag + 1)]
+        names += [f'{column}_mo{lead_month}' for lead_month in range(1, lead + 1)]
+    return names
+
+def lagged_matrix(values, lag=0, lead=0):
+    """
+    Builds the lagged/lead design matrix of a time series in one pass.
+
+    The series is padded with NaN, viewed as sliding windows of lag + lead + 1 rows (no copy) and
+    the shifted values are gathered straight into a preallocated output array.
+
+    Parameters:
+    - values (np.ndarray): 2D array with one row per time step and one column per variable.
+    - lag (int): Number of months of lagged variables. Default = 0.
+    - lead (int): Number of months of lead variables. Default = 0.
+
+    Returns:
+    - np.ndarray: Array of shape (time, variables * (1 + lag + lead)), columns ordered as `lagged_column_names`.
+      Rows without a value for a lag or lead hold NaN.
+    """
+    if not isinstance(lag, int) or not isinstance(lead, int) or lag < 0 or lead < 0:
+        raise ValueError("ERROR: lag and lead must be non-negative integers.")
+
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 2:
+        raise ValueError("ERROR: values must be a 2D array (time, variables).")
+
+    num_steps, num_columns = values.shape
+    num_shifts = lag + lead
+    out = np.empty((num_steps, num_columns * (1 + num_shifts)))
+    out[:, :num_columns] = values
+    if num_shifts == 0:
+        return out
+
+    padded = np.full((num_steps + num_shifts, num_columns), np.nan)
+    padded[lag:lag + num_steps] = values
+
+    # windows[t, c, w] is the value of column c at time t - lag + w
+    windows = sliding_window_view(padded, num_shifts + 1, axis=0)
+    offsets = np.r_[lag - np.arange(1, lag + 1), lag + np.arange(1, lead + 1)]
+    out[:, num_columns:].reshape(num_steps, num_columns, num_shifts)[:] = windows[:, :, offsets]
+    return out
+
+def month_one_hot(months):
+    """Returns the (rows, 12) one-hot encoding of an array of months (1 to 12)."""
+    months = np.asarray(months, dtype=np.int64)
+    encoded = np.zeros((len(months), 12))
+    encoded[np.arange(len(months)), months - 1] = 1
+    return encoded
+
+def _index_months(index):
+    """Returns the month of each row, from a DatetimeIndex or a 'month' index level."""
+    if isinstance(index, pd.DatetimeIndex):
+        return index.month.to_numpy()
+    if 'month' in (index.names or []):
+        return index.get_level_values('month').to_numpy()
+    raise ValueError("ERROR: The index must be a DatetimeIndex or have a 'month' level to one-hot encode the month.")
+
+class FeatureSchema:
+    """
+    Description of the model input features: the base variables, the lags and leads built from
+    them and whether the month is one-hot encoded.
+
+    The schema is saved as JSON next to the scalers when the models are trained, and checked at
+    inference so the input columns always line up with the training columns.
+
+    Parameters:
+    - base_columns (list): Names of the base variables, in order.
+    - lag (int): Number of months of lagged variables. Default = 0.
+    - lead (int): Number of months of lead variables. Default = 0.
+    - month_one_hot (bool): Append the 'month_1' ... 'month_12' columns. Default = True.
+
+    Example:
+    schema = FeatureSchema(base_columns, lag=6)
+    X = schema.build(df)
+    schema.save(os.path.join(input_dir, FEATURE_SCHEMA_FILE))
+    """
+
+    def __init__(self, base_columns, lag=0, lead=0, month_one_hot=True):
+        if not isinstance(lag, int) or not isinstance(lead, int) or lag < 0 or lead < 0:
+            raise ValueError("ERROR: lag and lead must be non-negative integers.")
+        self.base_columns = list(base_columns)
+        self.lag = lag
+        self.lead = lead
+        self.month_one_hot = month_one_hot
+
+    @property
+    def columns(self):
+        """The feature columns, in the order the models expect them."""
+        months = [f'month_{i}' for i in range(1, 13)] if self.month_one_hot else []
+        return lagged_column_names(self.base_columns, self.lag, self.lead) + months
+
+    @property
+    def fingerprint(self):
+        """Short hash of the feature columns, to tell schemas apart."""
+        return hashlib.sha1('\n'.join(self.columns).encode('utf-8')).hexdigest()[:12]
+
+    def to_dict(self):
+        return {'base_columns': self.base_columns, 'lag': self.lag, 'lead': self.lead,
+                'month_one_hot': self.month_one_hot, 'columns': self.columns, 'fingerprint': self.fingerprint}
+
+    def save(self, path):
+        """Write the schema to a JSON file (atomically)."""
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a schema saved with `save`.
+
+        Raises:
+        - ValueError: If the saved columns do not match the ones rebuilt from the schema settings.
+        """
+        with open(path) as f:
+            data = json.load(f)
+        schema = cls(data['base_columns'], data['lag'], data['lead'], data['month_one_hot'])
+        if data.get('columns', schema.columns) != schema.columns:
+            raise ValueError(f"ERROR: The feature schema in '{path}' is inconsistent.")
+        return schema
+
+    def build(self, df, dropna=True):
+        """
+        Build the design matrix from a DataFrame of base variables with one row per month.
+
+        Parameters:
+        - df (pd.DataFrame): The base variables (any extra column is ignored), indexed by date or by a 'month' level.
+        - dropna (bool): Drop the rows with missing values (e.g. the first `lag` and last `lead` months). Default = True.
+
+        Returns:
+        - pd.DataFrame: The features, with `columns` as columns and the index of `df`.
+        """
+        missing = [column for column in self.base_columns if column not in df.columns]
+        if missing:
+            raise ValueError(f"ERROR: Missing base columns for the feature schema: {missing}")
+
+        values = lagged_matrix(df[self.base_columns].to_numpy(dtype=np.float64), self.lag, self.lead)
+        if self.month_one_hot:
+            values = np.hstack([values, month_one_hot(_index_months(df.index))])
+
+        features = pd.DataFrame(values, columns=self.columns, index=df.index)
+        if dropna:
+            features = features[~np.isnan(values).any(axis=1)]
+        return features
+
+    def check(self, X, x_scaler=None):
+        """
+        Check an input matrix against the schema (and the scaler it was fitted with) and return it
+        with its columns in schema order.
+
+        Parameters:
+        - X (pd.DataFrame): The input features.
+        - x_scaler (scaler, optional): The input scaler; its `feature_names_in_` must match the schema.
+
+        Returns:
+        - pd.DataFrame: X with the schema columns in order (X itself if they already are).
+
+        Raises:
+        - ValueError: If columns are missing or unexpected, or the scaler was fitted on other features.
+        """
+        columns = self.columns
+        if x_scaler is not None and hasattr(x_scaler, 'feature_names_in_') and list(x_scaler.feature_names_in_) != columns:
+            raise ValueError("ERROR: The input scaler was not fitted on the features of the schema.")
+
+        if list(X.columns) == columns:
+            return X
+        missing = [column for column in columns if column not in X.columns]
+        extra = [column for column in X.columns if column not in set(columns)]
+        if missing or extra:
+            raise ValueError(f"ERROR: The input features do not match the feature schema (missing: {missing}, unexpected: {extra}).")
+        return X[columns]
+
+def feature_schema_path(x_scaler_path):
+    """Returns the path of the feature schema saved next to a scaler file."""
+    return os.path.join(os.path.dirname(os.path.abspath(x_scaler_path)), FEATURE_SCHEMA_FILE)
@@ -3,6 +3,17 @@ import numpy as np
 import pandas as pd
 
 
+# Surface area (in square meters) of each lake
+LAKE_SURFACE_AREA = {
+    'superior': 82097 * 1000000,       # Lake Superior area in square meters
+    'michigan-huron': (57753 + 59560) * 1000000,  # Lake Michigan-Huron combined area in square meters
+    'erie': 25655 * 1000000,           # Lake Erie area in square meters
+    'ontario': 19009 * 1000000         # Lake Ontario area in square meters
+}
+
+# Number of days in each month of a non-leap year
+_DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
 def seconds_in_month(year, month):
     """
     Calculate the number of seconds in a given month of a specific year.
@@ -50,19 +61,15 @@ def calculate_grid_cell_areas(lon, lat):
     R = 6371000.0
     
     # Convert latitude to radians
-    lat_rad = np.radians(lat)
+    lat_rad = np.radians(np.ma.getdata(lat))
     
     # Calculate grid cell width in radians
     dlat = np.radians(lat[1] - lat[0])
     dlon = np.radians(lon[1] - lon[0])
     
-    # Initialize the area array
-    area = np.zeros((len(lat), len(lon)))
-    
-    # Calculate area of each grid cell in square meters
-    for i in range(len(lat)):
-        for j in range(len(lon)):
-            area[i, j] = R**2 * dlat * dlon * np.cos(lat_rad[i])
+    # Calculate area of each grid cell in square meters, broadcasting cos(lat) over the longitudes
+    area = np.empty((len(lat), len(lon)))
+    area[:] = (R**2 * dlat * dlon * np.cos(lat_rad))[:, np.newaxis]
     
     return area
 
@@ -97,6 +104,49 @@ def calculate_evaporation(temperature_K, latent_heat):
 
     return evaporation_rate
 
+def lake_surface_areas(lakes):
+    """
+    Look up the surface area of each lake in an array.
+
+    Parameters:
+    lakes (array-like): Lake names ('superior', 'michigan-huron', 'erie' or 'ontario').
+
+    Returns:
+    numpy.ndarray: The surface areas in square meters (0 for unknown lakes).
+    """
+    return pd.Series(pd.Categorical(np.asarray(lakes))).map(LAKE_SURFACE_AREA).astype(float).fillna(0).to_numpy()
+
+def seconds_in_months(years, months):
+    """
+    Calculate the number of seconds in each month of arrays of years and months.
+
+    Parameters:
+    years (array-like): The years.
+    months (array-like): The months (1-12).
+
+    Returns:
+    numpy.ndarray: The number of seconds in each month.
+
+    Raises:
+    ValueError: If any month is not between 1 and 12.
+    """
+    years = np.asarray(years, dtype=np.int64)
+    months = np.asarray(months, dtype=np.int64)
+    if np.any((months < 1) | (months > 12)):
+        raise ValueError("ERROR: Month must be between 1 and 12.")
+
+    leap = ((years % 4 == 0) & (years % 100 != 0)) | (years % 400 == 0)
+    num_days = _DAYS_IN_MONTH[months - 1] + ((months == 2) & leap)
+
+    return num_days * 24 * 60 * 60
+
+def _index_years_months(df):
+    """Return the year and month arrays of a DataFrame index (by level name, else positions 2 and 1)."""
+    names = list(df.index.names)
+    years = df.index.get_level_values('year' if 'year' in names else 2)
+    months = df.index.get_level_values('month' if 'month' in names else 1)
+    return years, months
+
 def convert_mm_to_cms(df):
     """
     Converts the 'value [mm]' in the dataframe to 'value [cms]' (cubic meters per second) based on lake surface area and the number of seconds in the month.
@@ -107,24 +157,28 @@ def convert_mm_to_cms(df):
     Returns:
     - pd.DataFrame: DataFrame with a new column 'value [cms]' representing the value in cubic meters per second.
     """
+    years, months = _index_years_months(df)
 
-    # Dictionary storing the surface area (in square meters) for each lake
-    lake_sa = {
-        'superior': 82097 * 1000000,       # Lake Superior area in square meters
-        'michigan-huron': (57753 + 59560) * 1000000,  # Lake Michigan-Huron combined area in square meters
-        'erie': 25655 * 1000000,           # Lake Erie area in square meters
-        'ontario': 19009 * 1000000         # Lake Ontario area in square meters
-    }
-    
-    # Apply the conversion formula for each row in the dataframe
-    df['value [cms]'] = df.apply(
-        lambda row: (
-            # Convert mm to meters, multiply by the lake surface area, and divide by seconds in the given month
-            (row['value [mm]'] / 1000) * lake_sa.get(row['lake'], 0) / 
-            seconds_in_month(row.name[2], row.name[1])  # seconds_in_month() needs to be defined elsewhere
-        ), axis=1
-    )
+    # Convert mm to meters, multiply by the lake surface area, and divide by seconds in the given month
+    df['value [cms]'] = (df['value [mm]'].to_numpy() / 1000) * lake_surface_areas(df['lake']) / seconds_in_months(years, months)
     
     # Return the modified DataFrame with the new 'value [cms]' column
     return df
 
+def convert_cms_to_mm(df):
+    """
+    Converts the 'value [cms]' (cubic meters per second) in the dataframe back to 'value [mm]' over the lake surface.
+
+    Args:
+    - df (pd.DataFrame): DataFrame containing the columns 'value [cms]', 'lake', and a multi-index with 'month' and 'year'.
+
+    Returns:
+    - pd.DataFrame: DataFrame with a new column 'value [mm]' (NaN for unknown lakes).
+    """
+    years, months = _index_years_months(df)
+    areas = lake_surface_areas(df['lake'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['value [mm]'] = np.where(areas > 0, df['value [cms]'].to_numpy() * seconds_in_months(years, months) / areas * 1000, np.nan)
+
+    return df
@@ -0,0 +1,117 @@
+import numpy as np
+
+from src.hydro_utils import calculate_grid_cell_areas
+
+# Lake of each mask variable prefix
+MASK_LAKES = {'eri': 'erie', 'ont': 'ontario', 'sup': 'superior', 'mih': 'michigan-huron'}
+
+class MaskSet:
+    """
+    The lake/land regions of the GL mask as one stack of weights, so that the basin averages of every
+    region come from a single matrix product.
+
+    The mask variables are read from the netCDF file and checked once. Only the grid cells inside at least
+    one region are kept, and two (region, cell) weight matrices are computed in advance: the area weights
+    of each region normalised to sum to 1 (precipitation and evaporation), and the equal weights of the
+    cells of each region (the mean of the air temperature). A field, or a stack of fields, is then reduced
+    to all the regions with one `tensordot` instead of one pass over the full grid per region.
+
+    Parameters:
+    - mask_ds (netCDF4.Dataset): The GL mask dataset, with 'latitude', 'longitude' and the mask variables
+      (1 inside the region, masked or NaN outside).
+    - mask_variables (list): The mask variables, '<lake abbreviation>_<surface type>' (e.g. 'eri_lake').
+    - area (array, optional): Grid cell areas of the mask grid. Default = None (computed from the mask grid).
+    - dtype (numpy dtype): Type of the weight matrices. Default = np.float32.
+
+    Raises:
+    - ValueError: If a mask variable does not begin with 'eri', 'ont', 'sup' or 'mih', or selects no cell.
+
+    Example:
+    masks = MaskSet(mask_ds, mask_variables, area)
+    pcp_mm = masks.area_mean(pcp_remap) * 4 * num_days
+    for (lake, surface_type), value in zip(masks.regions, pcp_mm):
+        writer.add(cfs_run, year, month, lake, surface_type, 'precipitation', value)
+    """
+
+    def __init__(self, mask_ds, mask_variables, area=None, dtype=np.float32):
+        self.mask_variables = list(mask_variables)
+        self.latitude = np.asarray(mask_ds.variables['latitude'][:])
+        self.longitude = np.asarray(mask_ds.variables['longitude'][:])
+        area = np.asarray(area if area is not None else calculate_grid_cell_areas(self.longitude, self.latitude), dtype=np.float64)
+
+        self.regions = []
+        for mask_var in self.mask_variables:
+            lake_abv, surface_type = mask_var.split('_')
+            lake = MASK_LAKES.get(lake_abv)
+            if lake is None:
+                raise ValueError(f"ERROR: The mask variables need to begin with 'eri', 'ont', 'sup', or 'mih'. Check the mask file.")
+            self.regions.append((lake, surface_type))
+
+        # Region membership of every grid cell, as in the masked products of the mask values
+        masks = np.stack([np.ma.filled(np.ma.masked_invalid(mask_ds.variables[mask_var][:]).astype(np.float64), 0.0)
+                          for mask_var in self.mask_variables])
+        self.shape = masks.shape[1:]
+        support = masks != 0
+        if not support.any(axis=(1, 2)).all():
+            empty = [mask_var for mask_var, inside in zip(self.mask_variables, support.any(axis=(1, 2))) if not inside]
+            raise ValueError(f"ERROR: The mask variables {empty} select no grid cell. Check the mask file.")
+
+        # Only the cells inside a region take part in the reductions
+        self.cells = np.flatnonzero(support.any(axis=0))
+        masks = masks.reshape(len(masks), -1)[:, self.cells]
+        self.support = support.reshape(len(masks), -1)[:, self.cells]
+
+        weighted = masks * area.reshape(-1)[self.cells]
+        self.area_weights = (weighted / weighted.sum(axis=1, keepdims=True)).astype(dtype)
+        self.mean_weights = (self.support / self.support.sum(axis=1, keepdims=True)).astype(dtype)
+
+    @classmethod
+    def from_file(cls, mask_file, mask_variables, dtype=np.float32):
+        """Reads the mask variables of a GL mask netCDF file into a MaskSet."""
+        import netCDF4 as nc
+
+        with nc.Dataset(mask_file) as mask_ds:
+            return cls(mask_ds, mask_variables, dtype=dtype)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def _reduce(self, weights, field):
+        values = np.asarray(field)
+        if values.shape[-2:] != self.shape:
+            raise ValueError(f"ERROR: Field shape {values.shape[-2:]} does not match the mask grid {self.shape}.")
+        # The sums are accumulated in float64 whatever the type of the field and the weights
+        values = values.reshape(values.shape[:-2] + (-1,))[..., self.cells].astype(np.float64)
+
+        missing = np.isnan(values)
+        if not missing.any():
+            return np.tensordot(values, weights.T, axes=1)
+
+        # A missing value only spoils the regions it lies in
+        result = np.tensordot(np.where(missing, 0.0, values), weights.T, axes=1)
+        spoiled = np.tensordot(missing.astype(np.float64), self.support.T.astype(np.float64), axes=1) > 0
+        return np.where(spoiled, np.nan, result)
+
+    def area_mean(self, field):
+        """
+        Area-weighted mean of a field over every region.
+
+        Parameters:
+        - field (np.ndarray): A field on the mask grid, or a stack of fields (..., lat, lon).
+
+        Returns:
+        - np.ndarray: The means, with the last two dimensions replaced by the regions (float64).
+        """
+        return self._reduce(self.area_weights, field)
+
+    def mean(self, field):
+        """
+        Mean of a field over the cells of every region (each cell counts the same, as the air temperature).
+
+        Parameters:
+        - field (np.ndarray): A field on the mask grid, or a stack of fields (..., lat, lon).
+
+        Returns:
+        - np.ndarray: The means, with the last two dimensions replaced by the regions (float64).
+        """
+        return self._reduce(self.mean_weights, field)
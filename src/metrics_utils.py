@@ -0,0 +1,152 @@
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# Logger of the pipeline events; the command line configures it, library users can attach their own handlers
+logger = logging.getLogger('cnbs')
+
+# Environment variables turning on the JSON metrics summary and the profiler
+METRICS_ENV = 'CNBS_METRICS'
+PROFILE_ENV = 'CNBS_PROFILE'
+
+class PipelineMetrics:
+    """
+    Stage timers and counters of the ingest and forecast pipeline.
+
+    Stages are timed with `stage`, which accumulates the number of calls, the total and the longest wall time
+    of each stage. Counters (bytes downloaded, rows written, runs skipped, ...) are incremented with `count`.
+    Both are thread-safe, and the snapshot of a worker process can be merged into the parent's with `merge`.
+
+    Example:
+    with metrics.stage('regrid'):
+        pcp_remap = regrid(pcp_cut.values)
+    metrics.count('rows_written', len(rows))
+    metrics.write_json('metrics.json')
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear every timer and counter."""
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def add_time(self, name, seconds, calls=1, max_seconds=None):
+        """Add the wall time of one (or several) calls of a stage."""
+        with self._lock:
+            timer = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            timer['calls'] += calls
+            timer['seconds'] += seconds
+            timer['max_seconds'] = max(timer['max_seconds'], seconds if max_seconds is None else max_seconds)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the block as one call of a stage (the time is recorded even if the block raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.add_time(name, seconds)
+            if logger.isEnabledFor(logging.DEBUG):
+                log_event('stage', level=logging.DEBUG, stage=name, seconds=round(seconds, 6))
+
+    def count(self, name, value=1):
+        """Increment a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        """
+        Returns the timers and counters.
+
+        Returns:
+        - dict: {'started': ISO time of the last reset, 'wall_seconds': seconds since then,
+          'stages': {name: {'calls', 'seconds', 'max_seconds'}}, 'counters': {name: value}}.
+        """
+        with self._lock:
+            return {
+                'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec='seconds'),
+                'wall_seconds': time.time() - self.started,
+                'stages': {name: dict(timer) for name, timer in sorted(self.stages.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def merge(self, snapshot):
+        """Add the timers and counters of a snapshot (e.g. from a worker process)."""
+        for name, timer in snapshot.get('stages', {}).items():
+            self.add_time(name, timer['seconds'], timer['calls'], timer['max_seconds'])
+        for name, value in snapshot.get('counters', {}).items():
+            self.count(name, value)
+
+    def write_json(self, path, **fields):
+        """
+        Writes the snapshot as a JSON file.
+
+        Parameters:
+        - path (str): Path of the JSON file.
+        - **fields: Extra fields of the summary, e.g. the command that ran.
+        """
+        summary = dict(fields, **self.snapshot())
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+# Metrics of the current process, filled in by the ingest, download and forecast functions
+metrics = PipelineMetrics()
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Logs a structured event as one JSON object on the 'cnbs' logger.
+
+    Parameters:
+    - event (str): Name of the event, e.g. 'forecast_month_skipped'.
+    - level (int): Logging level. Default = logging.INFO.
+    - **fields: Fields of the event (CFS run, stage, error, ...).
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps(dict(event=event, **fields), default=str))
+
+def log_skip(event, error=None, **fields):
+    """Counts a skipped run (or forecast month) and logs why, with the error if there is one."""
+    metrics.count(event)
+    log_event(event, level=logging.WARNING, error=repr(error) if error is not None else None, **fields)
+
+@contextlib.contextmanager
+def profiled(name, directory=None):
+    """
+    Profiles the block with cProfile when $CNBS_PROFILE (or `directory`) names a directory.
+
+    The statistics are saved to '<directory>/<name>-<pid>-<time>.prof', to be read with `pstats` or snakeviz.
+    Without a directory the block runs unprofiled, at no cost.
+
+    Parameters:
+    - name (str): Name of the profiled section, e.g. the command.
+    - directory (str, optional): Directory of the profiles. Default = None ($CNBS_PROFILE).
+    """
+    directory = directory or os.environ.get(PROFILE_ENV)
+    if not directory:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}-{os.getpid()}-{datetime.now().strftime('%Y%m%d%H%M%S')}.prof")
+        profiler.dump_stats(path)
+        log_event('profile_saved', path=path)
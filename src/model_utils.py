@@ -0,0 +1,101 @@
+import hashlib
+import os
+import threading
+
+class ModelRegistry:
+    """
+    In-process cache of the trained models and scalers saved with joblib.
+
+    Each artifact is deserialized once and kept in memory. Files exported to '.npz' with
+    `src.numpy_models.export_models` are loaded as NumPy models. On every request the file is checked
+    (by modification time and size, or by content hash) and only reloaded if it changed on disk,
+    so repeated forecasts in a long-running process skip the deserialization entirely.
+
+    Parameters:
+    - validate (str): How to detect a changed file, 'mtime' (modification time and size) or 'hash'
+      (SHA-1 of the file content). Default = 'mtime'.
+    - mmap_mode (str, optional): Memory-map the numpy arrays stored in the artifacts (e.g. 'r'),
+      passed to `joblib.load`. Useful for large numpy-backed models such as the GP. Default = None.
+
+    Example:
+    registry = ModelRegistry(mmap_mode='r')
+    registry.warm_up([x_scaler, y_scaler] + [model['path'] for model in models_info])
+    df_y = predict_cnbs(X, x_scaler, y_scaler, models_info, 'GP', registry=registry)
+    """
+
+    def __init__(self, validate='mtime', mmap_mode=None):
+        if validate not in ('mtime', 'hash'):
+            raise ValueError("ERROR: validate must be 'mtime' or 'hash'.")
+        self.validate = validate
+        self.mmap_mode = mmap_mode
+        self._artifacts = {}
+        self._lock = threading.Lock()
+
+    def _stamp(self, path):
+        """Return the token used to detect that a file changed."""
+        if self.validate == 'hash':
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            return digest.hexdigest()
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path, mmap_mode=None):
+        """
+        Return the artifact saved at `path`, loading it only if it is not cached or changed on disk.
+
+        Parameters:
+        - path (str): Path of the joblib file.
+        - mmap_mode (str, optional): Overrides the registry's mmap_mode for this artifact. Default = None.
+
+        Returns:
+        - The deserialized artifact (scaler or model).
+
+        Raises:
+        - FileNotFoundError: If the file does not exist.
+        """
+        path = os.path.abspath(path)
+        stamp = self._stamp(path)
+
+        with self._lock:
+            cached = self._artifacts.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+
+            if path.endswith('.npz'):
+                # Exported with `src.numpy_models.export_model`: no scikit-learn or TensorFlow needed
+                from src.numpy_models import load_numpy_model
+                artifact = load_numpy_model(path)
+            else:
+                import joblib
+                artifact = joblib.load(path, mmap_mode=mmap_mode or self.mmap_mode)
+            self._artifacts[path] = (stamp, artifact)
+            return artifact
+
+    def warm_up(self, paths):
+        """
+        Load a list of artifacts ahead of the first forecast.
+
+        Parameters:
+        - paths (list): Paths of the joblib files to load.
+
+        Returns:
+        - dict: Path mapped to the loaded artifact.
+        """
+        return {path: self.get(path) for path in paths}
+
+    def clear(self):
+        """Drop every cached artifact."""
+        with self._lock:
+            self._artifacts.clear()
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self._artifacts
+
+    def __len__(self):
+        return len(self._artifacts)
+
+# Registry used by predict_cnbs when no registry is given
+default_registry = ModelRegistry()
@@ -0,0 +1,372 @@
+"""
+Framework-free inference for the trained models.
+
+`export_models` turns the trained scalers and models into plain arrays saved as `.npz` files
+(GP training inputs, `alpha_` and kernel hyperparameters, LR coefficients, NN dense weights), and the
+classes below predict from those arrays with NumPy only. A forecast that uses the exported files
+never imports scikit-learn or TensorFlow.
+"""
+import io
+import json
+import os
+import pickletools
+import shutil
+import zipfile
+import numpy as np
+
+# Rows of X evaluated at once by the GP kernels (bounds the (rows, train, features) temporary)
+_KERNEL_CHUNK = 256
+
+def _save_npz(path, kind, arrays, meta=None):
+    """Save arrays with their model kind and JSON metadata, atomically."""
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, __kind__=np.array(kind), __meta__=np.array(json.dumps(meta or {})), **arrays)
+    os.replace(tmp_path, path)
+
+class NumpyScaler:
+    """Standard scaler (as `sklearn.preprocessing.StandardScaler`) from its mean and scale."""
+
+    kind = 'scaler'
+
+    def __init__(self, mean, scale, feature_names=None):
+        self.mean_ = np.asarray(mean, dtype=np.float64)
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+        if feature_names is not None:
+            self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+
+    @classmethod
+    def from_sklearn(cls, scaler):
+        mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(scaler.n_features_in_)
+        scale = scaler.scale_ if scaler.scale_ is not None else np.ones(scaler.n_features_in_)
+        return cls(mean, scale, getattr(scaler, 'feature_names_in_', None))
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+    def inverse_transform(self, X):
+        return np.asarray(X, dtype=np.float64) * self.scale_ + self.mean_
+
+    def save(self, path):
+        names = getattr(self, 'feature_names_in_', None)
+        _save_npz(path, self.kind, {'mean': self.mean_, 'scale': self.scale_},
+                  {'feature_names': None if names is None else [str(name) for name in names]})
+
+class NumpyLinear:
+    """Linear model (as `sklearn.linear_model.LinearRegression`) from its coefficients and intercept."""
+
+    kind = 'linear'
+
+    def __init__(self, coef, intercept):
+        self.coef_ = np.asarray(coef, dtype=np.float64)
+        self.intercept_ = np.asarray(intercept, dtype=np.float64)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        return cls(model.coef_, model.intercept_)
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64) @ self.coef_.T + self.intercept_
+
+    def save(self, path):
+        _save_npz(path, self.kind, {'coef': self.coef_, 'intercept': self.intercept_})
+
+def _kernel_spec(kernel):
+    """Describe a fitted scikit-learn kernel as a JSON-serializable tree of hyperparameters."""
+    name = type(kernel).__name__
+    params = kernel.get_params(deep=False)
+    if name in ('Sum', 'Product'):
+        return {'type': name, 'k1': _kernel_spec(params['k1']), 'k2': _kernel_spec(params['k2'])}
+    if name == 'Exponentiation':
+        return {'type': name, 'kernel': _kernel_spec(params['kernel']), 'exponent': float(params['exponent'])}
+
+    specs = {
+        'ConstantKernel': ['constant_value'],
+        'WhiteKernel': ['noise_level'],
+        'RBF': ['length_scale'],
+        'Matern': ['length_scale', 'nu'],
+        'RationalQuadratic': ['length_scale', 'alpha'],
+        'ExpSineSquared': ['length_scale', 'periodicity'],
+        'DotProduct': ['sigma_0'],
+    }
+    if name not in specs:
+        raise ValueError(f"ERROR: Kernel '{name}' is not supported by the NumPy export.")
+    return {'type': name, **{key: np.asarray(params[key], dtype=np.float64).tolist() for key in specs[name]}}
+
+def _sq_distances(X, Y, length_scale=1.0):
+    """Squared Euclidean distances between the rows of X and Y, after dividing by the length scale."""
+    X = X / length_scale
+    Y = Y / length_scale
+    return np.sum((X[:, None, :] - Y[None, :, :]) ** 2, axis=-1)
+
+def _evaluate_kernel(spec, X, Y):
+    """Evaluate the kernel described by `spec` between the rows of X and Y (with X distinct from Y)."""
+    kind = spec['type']
+    if kind == 'Sum':
+        return _evaluate_kernel(spec['k1'], X, Y) + _evaluate_kernel(spec['k2'], X, Y)
+    if kind == 'Product':
+        return _evaluate_kernel(spec['k1'], X, Y) * _evaluate_kernel(spec['k2'], X, Y)
+    if kind == 'Exponentiation':
+        return _evaluate_kernel(spec['kernel'], X, Y) ** spec['exponent']
+    if kind == 'ConstantKernel':
+        return np.full((len(X), len(Y)), spec['constant_value'])
+    if kind == 'WhiteKernel':
+        # White noise only adds to the diagonal of K(X, X), never between new and training points
+        return np.zeros((len(X), len(Y)))
+    if kind == 'DotProduct':
+        return X @ Y.T + spec['sigma_0'] ** 2
+
+    length_scale = np.asarray(spec['length_scale'])
+    if kind == 'RBF':
+        return np.exp(-0.5 * _sq_distances(X, Y, length_scale))
+    if kind == 'Matern':
+        dists = np.sqrt(_sq_distances(X, Y, length_scale))
+        nu = spec['nu']
+        if nu == 0.5:
+            return np.exp(-dists)
+        if nu == 1.5:
+            scaled = dists * np.sqrt(3)
+            return (1.0 + scaled) * np.exp(-scaled)
+        if nu == 2.5:
+            scaled = dists * np.sqrt(5)
+            return (1.0 + scaled + scaled ** 2 / 3.0) * np.exp(-scaled)
+        if np.isinf(nu):
+            return np.exp(-0.5 * dists ** 2)
+        raise ValueError(f"ERROR: Matern kernels with nu={nu} are not supported by the NumPy export.")
+    if kind == 'RationalQuadratic':
+        alpha = spec['alpha']
+        return (1 + _sq_distances(X, Y) / (2 * alpha * length_scale ** 2)) ** -alpha
+    if kind == 'ExpSineSquared':
+        dists = np.sqrt(_sq_distances(X, Y))
+        return np.exp(-2 * (np.sin(np.pi / spec['periodicity'] * dists) / length_scale) ** 2)
+    raise ValueError(f"ERROR: Kernel '{kind}' is not supported by the NumPy export.")
+
+class NumpyGaussianProcess:
+    """
+    Gaussian process mean predictor (as `GaussianProcessRegressor.predict`) from the training inputs,
+    the dual coefficients `alpha_`, the target normalization and the fitted kernel hyperparameters.
+    """
+
+    kind = 'gaussian_process'
+
+    def __init__(self, X_train, alpha, kernel, y_mean=0.0, y_std=1.0):
+        self.X_train_ = np.asarray(X_train, dtype=np.float64)
+        self.alpha_ = np.asarray(alpha, dtype=np.float64)
+        self.kernel = kernel
+        self.y_mean = np.asarray(y_mean, dtype=np.float64)
+        self.y_std = np.asarray(y_std, dtype=np.float64)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        return cls(model.X_train_, model.alpha_, _kernel_spec(model.kernel_),
+                   getattr(model, '_y_train_mean', 0.0), getattr(model, '_y_train_std', 1.0))
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.empty((len(X),) + self.alpha_.shape[1:])
+        for start in range(0, len(X), _KERNEL_CHUNK):
+            chunk = X[start:start + _KERNEL_CHUNK]
+            y[start:start + len(chunk)] = _evaluate_kernel(self.kernel, chunk, self.X_train_) @ self.alpha_
+        y = self.y_std * y + self.y_mean
+        if y.ndim == 2 and y.shape[1] == 1:
+            y = y[:, 0]
+        return y
+
+    def save(self, path):
+        _save_npz(path, self.kind, {'X_train': self.X_train_, 'alpha': self.alpha_, 'y_mean': self.y_mean, 'y_std': self.y_std},
+                  {'kernel': self.kernel})
+
+# Activations of the dense layers
+_ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'elu': lambda x: np.where(x > 0, x, np.expm1(x)),
+}
+
+class NumpyMLP:
+    """
+    Feed-forward network of dense layers (as a Keras `Sequential` of `Dense` layers) from its weights,
+    biases and activations. The layers are evaluated in the precision of the weights (float32 for Keras).
+    """
+
+    kind = 'mlp'
+
+    def __init__(self, weights, biases, activations):
+        if not (len(weights) == len(biases) == len(activations)):
+            raise ValueError("ERROR: weights, biases and activations must have one entry per layer.")
+        for activation in activations:
+            if activation not in _ACTIVATIONS:
+                raise ValueError(f"ERROR: Activation '{activation}' is not supported by the NumPy export.")
+        self.weights = [np.asarray(weight) for weight in weights]
+        self.biases = [np.asarray(bias) for bias in biases]
+        self.activations = list(activations)
+
+    @classmethod
+    def from_keras(cls, model):
+        weights, biases, activations = [], [], []
+        for layer in model.layers:
+            if type(layer).__name__ == 'InputLayer':
+                continue
+            if type(layer).__name__ != 'Dense':
+                raise ValueError(f"ERROR: Layer '{type(layer).__name__}' is not supported by the NumPy export.")
+            kernel, bias = layer.get_weights()
+            weights.append(kernel)
+            biases.append(bias)
+            activations.append(layer.get_config()['activation'])
+        return cls(weights, biases, activations)
+
+    @classmethod
+    def from_keras_pickle(cls, path):
+        """
+        Read the dense layers of a Keras model pickled with joblib, without importing Keras.
+
+        Keras 3 pickles a model as its '.keras' archive; the archive is found in the pickle stream
+        (which is only parsed, never unpickled) and its config and weights are read with h5py.
+        """
+        import h5py
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        archives = [arg for _, arg, _ in pickletools.genops(data) if isinstance(arg, bytes) and arg[:4] == b'PK\x03\x04']
+        if not archives:
+            raise ValueError(f"ERROR: No Keras archive found in '{path}'.")
+
+        with zipfile.ZipFile(io.BytesIO(archives[0])) as archive:
+            config = json.loads(archive.read('config.json'))
+            weights_file = io.BytesIO(archive.read('model.weights.h5'))
+
+        layers = [layer for layer in config['config']['layers'] if layer['class_name'] != 'InputLayer']
+        for layer in layers:
+            if layer['class_name'] != 'Dense':
+                raise ValueError(f"ERROR: Layer '{layer['class_name']}' is not supported by the NumPy export.")
+
+        with h5py.File(weights_file, 'r') as f:
+            # The weights are stored per layer as 'dense', 'dense_1', ... in the order of the layers
+            groups = sorted(f['layers'], key=lambda name: int(name.rsplit('_', 1)[1]) if name[-1].isdigit() else 0)
+            weights = [f['layers'][name]['vars']['0'][()] for name in groups]
+            biases = [f['layers'][name]['vars']['1'][()] for name in groups]
+
+        if len(weights) != len(layers):
+            raise ValueError(f"ERROR: The weights in '{path}' do not match the layers of the model.")
+        return cls(weights, biases, [layer['config']['activation'] for layer in layers])
+
+    def predict(self, X):
+        y = np.asarray(X, dtype=self.weights[0].dtype)
+        for weight, bias, activation in zip(self.weights, self.biases, self.activations):
+            y = _ACTIVATIONS[activation](y @ weight + bias)
+        return y
+
+    def save(self, path):
+        arrays = {f'weight_{i}': weight for i, weight in enumerate(self.weights)}
+        arrays.update({f'bias_{i}': bias for i, bias in enumerate(self.biases)})
+        _save_npz(path, self.kind, arrays, {'activations': self.activations})
+
+def load_numpy_model(path):
+    """
+    Load a scaler or model exported with `export_model`.
+
+    Parameters:
+    - path (str): Path of the '.npz' file.
+
+    Returns:
+    - NumpyScaler, NumpyLinear, NumpyGaussianProcess or NumpyMLP: The model, with `predict` (or `transform`).
+    """
+    with np.load(path, allow_pickle=False) as data:
+        kind = str(data['__kind__'])
+        meta = json.loads(str(data['__meta__']))
+        if kind == 'scaler':
+            return NumpyScaler(data['mean'], data['scale'], meta.get('feature_names'))
+        if kind == 'linear':
+            return NumpyLinear(data['coef'], data['intercept'])
+        if kind == 'gaussian_process':
+            return NumpyGaussianProcess(data['X_train'], data['alpha'], meta['kernel'], data['y_mean'], data['y_std'])
+        if kind == 'mlp':
+            num_layers = len(meta['activations'])
+            return NumpyMLP([data[f'weight_{i}'] for i in range(num_layers)],
+                            [data[f'bias_{i}'] for i in range(num_layers)], meta['activations'])
+    raise ValueError(f"ERROR: Unknown model kind '{kind}' in '{path}'.")
+
+def to_numpy_model(model):
+    """
+    Convert a trained scaler or model to its NumPy equivalent.
+
+    Supported: StandardScaler, linear models with `coef_`/`intercept_`, GaussianProcessRegressor
+    and Keras Sequential models of Dense layers.
+
+    Raises:
+    - ValueError: If the model type is not supported (e.g. tree ensembles).
+    """
+    name = type(model).__name__
+    if hasattr(model, 'mean_') and hasattr(model, 'scale_'):
+        return NumpyScaler.from_sklearn(model)
+    if name == 'GaussianProcessRegressor':
+        return NumpyGaussianProcess.from_sklearn(model)
+    if hasattr(model, 'coef_') and hasattr(model, 'intercept_'):
+        return NumpyLinear.from_sklearn(model)
+    if hasattr(model, 'layers') and hasattr(model, 'get_weights'):
+        return NumpyMLP.from_keras(model)
+    raise ValueError(f"ERROR: Model type '{name}' is not supported by the NumPy export.")
+
+def export_model(path, output_path):
+    """
+    Export a joblib scaler or model to a '.npz' file for `load_numpy_model`.
+
+    Keras models are read from the pickled archive directly when Keras is not installed.
+
+    Parameters:
+    - path (str): Path of the joblib file.
+    - output_path (str): Path of the '.npz' file to write.
+
+    Returns:
+    - The NumPy model that was saved.
+    """
+    import joblib
+
+    try:
+        model = to_numpy_model(joblib.load(path))
+    except ModuleNotFoundError:
+        # The pickle needs a framework that is not installed (e.g. Keras)
+        model = NumpyMLP.from_keras_pickle(path)
+    model.save(output_path)
+    return model
+
+def export_models(x_scaler, y_scaler, models_info, output_dir):
+    """
+    Export the scalers and the trained models to '.npz' files.
+
+    Parameters:
+    - x_scaler (str): Path to the input scaler joblib file.
+    - y_scaler (str): Path to the target scaler joblib file.
+    - models_info (list): A list of dictionaries containing model information ('model' and 'path').
+    - output_dir (str): Directory the '.npz' files are written to.
+
+    Returns:
+    - tuple: (x_scaler path, y_scaler path, models_info) pointing to the exported files, to be passed to
+      `predict_cnbs` / `predict_ensemble`. Models that cannot be exported keep their joblib path.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    def exported_path(path):
+        return os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.npz')
+
+    x_path, y_path = exported_path(x_scaler), exported_path(y_scaler)
+    export_model(x_scaler, x_path)
+    export_model(y_scaler, y_path)
+
+    # Keep the feature schema next to the exported scalers
+    schema_path = os.path.join(os.path.dirname(os.path.abspath(x_scaler)), 'feature_schema.json')
+    if os.path.exists(schema_path):
+        shutil.copy2(schema_path, os.path.join(output_dir, 'feature_schema.json'))
+
+    exported_info = []
+    for model_info in models_info:
+        try:
+            output_path = exported_path(model_info['path'])
+            export_model(model_info['path'], output_path)
+            exported_info.append({**model_info, 'path': output_path})
+        except ValueError as e:
+            print(f"{e} Keeping '{model_info['path']}' for model {model_info['model']}.")
+            exported_info.append(model_info)
+
+    return x_path, y_path, exported_info
@@ -0,0 +1,383 @@
+import os
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
+
+from src.data_processing import process_grib_files, cfs_run_dates, parse_cfs_date, forecast_new_runs, \
+    write_forecast_csv
+from src.database_utils import CFSWriter, download_cfs_run, open_cfs_db, cfs_run_available, get_next_cfs_run
+from src.hydro_utils import calculate_grid_cell_areas
+from src.mask_utils import MaskSet
+from src.metrics_utils import log_skip, metrics
+from src.model_utils import ModelRegistry
+
+# Marks the end of the download queue
+_DONE = object()
+
+def release_cfs_run(download_path, cfs_run, index_dir=None):
+    """
+    Deletes the GRIB files (and their index files) of one CFS run once its rows are committed.
+
+    Parameters:
+    download_path (str): Directory holding the GRIB files of the run.
+    cfs_run (str): The CFS run identifier (YYYYMMDDHH).
+    index_dir (str, optional): Directory of the persistent GRIB index files, if not next to the GRIB files.
+
+    Returns:
+    int: The number of bytes freed.
+    """
+    prefixes = (f'pgbf.01.{cfs_run}', f'flxf.01.{cfs_run}')
+    freed = 0
+    for directory in {download_path, index_dir or download_path}:
+        if not os.path.isdir(directory):
+            continue
+        for filename in os.listdir(directory):
+            if filename.startswith(prefixes):
+                file_path = os.path.join(directory, filename)
+                freed += os.path.getsize(file_path)
+                os.remove(file_path)
+    return freed
+
+def stream_cfs_runs(start, end, download_dir, database, mask_file, mask_variables, table='cfs_forecast_data',
+                    source='aws', bucket_name='noaa-cfs-pds', queue_size=2, delete_files=True, runs_per_commit=1,
+                    subset=False, cache=None, endpoint_url=None, regrid_dir=None, index_dir=None, archive=None):
+    """
+    Downloads, decodes and ingests every CFS run between two dates as a streaming pipeline.
+
+    A download thread fetches the runs in order and hands them to the decoder through a bounded queue,
+    so the next run downloads while the current one is decoded and written. At most `queue_size` runs
+    wait on disk, and each run's files are released as soon as its rows are committed, which keeps disk
+    and memory use bounded for arbitrarily long date ranges.
+
+    Parameters:
+    start (str or datetime): First CFS run ('MM-DD-YYYY HH' or 'MM-DD-YYYY' for 00Z).
+    end (str or datetime): Last CFS run ('MM-DD-YYYY HH' or 'MM-DD-YYYY' for 18Z).
+    download_dir (str): Directory under which one 'YYYYMMDD' folder per day is downloaded.
+    database (str): Path to the SQLite database.
+    mask_file (str): Path to the GL mask netCDF file.
+    mask_variables (list): A list of mask variables to process.
+    table (str): The table where the data will be inserted. Default = 'cfs_forecast_data'.
+    source (str): 'aws' or 'ncei'. Default = 'aws'.
+    bucket_name (str): AWS bucket holding the CFS data. Default = 'noaa-cfs-pds'.
+    queue_size (int): Maximum number of downloaded runs waiting to be decoded. Default = 2.
+    delete_files (bool): Delete each run's GRIB files once its rows are committed. Default = True.
+    runs_per_commit (int): Number of runs written per database transaction. Default = 1.
+    subset (bool): Only download the GRIB messages used by the forecast. Default = False.
+    cache (GribCache, optional): Local download cache (its disk budget bounds the cached copies). Default = None.
+    endpoint_url (str, optional): S3 endpoint to use instead of AWS. Default = None.
+    regrid_dir (str, optional): Directory to cache the regrid weights in. Default = None.
+    index_dir (str, optional): Directory for the persistent GRIB index files. Default = None.
+    archive (CFSArchive, optional): A columnar archive the runs are also appended to. Default = None.
+
+    Returns:
+    dict: {'processed': list of CFS runs written, 'failed': dict of CFS run -> error message}.
+    """
+    import netCDF4 as nc
+
+    if not isinstance(queue_size, int) or queue_size < 1:
+        raise ValueError("ERROR: queue_size must be a positive integer.")
+
+    date_array = cfs_run_dates(start, end)
+
+    conn, _ = open_cfs_db(database)
+    if conn is not None:
+        conn.close()
+
+    downloaded = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Block while the queue is full, but give up if the decoder has stopped
+        while not stop.is_set():
+            try:
+                downloaded.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def download_runs():
+        for date in date_array:
+            if stop.is_set():
+                break
+            cfs_run = date.strftime('%Y%m%d%H')
+            download_path = os.path.join(download_dir, date.strftime('%Y%m%d'))
+            try:
+                available = download_cfs_run(date, download_path, source=source, bucket_name=bucket_name,
+                                             subset=subset, cache=cache, endpoint_url=endpoint_url)
+                put((cfs_run, download_path, None if available else "Run not available from the source."))
+            except Exception as e:
+                put((cfs_run, download_path, str(e)))
+        put(_DONE)
+
+    processed, failed = [], {}
+    pending_release = []
+
+    mask_ds = nc.Dataset(mask_file)
+    mask_lat = mask_ds.variables['latitude'][:]
+    mask_lon = mask_ds.variables['longitude'][:]
+    area = calculate_grid_cell_areas(mask_lon, mask_lat)
+    mask_set = MaskSet(mask_ds, mask_variables, area)
+
+    downloader = threading.Thread(target=download_runs, name='cfs-download', daemon=True)
+    downloader.start()
+    try:
+        with CFSWriter(database, table, runs_per_commit=runs_per_commit) as writer:
+            while True:
+                item = downloaded.get()
+                if item is _DONE:
+                    break
+
+                cfs_run, download_path, error = item
+                if error is None:
+                    try:
+                        rows_before = writer.rows_written + len(writer.rows)
+                        process_grib_files(download_path, database, table, cfs_run, mask_lat, mask_lon, mask_ds,
+                                           mask_variables, area, regrid_dir=regrid_dir, index_dir=index_dir, writer=writer,
+                                           archive=archive, mask_set=mask_set)
+                        if writer.rows_written + len(writer.rows) == rows_before:
+                            error = "No data extracted from the GRIB files."
+                    except Exception as e:
+                        error = str(e)
+
+                if error is not None:
+                    print(f"ERROR processing CFS run {cfs_run}: {error} Skipping.")
+                    log_skip('runs_failed', cfs_run=cfs_run, reason=error)
+                    failed[cfs_run] = error
+                else:
+                    processed.append(cfs_run)
+                    metrics.count('runs_processed')
+                pending_release.append((download_path, cfs_run))
+
+                # Files are only released once the rows read from them are committed
+                if not writer.rows:
+                    if delete_files:
+                        for path, run in pending_release:
+                            release_cfs_run(path, run, index_dir)
+                    pending_release = []
+
+            writer.flush()
+            if delete_files:
+                for path, run in pending_release:
+                    release_cfs_run(path, run, index_dir)
+    finally:
+        stop.set()
+        downloader.join()
+        mask_ds.close()
+
+    print(f"Processed {len(processed)} of {len(date_array)} CFS runs ({len(failed)} failed).")
+    return {'processed': processed, 'failed': failed}
+
+class CFSForecastDaemon:
+    """
+    Long-running service that ingests and forecasts every new CFS cycle as soon as it is published.
+
+    Everything that the notebooks reload on each run is loaded once and kept warm between cycles: the mask
+    dataset and its grid cell areas, the regrid weights, the scalers and models (through a `ModelRegistry`)
+    and the connection of the CFS database writer. Each poll checks whether the next 6-hourly run is
+    published, downloads, decodes and commits it, then catches up on any later runs before forecasting the
+    new runs with `forecast_new_runs`. A run that is still missing `max_wait_hours` after its cycle time
+    (e.g. a cycle NOAA never published) is skipped so the service does not stall.
+
+    Parameters:
+    download_dir (str): Directory under which one 'YYYYMMDD' folder per day is downloaded.
+    database (str): Path to the CFS forecast database.
+    mask_file (str): Path to the GL mask netCDF file.
+    mask_variables (list): A list of mask variables to process.
+    cnbs_database (str): Path to the CNBS forecast database.
+    x_scaler (str): The file path to the scaler used for the input data.
+    y_scaler (str): The file path to the scaler used for the target data.
+    models_info (list): A list of dictionaries containing model information.
+    table (str): The table where the CFS data is inserted. Default = 'cfs_forecast_data'.
+    start (str or datetime, optional): First CFS run to process. Default = None (the run after the last one in the database).
+    source (str): 'aws' or 'ncei'. Default = 'aws'.
+    bucket_name (str): AWS bucket holding the CFS data. Default = 'noaa-cfs-pds'.
+    subset (bool): Only download the GRIB messages used by the forecast. Default = False.
+    cache (GribCache, optional): Local download cache. Default = None.
+    endpoint_url (str, optional): S3 endpoint to use instead of AWS. Default = None.
+    regrid_dir (str, optional): Directory to cache the regrid weights in. Default = None.
+    index_dir (str, optional): Directory for the persistent GRIB index files. Default = None.
+    archive (CFSArchive, optional): A columnar archive the runs are also appended to. Default = None.
+    delete_files (bool): Delete each run's GRIB files once its rows are committed. Default = True.
+    max_wait_hours (float): Hours after its cycle time before a missing run is skipped. Default = 48.
+    registry (ModelRegistry, optional): Registry the scalers and models are kept in. Default = None (a new registry).
+    forecast_workers (int): Number of threads used to run the models. Default = 1.
+    csv_path (str, optional): Forecast CSV file rewritten after each poll that forecast new runs (see `write_forecast_csv`). Default = None.
+    metrics_path (str, optional): JSON file the pipeline metrics since the start of the service are written to
+        after each poll (see `src.metrics_utils`). Default = None.
+
+    Example:
+    with CFSForecastDaemon(download_dir, database, mask_file, mask_variables, cnbs_database,
+                           x_scaler, y_scaler, models_info) as daemon:
+        daemon.serve(poll_interval=600)
+    """
+
+    def __init__(self, download_dir, database, mask_file, mask_variables, cnbs_database, x_scaler, y_scaler, models_info,
+                 table='cfs_forecast_data', start=None, source='aws', bucket_name='noaa-cfs-pds', subset=False, cache=None,
+                 endpoint_url=None, regrid_dir=None, index_dir=None, archive=None, delete_files=True, max_wait_hours=48,
+                 registry=None, forecast_workers=1, csv_path=None, metrics_path=None):
+        import netCDF4 as nc
+
+        if source not in ('aws', 'ncei'):
+            raise ValueError("ERROR: Input source does not exist. Source must be aws or ncei.")
+
+        self.download_dir = download_dir
+        self.database = database
+        self.mask_variables = list(mask_variables)
+        self.cnbs_database = cnbs_database
+        self.x_scaler = x_scaler
+        self.y_scaler = y_scaler
+        self.models_info = models_info
+        self.table = table
+        self.source = source
+        self.bucket_name = bucket_name
+        self.subset = subset
+        self.cache = cache
+        self.endpoint_url = endpoint_url
+        self.regrid_dir = regrid_dir
+        self.index_dir = index_dir
+        self.archive = archive
+        self.delete_files = delete_files
+        self.max_wait = timedelta(hours=max_wait_hours)
+        self.forecast_workers = forecast_workers
+        self.csv_path = csv_path
+        self.metrics_path = metrics_path
+
+        if start is None:
+            start = get_next_cfs_run(database, table)
+            if start is None:
+                raise ValueError("ERROR: The CFS database is empty, a start date is required.")
+        self.next_run = parse_cfs_date(start)
+
+        # Warm state kept between cycles
+        self.registry = registry if registry is not None else ModelRegistry()
+        self.registry.warm_up([x_scaler, y_scaler] + [model['path'] for model in models_info])
+        self.mask_ds = nc.Dataset(mask_file)
+        self.mask_lat = self.mask_ds.variables['latitude'][:]
+        self.mask_lon = self.mask_ds.variables['longitude'][:]
+        self.area = calculate_grid_cell_areas(self.mask_lon, self.mask_lat)
+        self.mask_set = MaskSet(self.mask_ds, self.mask_variables, self.area)
+
+        conn, _ = open_cfs_db(database)
+        if conn is not None:
+            conn.close()
+        self.writer = CFSWriter(database, table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Commit any buffered rows and release the mask dataset and the database connection."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.mask_ds is not None:
+            self.mask_ds.close()
+            self.mask_ds = None
+
+    def process_run(self, date):
+        """
+        Downloads, decodes and commits one CFS run.
+
+        Parameters:
+        date (datetime): The CFS run.
+
+        Returns:
+        bool: True if rows were written for the run, False otherwise.
+        """
+        cfs_run = date.strftime('%Y%m%d%H')
+        download_path = os.path.join(self.download_dir, date.strftime('%Y%m%d'))
+        rows_before = len(self.writer.rows)
+        try:
+            if not download_cfs_run(date, download_path, source=self.source, bucket_name=self.bucket_name,
+                                    subset=self.subset, cache=self.cache, endpoint_url=self.endpoint_url):
+                return False
+            rows_written = self.writer.rows_written
+            process_grib_files(download_path, self.database, self.table, cfs_run, self.mask_lat, self.mask_lon, self.mask_ds,
+                               self.mask_variables, self.area, regrid_dir=self.regrid_dir, index_dir=self.index_dir,
+                               writer=self.writer, archive=self.archive, mask_set=self.mask_set)
+            if self.writer.rows_written == rows_written:
+                print(f"ERROR processing CFS run {cfs_run}: No data extracted from the GRIB files.")
+                log_skip('runs_failed', cfs_run=cfs_run, reason='no_data')
+                return False
+        except Exception as e:
+            # Drop the rows of a partially decoded run so they are never committed
+            del self.writer.rows[rows_before:]
+            print(f"ERROR processing CFS run {cfs_run}: {e}")
+            log_skip('runs_failed', e, cfs_run=cfs_run)
+            return False
+        finally:
+            if self.delete_files:
+                release_cfs_run(download_path, cfs_run, self.index_dir)
+        metrics.count('runs_processed')
+        return True
+
+    def poll(self, now=None):
+        """
+        Processes every published CFS run from `next_run` on and forecasts the new ones.
+
+        Parameters:
+        now (datetime, optional): The current UTC time. Default = None (now).
+
+        Returns:
+        dict: {'processed': list of CFS runs written, 'skipped': list of CFS runs given up on,
+        'forecast': result of `forecast_new_runs`, or None if no run was written}.
+        """
+        now = now if now is not None else datetime.now(timezone.utc).replace(tzinfo=None)
+        processed, skipped = [], []
+
+        while self.next_run <= now:
+            date = self.next_run
+            cfs_run = date.strftime('%Y%m%d%H')
+            if cfs_run_available(date, source=self.source, bucket_name=self.bucket_name, endpoint_url=self.endpoint_url) \
+                    and self.process_run(date):
+                processed.append(cfs_run)
+            elif now - date > self.max_wait:
+                print(f"CFS run {cfs_run} is still missing after {self.max_wait}. Skipping.")
+                log_skip('runs_skipped', cfs_run=cfs_run, reason='not_published')
+                skipped.append(cfs_run)
+            else:
+                break
+            self.next_run = date + timedelta(hours=6)
+
+        forecast = None
+        if processed:
+            forecast = forecast_new_runs(self.database, self.cnbs_database, self.x_scaler, self.y_scaler, self.models_info,
+                                         registry=self.registry, table=self.table, workers=self.forecast_workers)
+            if self.csv_path is not None and forecast['rows']:
+                write_forecast_csv(self.cnbs_database, self.csv_path)
+        return {'processed': processed, 'skipped': skipped, 'forecast': forecast}
+
+    def serve(self, poll_interval=600, stop_event=None, max_polls=None):
+        """
+        Polls for new CFS runs until stopped.
+
+        Parameters:
+        poll_interval (float): Seconds between two polls. Default = 600.
+        stop_event (threading.Event, optional): Set it to stop the service. Default = None (run until interrupted).
+        max_polls (int, optional): Stop after this many polls. Default = None (no limit).
+
+        Returns:
+        int: The number of polls done.
+        """
+        stop_event = stop_event if stop_event is not None else threading.Event()
+        polls = 0
+        while not stop_event.is_set() and (max_polls is None or polls < max_polls):
+            try:
+                result = self.poll()
+                if result['processed']:
+                    print(f"Processed CFS runs {', '.join(result['processed'])}.")
+            except Exception as e:
+                # Keep the service alive, the next poll retries
+                print(f"ERROR during the poll: {e}")
+                log_skip('poll_errors', e)
+            polls += 1
+            metrics.count('polls')
+            if self.metrics_path is not None:
+                metrics.write_json(self.metrics_path, command='daemon', next_run=self.next_run.strftime('%Y%m%d%H'))
+            if max_polls is None or polls < max_polls:
+                print(f"Waiting for CFS run {self.next_run.strftime('%Y%m%d%H')}.")
+                stop_event.wait(poll_interval)
+        return polls
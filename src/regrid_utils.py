@@ -0,0 +1,180 @@
+import hashlib
+import os
+import numpy as np
+from scipy import sparse
+
+# In-process cache of regrid operators keyed by the (source grid, target grid) hash
+_REGRID_OPERATORS = {}
+
+# Version of the weights, part of the cache key so operators saved by older versions are rebuilt
+_REGRID_VERSION = 2
+
+class RegridOperator:
+    """
+    Bilinear regrid operator stored as a sparse weight matrix.
+
+    The operator maps a field on a rectilinear source grid (lat, lon) onto a rectilinear
+    target grid. Target points outside the source grid are set to NaN, matching the
+    behaviour of xarray's `DataArray.interp(method='linear')`.
+
+    Attributes:
+    weights (scipy.sparse.csr_matrix): Weight matrix of shape (n_target, n_source).
+    valid (np.ndarray): Boolean array (n_target,) marking target points inside the source grid.
+    src_shape (tuple): Shape (nlat, nlon) of the source grid.
+    dst_shape (tuple): Shape (nlat, nlon) of the target grid.
+    """
+
+    def __init__(self, weights, valid, src_shape, dst_shape):
+        self.weights = weights.tocsr()
+        self.valid = np.asarray(valid, dtype=bool)
+        self.src_shape = tuple(int(n) for n in src_shape)
+        self.dst_shape = tuple(int(n) for n in dst_shape)
+
+    def __call__(self, field):
+        return self.apply(field)
+
+    def apply(self, field):
+        """
+        Regrid a field (or a stack of fields) onto the target grid.
+
+        Parameters:
+        field (array-like): Array whose last two dimensions match the source grid (lat, lon).
+
+        Returns:
+        np.ndarray: The regridded array with the last two dimensions replaced by the target grid.
+        """
+        values = np.asarray(field)
+        if values.shape[-2:] != self.src_shape:
+            raise ValueError(f"ERROR: Field shape {values.shape[-2:]} does not match the source grid {self.src_shape}.")
+
+        lead_shape = values.shape[:-2]
+        flat = values.reshape(-1, self.src_shape[0] * self.src_shape[1])
+
+        # One sparse matrix product for every field in the stack
+        out = np.asarray(self.weights @ flat.T).T
+        out[:, ~self.valid] = np.nan
+
+        return out.reshape(lead_shape + self.dst_shape)
+
+    def save(self, path):
+        """Save the operator to a .npz file (written atomically)."""
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path,
+                 data=self.weights.data, indices=self.weights.indices, indptr=self.weights.indptr,
+                 shape=np.array(self.weights.shape), valid=self.valid,
+                 src_shape=np.array(self.src_shape), dst_shape=np.array(self.dst_shape))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an operator previously written with `save`."""
+        with np.load(path) as f:
+            weights = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(weights, f['valid'], tuple(f['src_shape']), tuple(f['dst_shape']))
+
+def _as_coords(values):
+    """Return a 1D float64 coordinate array (netCDF masked arrays are unmasked)."""
+    coords = np.asarray(np.ma.getdata(values), dtype=np.float64)
+    if coords.ndim != 1:
+        raise ValueError("ERROR: Grid coordinates must be 1D arrays.")
+    return coords
+
+def linear_weights_1d(src, dst):
+    """
+    Build the 1D linear interpolation weights from a source axis to a target axis.
+
+    Parameters:
+    src (array-like): Source coordinates (strictly ascending or descending).
+    dst (array-like): Target coordinates.
+
+    Returns:
+    tuple: (scipy.sparse.csr_matrix of shape (len(dst), len(src)), boolean array of valid target points)
+    """
+    src = _as_coords(src)
+    dst = _as_coords(dst)
+    if len(src) < 2:
+        raise ValueError("ERROR: The source axis must have at least two points to interpolate.")
+
+    # Work on an ascending copy of the axis and map back to the original positions
+    order = np.argsort(src)
+    src_sorted = src[order]
+
+    # A target on a source point falls in the cell below it, as in scipy's interpolators, so a NaN
+    # neighbour with a zero weight makes it NaN exactly as with `DataArray.interp`
+    lower = np.clip(np.searchsorted(src_sorted, dst, side='left') - 1, 0, len(src) - 2)
+    x0, x1 = src_sorted[lower], src_sorted[lower + 1]
+    frac = (dst - x0) / (x1 - x0)
+    valid = (dst >= src_sorted[0]) & (dst <= src_sorted[-1])
+
+    rows = np.repeat(np.flatnonzero(valid), 2)
+    cols = np.column_stack([order[lower], order[lower + 1]])[valid].ravel()
+    data = np.column_stack([1.0 - frac, frac])[valid].ravel()
+
+    weights = sparse.csr_matrix((data, (rows, cols)), shape=(len(dst), len(src)))
+    return weights, valid
+
+def build_regrid_operator(src_lat, src_lon, dst_lat, dst_lon):
+    """
+    Build a bilinear regrid operator between two rectilinear (lat, lon) grids.
+
+    Parameters:
+    src_lat, src_lon (array-like): 1D source grid coordinates.
+    dst_lat, dst_lon (array-like): 1D target grid coordinates.
+
+    Returns:
+    RegridOperator: The sparse regrid operator.
+    """
+    w_lat, valid_lat = linear_weights_1d(src_lat, dst_lat)
+    w_lon, valid_lon = linear_weights_1d(src_lon, dst_lon)
+
+    # Bilinear weights on a row-major (lat, lon) grid are the Kronecker product of the 1D weights
+    weights = sparse.kron(w_lat, w_lon, format='csr')
+    valid = np.outer(valid_lat, valid_lon).ravel()
+
+    return RegridOperator(weights, valid, (w_lat.shape[1], w_lon.shape[1]), (w_lat.shape[0], w_lon.shape[0]))
+
+def grid_key(src_lat, src_lon, dst_lat, dst_lon):
+    """Return a short hash identifying a (source grid, target grid) pair."""
+    digest = hashlib.sha1(f'v{_REGRID_VERSION}'.encode())
+    for coords in (src_lat, src_lon, dst_lat, dst_lon):
+        coords = _as_coords(coords)
+        digest.update(str(coords.shape).encode())
+        digest.update(coords.tobytes())
+    return digest.hexdigest()[:16]
+
+def get_regrid_operator(src_lat, src_lon, dst_lat, dst_lon, cache_dir=None):
+    """
+    Return the regrid operator for a (source grid, target grid) pair, building it only once.
+
+    Operators are kept in memory for the life of the process and, if `cache_dir` is given,
+    saved to disk so later runs can reload them instead of rebuilding the weights.
+
+    Parameters:
+    src_lat, src_lon (array-like): 1D source grid coordinates.
+    dst_lat, dst_lon (array-like): 1D target grid coordinates.
+    cache_dir (str, optional): Directory in which to store the operator. Default = None (memory only).
+
+    Returns:
+    RegridOperator: The sparse regrid operator.
+    """
+    key = grid_key(src_lat, src_lon, dst_lat, dst_lon)
+    if key in _REGRID_OPERATORS:
+        return _REGRID_OPERATORS[key]
+
+    operator = None
+    cache_file = os.path.join(cache_dir, f'regrid_{key}.npz') if cache_dir else None
+
+    if cache_file and os.path.exists(cache_file):
+        try:
+            operator = RegridOperator.load(cache_file)
+        except Exception as e:
+            print(f"ERROR reading regrid operator {cache_file}, rebuilding it: {e}")
+
+    if operator is None:
+        operator = build_regrid_operator(src_lat, src_lon, dst_lat, dst_lon)
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            operator.save(cache_file)
+
+    _REGRID_OPERATORS[key] = operator
+    return operator
@@ -0,0 +1,415 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from src.catalog_utils import get_catalog
+from src.data_processing import CNBS_COLUMNS, FEATURE_COLUMNS
+from src.feature_utils import FeatureSchema, FEATURE_SCHEMA_FILE
+
+# Columns of the training targets, in the order of the model output (CNBS_COLUMNS)
+TARGET_COLUMNS = [column.replace('_', '_target_', 1) for column in CNBS_COLUMNS]
+
+# Hyperparameter candidates searched by default for each model
+DEFAULT_CANDIDATES = {
+    'GP': [{'kernel': 'matern_rq', 'alpha': 0.1}, {'kernel': 'matern', 'alpha': 0.1}, {'kernel': 'rbf', 'alpha': 0.1}],
+    'LR': [{}],
+    'RF': [{'n_estimators': 100, 'max_depth': None}, {'n_estimators': 300, 'max_depth': 10}],
+    'NN': [{'epochs': 50, 'batch_size': 32}],
+}
+
+def gp_kernel(name):
+    """
+    Returns a new GP kernel by name.
+
+    'matern_rq' is the kernel of the production model, 1.0 * Matern(nu=1.5) * RationalQuadratic().
+    """
+    from sklearn.gaussian_process.kernels import ConstantKernel, Matern, RationalQuadratic, RBF
+
+    if name == 'matern_rq':
+        return 1.0 * Matern(nu=1.5) * RationalQuadratic()
+    if name == 'matern':
+        return ConstantKernel(1.0, (1e-3, 1e3)) * Matern(length_scale=1.0, nu=1.5)
+    if name == 'rbf':
+        return ConstantKernel(1.0, (1e-3, 1e3)) * RBF(1.0, (1e-2, 1e2))
+    raise ValueError(f"ERROR: Unknown GP kernel '{name}'.")
+
+def _keras_mlp(n_features, n_targets):
+    import tensorflow as tf
+
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(n_features,)),
+        tf.keras.layers.Dense(128, activation='relu'),
+        tf.keras.layers.Dense(64, activation='relu'),
+        tf.keras.layers.Dense(n_targets)
+    ])
+    model.compile(optimizer='adam', loss='mse', metrics=['mae'])
+    return model
+
+def fit_estimator(model_name, params, X, y, n_restarts_optimizer=0, random_state=42):
+    """
+    Fits one candidate model on scaled data, as in the training notebook.
+
+    Parameters:
+    - model_name (str): 'GP', 'LR', 'RF' or 'NN'.
+    - params (dict): Hyperparameters of the candidate (see DEFAULT_CANDIDATES).
+    - X (np.ndarray): Scaled inputs.
+    - y (np.ndarray): Scaled targets.
+    - n_restarts_optimizer (int): Restarts of the GP kernel optimizer. Default = 0.
+    - random_state (int): Seed of the GP optimizer, the random forest and the NN. Default = 42.
+
+    Returns:
+    - The fitted model.
+    """
+    if model_name == 'GP':
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        kernel = params['kernel'] if not isinstance(params['kernel'], str) else gp_kernel(params['kernel'])
+        model = GaussianProcessRegressor(kernel=kernel, alpha=params.get('alpha', 0.1),
+                                         n_restarts_optimizer=n_restarts_optimizer, random_state=random_state)
+    elif model_name == 'LR':
+        from sklearn.linear_model import LinearRegression
+        model = LinearRegression(**params)
+    elif model_name == 'RF':
+        from sklearn.ensemble import RandomForestRegressor
+        model = RandomForestRegressor(random_state=random_state, **params)
+    elif model_name == 'NN':
+        import tensorflow as tf
+        tf.keras.utils.set_random_seed(random_state)
+        model = _keras_mlp(X.shape[1], y.shape[1])
+        model.fit(X, y, epochs=params.get('epochs', 50), batch_size=params.get('batch_size', 32),
+                  validation_split=params.get('validation_split', 0.2), verbose=0)
+        return model
+    else:
+        raise ValueError(f"ERROR: Unknown model '{model_name}'. Models must be GP, LR, RF or NN.")
+    return model.fit(X, y)
+
+def load_training_data(data_dir, schema=None, catalog=None):
+    """
+    Loads the CFSR basin averages (features) and the L2SWBM medians (targets) used to train the models.
+
+    Parameters:
+    - data_dir (str): The data directory, holding the training/ and l2swbm/ folders.
+    - schema (FeatureSchema, optional): The features to build. Default = None (the 24 CFS variables and the month one-hot).
+    - catalog (DataCatalog, optional): Catalog the CSV files are read from. Default = None (the shared catalog of data_dir).
+
+    Returns:
+    - tuple: (X, y) DataFrames indexed by month, restricted to the months found in both.
+    """
+    schema = schema if schema is not None else FeatureSchema(FEATURE_COLUMNS[:24])
+    catalog = catalog if catalog is not None else get_catalog(data_dir)
+
+    # The CFSR columns are named '<lake>_<surface type>_<component>', as the base variables of the schema
+    X = schema.build(catalog.frame('cfsr'))
+    y = catalog.frame('l2swbm', columns='{lake}_target_{component}')[TARGET_COLUMNS].dropna()
+
+    index = X.index.intersection(y.index)
+    return X.loc[index], y.loc[index]
+
+def rolling_origin_folds(index, first_test, test_months=12, step_months=12, gap_months=0, max_train_months=None, last_test=None):
+    """
+    Splits a monthly time series into time-ordered rolling-origin folds.
+
+    Each fold trains on every month before its origin (or the last `max_train_months` of them) and tests on the
+    `test_months` after the origin, skipping `gap_months` in between. The origin then moves forward by
+    `step_months`, so no fold ever trains on months after the ones it is tested on.
+
+    Parameters:
+    - index (pd.DatetimeIndex): The sorted months of the data.
+    - first_test (str or datetime): First month of the first test window, e.g. '2005-01-01'.
+    - test_months (int): Length of the test windows. Default = 12.
+    - step_months (int): Months between two origins. Default = 12.
+    - gap_months (int): Months left out between the training and the test window. Default = 0.
+    - max_train_months (int, optional): Length of a sliding training window. Default = None (expanding window).
+    - last_test (str or datetime, optional): Last month that may be tested on. Default = None (the end of the data).
+
+    Returns:
+    - list: (train positions, test positions) integer arrays, one pair per fold.
+    """
+    index = pd.DatetimeIndex(index)
+    if not index.is_monotonic_increasing:
+        raise ValueError("ERROR: The index must be sorted in time.")
+    if min(test_months, step_months) < 1 or gap_months < 0:
+        raise ValueError("ERROR: test_months and step_months must be positive and gap_months non-negative.")
+
+    positions = np.arange(len(index))
+    last = positions[index <= pd.Timestamp(last_test)][-1] if last_test is not None else positions[-1]
+    origin = int(np.searchsorted(index, pd.Timestamp(first_test)))
+
+    folds = []
+    while origin + test_months - 1 <= last:
+        train_end = origin - gap_months
+        train_start = 0 if max_train_months is None else max(0, train_end - max_train_months)
+        if train_end <= train_start:
+            raise ValueError("ERROR: The first fold has no training data.")
+        folds.append((positions[train_start:train_end], positions[origin:origin + test_months]))
+        origin += step_months
+    if not folds:
+        raise ValueError("ERROR: The data is too short for a single test window.")
+    return folds
+
+class FoldCache:
+    """
+    Scaled train/test matrices of every fold, computed once and shared by every model and candidate.
+
+    The scalers of each fold are fitted on its training months only, so no test month leaks into the
+    scaling. The matrices are saved as '.npy' files under a key made from the data and the folds, and
+    the worker processes open them memory-mapped instead of receiving copies.
+
+    Parameters:
+    - X (pd.DataFrame): The features.
+    - y (pd.DataFrame): The targets.
+    - folds (list): (train positions, test positions) pairs, see `rolling_origin_folds`.
+    - cache_dir (str): Directory the fold matrices are saved under (reused if they already exist).
+    """
+
+    def __init__(self, X, y, folds, cache_dir):
+        from sklearn.preprocessing import StandardScaler
+
+        digest = hashlib.sha1()
+        for array in (X.to_numpy(dtype=np.float64), y.to_numpy(dtype=np.float64)):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        for train, test in folds:
+            digest.update(np.asarray(train, dtype=np.int64).tobytes() + b'|' + np.asarray(test, dtype=np.int64).tobytes())
+        self.path = os.path.join(cache_dir, digest.hexdigest()[:16])
+        self.num_folds = len(folds)
+
+        if os.path.exists(os.path.join(self.path, 'done')):
+            return
+        os.makedirs(self.path, exist_ok=True)
+        X_values, y_values = X.to_numpy(dtype=np.float64), y.to_numpy(dtype=np.float64)
+        for fold, (train, test) in enumerate(folds):
+            x_scaler = StandardScaler().fit(X_values[train])
+            y_scaler = StandardScaler().fit(y_values[train])
+            np.save(self._file(fold, 'X_train'), x_scaler.transform(X_values[train]))
+            np.save(self._file(fold, 'X_test'), x_scaler.transform(X_values[test]))
+            np.save(self._file(fold, 'y_train'), y_scaler.transform(y_values[train]))
+            np.save(self._file(fold, 'y_test'), y_scaler.transform(y_values[test]))
+        open(os.path.join(self.path, 'done'), 'w').close()
+
+    def _file(self, fold, name):
+        return os.path.join(self.path, f'fold{fold}_{name}.npy')
+
+    def get(self, fold):
+        """Returns the memory-mapped (X_train, y_train, X_test, y_test) scaled matrices of a fold."""
+        return tuple(np.load(self._file(fold, name), mmap_mode='r') for name in ('X_train', 'y_train', 'X_test', 'y_test'))
+
+def _evaluate_candidate(cache, fold, model_name, candidate, params):
+    """Fit one candidate on one fold and score it on the fold's test months (run in a worker process)."""
+    X_train, y_train, X_test, y_test = cache.get(fold)
+    start = time.perf_counter()
+    try:
+        model = fit_estimator(model_name, params, np.asarray(X_train), np.asarray(y_train))
+        y_pred = np.asarray(model.predict(np.asarray(X_test)))
+    except Exception as e:
+        return {'model': model_name, 'candidate': candidate, 'fold': fold, 'error': str(e)}
+    errors = y_pred - y_test
+    mse = float(np.mean(errors ** 2))
+    # R² averaged over the targets, as sklearn's r2_score
+    r2 = float(np.mean(1 - np.sum(errors ** 2, axis=0) / np.sum((y_test - y_test.mean(axis=0)) ** 2, axis=0)))
+    return {'model': model_name, 'candidate': candidate, 'fold': fold, 'mse': mse, 'r2': r2,
+            'fit_seconds': time.perf_counter() - start, 'error': None}
+
+def _run_tasks(function, tasks, workers):
+    """Run function(*task) for every task, in this process or in a process pool, and return the results in order."""
+    if workers == 1:
+        return [function(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(function, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+def cross_validate(X, y, folds, models=('GP', 'LR', 'RF', 'NN'), candidates=None, workers=1, cache_dir=None):
+    """
+    Scores every hyperparameter candidate of every model on every fold, in parallel.
+
+    Each (model, candidate, fold) is one task of the process pool. The scaled fold matrices are built once
+    (see `FoldCache`) and shared by every task. GP candidates are fitted without optimizer restarts; the
+    restarts are only used for the final fit (see `fit_gp_parallel`). A candidate that fails on a fold (e.g.
+    the NN when TensorFlow is not installed) is reported in the 'error' column instead of stopping the run.
+
+    Parameters:
+    - X (pd.DataFrame): The features.
+    - y (pd.DataFrame): The targets.
+    - folds (list): (train positions, test positions) pairs, see `rolling_origin_folds`.
+    - models (tuple): Models to evaluate. Default = ('GP', 'LR', 'RF', 'NN').
+    - candidates (dict, optional): Model name mapped to a list of hyperparameter dicts. Default = None (DEFAULT_CANDIDATES).
+    - workers (int): Number of worker processes. Default = 1.
+    - cache_dir (str, optional): Directory of the fold matrix cache. Default = None (a temporary directory).
+
+    Returns:
+    - pd.DataFrame: One row per model, candidate and fold with the parameters, the test MSE and R² (in scaled
+      units), the fit time and the error message of failed fits.
+    """
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError("ERROR: workers must be a positive integer.")
+    candidates = candidates if candidates is not None else DEFAULT_CANDIDATES
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = FoldCache(X, y, folds, cache_dir or temp_dir)
+        # The slow GP tasks are submitted first so they do not end up alone at the end of the run
+        tasks = [(cache, fold, model_name, candidate, params)
+                 for model_name in sorted(models, key=lambda name: name != 'GP')
+                 for candidate, params in enumerate(candidates[model_name])
+                 for fold in range(len(folds))]
+        results = pd.DataFrame(_run_tasks(_evaluate_candidate, tasks, workers))
+
+    results['params'] = [json.dumps(candidates[model_name][candidate], sort_keys=True)
+                         for model_name, candidate in zip(results['model'], results['candidate'])]
+    results['test_start'] = [X.index[folds[fold][1][0]] for fold in results['fold']]
+    results['test_end'] = [X.index[folds[fold][1][-1]] for fold in results['fold']]
+    return results.sort_values(['model', 'candidate', 'fold']).reset_index(drop=True)
+
+def select_candidates(results):
+    """
+    Picks the candidate of each model with the lowest mean test MSE over the folds.
+
+    Parameters:
+    - results (pd.DataFrame): The output of `cross_validate`.
+
+    Returns:
+    - pd.DataFrame: One row per model with the best candidate, its parameters and its mean MSE and R².
+      Candidates that failed on any fold are not eligible.
+    """
+    columns = ['model', 'candidate', 'params', 'mse', 'r2']
+    if 'mse' not in results or results['mse'].isna().all():
+        # Every candidate failed, so no fit reported a score
+        return pd.DataFrame(columns=columns)
+
+    failed = results[results['error'].notna()][['model', 'candidate']].drop_duplicates()
+    valid = results.merge(failed, on=['model', 'candidate'], how='left', indicator=True)
+    valid = valid[valid['_merge'] == 'left_only']
+    summary = valid.groupby(['model', 'candidate', 'params'], as_index=False)[['mse', 'r2']].mean()
+    if summary.empty:
+        return pd.DataFrame(columns=columns)
+    best = summary.loc[summary.groupby('model')['mse'].idxmin()]
+    return best.reset_index(drop=True)
+
+def _fit_gp_start(params, X, y, theta):
+    """Fit a GP from one starting point of the kernel hyperparameters (run in a worker process)."""
+    kernel = gp_kernel(params['kernel']) if isinstance(params['kernel'], str) else params['kernel']
+    model = fit_estimator('GP', dict(params, kernel=kernel.clone_with_theta(theta)), X, y)
+    return model.log_marginal_likelihood_value_, model
+
+def fit_gp_parallel(params, X, y, n_restarts_optimizer=10, random_state=42, workers=1):
+    """
+    Fits a GP with optimizer restarts spread across a process pool.
+
+    `GaussianProcessRegressor` runs its restarts one after the other. Here the starting points are drawn
+    exactly as scikit-learn draws them (log-uniform within the kernel bounds, from `random_state`), each
+    start is optimized in its own process, and the fit with the highest log-marginal likelihood is kept,
+    which gives the same model as `n_restarts_optimizer` with the starts optimized concurrently.
+
+    Parameters:
+    - params (dict): The GP candidate ('kernel' and 'alpha').
+    - X (np.ndarray): Scaled inputs.
+    - y (np.ndarray): Scaled targets.
+    - n_restarts_optimizer (int): Number of restarts. Default = 10.
+    - random_state (int): Seed the starting points are drawn from. Default = 42.
+    - workers (int): Number of worker processes. Default = 1.
+
+    Returns:
+    - GaussianProcessRegressor: The fitted model.
+    """
+    kernel = gp_kernel(params['kernel']) if isinstance(params['kernel'], str) else params['kernel']
+    rng = np.random.RandomState(random_state)
+    bounds = kernel.bounds
+    starts = [kernel.theta] + [rng.uniform(bounds[:, 0], bounds[:, 1]) for _ in range(n_restarts_optimizer)]
+    fits = _run_tasks(_fit_gp_start, [(params, X, y, theta) for theta in starts], workers)
+    return max(fits, key=lambda fit: fit[0])[1]
+
+def train_models(X, y, output_dir, selected, schema=None, train_start=None, train_end=None, n_restarts_optimizer=10, workers=1):
+    """
+    Fits the selected candidates on the training period and saves the artifacts read by `predict_cnbs`.
+
+    The scalers are fitted on the training months only. Written to `output_dir`: x_scaler.joblib,
+    y_scaler.joblib, feature_schema.json and one '<MODEL>_trained_model.joblib' per model.
+
+    Parameters:
+    - X (pd.DataFrame): The features.
+    - y (pd.DataFrame): The targets (TARGET_COLUMNS).
+    - output_dir (str): Directory the artifacts are written to.
+    - selected (dict or pd.DataFrame): Model name mapped to its hyperparameters, or the output of `select_candidates`.
+    - schema (FeatureSchema, optional): The feature schema of X. Default = None (the 24 CFS variables and the month one-hot).
+    - train_start (str, optional): First training month. Default = None (the start of the data).
+    - train_end (str, optional): Last training month. Default = None (the end of the data).
+    - n_restarts_optimizer (int): Restarts of the GP kernel optimizer. Default = 10.
+    - workers (int): Number of worker processes (the models, then the GP restarts, run in parallel). Default = 1.
+
+    Returns:
+    - list: A list of dictionaries containing model information ({'model': name, 'path': path}).
+    """
+    import joblib
+    from sklearn.preprocessing import StandardScaler
+
+    if isinstance(selected, pd.DataFrame):
+        selected = {row.model: json.loads(row.params) for row in selected.itertuples()}
+    schema = schema if schema is not None else FeatureSchema(FEATURE_COLUMNS[:24])
+    X = schema.check(X)
+
+    X_train, y_train = X.loc[train_start:train_end], y.loc[train_start:train_end]
+    x_scaler = StandardScaler().fit(X_train)
+    y_scaler = StandardScaler().fit(y_train)
+    X_scaled, y_scaled = x_scaler.transform(X_train), y_scaler.transform(y_train)
+
+    os.makedirs(output_dir, exist_ok=True)
+    joblib.dump(x_scaler, os.path.join(output_dir, 'x_scaler.joblib'))
+    joblib.dump(y_scaler, os.path.join(output_dir, 'y_scaler.joblib'))
+    schema.save(os.path.join(output_dir, FEATURE_SCHEMA_FILE))
+
+    others = [name for name in selected if name != 'GP']
+    fitted = dict(zip(others, _run_tasks(fit_estimator, [(name, selected[name], X_scaled, y_scaled) for name in others], workers)))
+    if 'GP' in selected:
+        fitted['GP'] = fit_gp_parallel(selected['GP'], X_scaled, y_scaled, n_restarts_optimizer=n_restarts_optimizer, workers=workers)
+
+    models_info = []
+    for model_name in selected:
+        path = os.path.join(output_dir, f'{model_name}_trained_model.joblib')
+        joblib.dump(fitted[model_name], path)
+        models_info.append({'model': model_name, 'path': path})
+        print(f"Saved {model_name} model to {path}")
+    return models_info
+
+def run_training(data_dir, output_dir, models=('GP', 'LR', 'RF', 'NN'), candidates=None, first_test='2005-01-01',
+                 test_months=12, step_months=12, train_end=None, n_restarts_optimizer=10, workers=1, cache_dir=None):
+    """
+    Cross-validates the candidates, then trains the best candidate of each model and saves the artifacts.
+
+    Parameters:
+    - data_dir (str): The data directory, holding the training/ and l2swbm/ folders.
+    - output_dir (str): Directory the artifacts and 'cv_results.csv' are written to.
+    - models (tuple): Models to train. Default = ('GP', 'LR', 'RF', 'NN').
+    - candidates (dict, optional): Model name mapped to a list of hyperparameter dicts. Default = None (DEFAULT_CANDIDATES).
+    - first_test (str): First month of the first test window. Default = '2005-01-01'.
+    - test_months (int): Length of the test windows. Default = 12.
+    - step_months (int): Months between two fold origins. Default = 12.
+    - train_end (str, optional): Last month used by the final fit. Default = None (all the data).
+    - n_restarts_optimizer (int): Restarts of the GP kernel optimizer in the final fit. Default = 10.
+    - workers (int): Number of worker processes. Default = 1.
+    - cache_dir (str, optional): Directory of the fold matrix cache. Default = None (a temporary directory).
+
+    Returns:
+    - tuple: (models_info of the saved models, cross-validation results DataFrame).
+    """
+    schema = FeatureSchema(FEATURE_COLUMNS[:24])
+    X, y = load_training_data(data_dir, schema)
+    folds = rolling_origin_folds(X.index, first_test, test_months=test_months, step_months=step_months)
+    print(f"Cross-validating {len(models)} models on {len(folds)} folds ({len(X)} months).")
+
+    results = cross_validate(X, y, folds, models=models, candidates=candidates, workers=workers, cache_dir=cache_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    results.to_csv(os.path.join(output_dir, 'cv_results.csv'), index=False)
+    for row in results[results['error'].notna()].drop_duplicates(['model', 'candidate']).itertuples():
+        print(f"ERROR: {row.model} candidate {row.params} failed: {row.error}")
+
+    best = select_candidates(results)
+    if best.empty:
+        raise ValueError("ERROR: No candidate could be fitted.")
+    for row in best.itertuples():
+        print(f"{row.model}: best candidate {row.params} (MSE {row.mse:.4f}, R^2 {row.r2:.4f})")
+
+    models_info = train_models(X, y, output_dir, best, schema=schema, train_end=train_end,
+                               n_restarts_optimizer=n_restarts_optimizer, workers=workers)
+    return models_info, results
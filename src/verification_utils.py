@@ -0,0 +1,266 @@
+import hashlib
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from src.catalog_utils import get_catalog
+from src.ensemble_utils import ENSEMBLE_ALL
+
+# Lakes with a CNBS forecast
+VERIFIED_LAKES = ('superior', 'michigan-huron', 'erie', 'ontario')
+
+# Table caching the verification of each batch of forecasts (the CFS runs issued in one month)
+VERIFICATION_TABLE = 'cnbs_verification'
+
+def load_glcc_observations(glcc_dir, lakes=None):
+    """
+    Reads the GLCC monthly net basin supplies of the lakes, through the data catalog.
+
+    Parameters:
+    - glcc_dir (str): Directory of the GLCC files (data/glcc).
+    - lakes (list, optional): Lakes to read. Default = None (the lakes forecast: superior, michigan-huron, erie and ontario).
+
+    Returns:
+    - pd.DataFrame: The observed NBS [cms] with one row per month (DatetimeIndex) and one column per lake,
+      NaN where the GLCC record has no data.
+    """
+    glcc_dir = os.path.abspath(glcc_dir)
+    catalog = get_catalog(os.path.dirname(glcc_dir), directories={'glcc': glcc_dir})
+    lakes = lakes if lakes is not None else list(VERIFIED_LAKES)
+    return catalog.frame('glcc', lakes=lakes, columns='{lake}')
+
+def crps_ensemble(observations, members, axis=-1):
+    """
+    Continuous ranked probability score of ensemble forecasts, ignoring NaN members.
+
+    Uses CRPS = E|X - y| - 1/2 E|X - X'| over the empirical distribution of the members (the score of
+    `properscoring.crps_ensemble`), with the pairwise term computed from the sorted members in O(n log n).
+
+    Parameters:
+    - observations (np.ndarray): The observations, broadcastable to `members` without the member axis.
+    - members (np.ndarray): The ensemble members.
+    - axis (int): The member axis of `members`. Default = -1.
+
+    Returns:
+    - np.ndarray: The CRPS of each forecast (NaN where there is no member or no observation).
+    """
+    members = np.moveaxis(np.asarray(members, dtype=np.float64), axis, -1)
+    observations = np.asarray(observations, dtype=np.float64)[..., None]
+
+    valid = ~np.isnan(members)
+    counts = valid.sum(axis=-1)
+    safe_counts = np.maximum(counts, 1)
+
+    absolute_error = np.where(valid, np.abs(members - observations), 0).sum(axis=-1) / safe_counts
+
+    # E|X - X'| = 2 / n^2 * sum_i (2i - n - 1) x_(i), with the NaN sorted last
+    ordered = np.sort(members, axis=-1)
+    rank = np.arange(1, members.shape[-1] + 1)
+    weights = 2 * rank - counts[..., None] - 1
+    spread = np.where(rank <= counts[..., None], weights * np.nan_to_num(ordered), 0).sum(axis=-1)
+    crps = absolute_error - spread / safe_counts ** 2
+    return np.where((counts > 0) & ~np.isnan(observations[..., 0]), crps, np.nan)
+
+def _batch_fingerprints(conn, table, component):
+    """Cheap per-batch fingerprint of the forecast rows, computed by SQLite without reading the rows."""
+    rows = conn.execute(f'''
+    SELECT cfs_run / 10000 AS batch, COUNT(*), TOTAL("value [cms]"), TOTAL((cfs_run % 10000) * "value [cms]"),
+           TOTAL((year * 12 + month) * "value [cms]"), GROUP_CONCAT(DISTINCT model)
+    FROM "{table}" WHERE component = ?
+    GROUP BY batch
+    ''', (component,)).fetchall()
+    return {int(row[0]): '|'.join(repr(value) for value in row[1:5]) + '|' + ','.join(sorted(row[5].split(',')))
+            for row in rows}
+
+def verify_batch(df, observations, max_lead=None):
+    """
+    Verifies the forecasts of one batch against the observations.
+
+    The forecasts are arranged into a (run, model, lead, lake) array in one indexed lookup, and each lake's
+    observation is looked up for every (lead, lake) in one indexing operation. For each model (and for the
+    whole ensemble, 'all') the runs of the batch form an ensemble: its mean is the point forecast and its
+    members give the CRPS.
+
+    Parameters:
+    - df (pd.DataFrame): Forecast rows of the runs issued in one month, with the 'cfs_run', 'year', 'month',
+      'model', 'lake' and 'value [cms]' columns.
+    - observations (pd.DataFrame): Observations from `load_glcc_observations`.
+    - max_lead (int, optional): Longest lead (in months) to verify. Default = None (all).
+
+    Returns:
+    - pd.DataFrame: One row per model, lead and lake with the 'members', 'forecast' (ensemble mean),
+      'observed' and 'crps' columns ('observed' and 'crps' are NaN when the month is not observed yet).
+    """
+    runs = df['cfs_run'].to_numpy(dtype=np.int64)
+    issue_key = (runs // 1000000) * 12 + (runs // 10000) % 100 - 1
+    valid_key = df['year'].to_numpy(dtype=np.int64) * 12 + df['month'].to_numpy(dtype=np.int64) - 1
+    issue = int(issue_key.min())
+    leads = valid_key - issue
+
+    keep = leads >= 0 if max_lead is None else (leads >= 0) & (leads <= max_lead)
+    run_values, run_codes = np.unique(runs[keep], return_inverse=True)
+    models, model_codes = np.unique(df['model'].astype(str).to_numpy()[keep], return_inverse=True)
+    lakes, lake_codes = np.unique(df['lake'].astype(str).to_numpy()[keep], return_inverse=True)
+    leads = leads[keep]
+    num_leads = int(leads.max()) + 1 if len(leads) else 0
+
+    cube = np.full((len(run_values), len(models), num_leads, len(lakes)), np.nan)
+    cube[run_codes, model_codes, leads, lake_codes] = df['value [cms]'].to_numpy(dtype=np.float64)[keep]
+
+    # Observation of every (lead, lake), NaN outside the GLCC record
+    observed = np.full((num_leads, len(lakes)), np.nan)
+    obs_keys = observations.index.year.to_numpy() * 12 + observations.index.month.to_numpy() - 1
+    positions = issue + np.arange(num_leads) - obs_keys[0]
+    inside = (positions >= 0) & (positions < len(obs_keys))
+    for lake_code, lake in enumerate(lakes):
+        if lake in observations:
+            observed[inside, lake_code] = observations[lake].to_numpy()[positions[inside]]
+
+    # Members are the runs of each model, then every run of every model for the ensemble
+    num_runs = len(run_values)
+    per_model = np.moveaxis(cube, 0, -1)
+    pooled = cube.transpose(2, 3, 0, 1).reshape(1, num_leads, len(lakes), num_runs * len(models))
+    padding = np.full(per_model.shape[:-1] + (pooled.shape[-1] - num_runs,), np.nan)
+    ensembles = np.concatenate([np.concatenate([per_model, padding], axis=-1), pooled], axis=0)
+    counts = (~np.isnan(ensembles)).sum(axis=-1)
+    means = np.where(counts > 0, np.nansum(ensembles, axis=-1) / np.maximum(counts, 1), np.nan)
+    crps = crps_ensemble(np.broadcast_to(observed, means.shape), ensembles)
+
+    names = np.array(list(models) + [ENSEMBLE_ALL])
+    grid = np.indices(means.shape).reshape(3, -1)
+    result = pd.DataFrame({
+        'model': names[grid[0]], 'lead': grid[1], 'lake': lakes[grid[2]],
+        'members': counts.ravel(), 'forecast': means.ravel(),
+        'observed': np.broadcast_to(observed, means.shape).ravel(), 'crps': crps.ravel(),
+    })
+    return result[result['members'] > 0].reset_index(drop=True)
+
+def _open_verification_table(conn, verification_table):
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS "{verification_table}" (
+        batch INTEGER,
+        fingerprint TEXT,
+        model TEXT,
+        lead INTEGER,
+        lake TEXT,
+        members INTEGER,
+        forecast REAL,
+        observed REAL,
+        crps REAL,
+        PRIMARY KEY (batch, model, lead, lake)
+    )
+    ''')
+
+def update_verification(cnbs_database, glcc_dir, table='cnbs_forecast', component='cnbs',
+                        verification_table=VERIFICATION_TABLE, max_lead=None):
+    """
+    Verifies every batch of forecasts (the CFS runs issued in one month) whose forecasts or observations
+    changed since it was last verified, and caches the result in the forecast database.
+
+    Each batch is fingerprinted from SQL aggregates of its forecast rows and from the observations of the
+    months it forecasts, so after a retrain (or a GLCC update) only the batches that changed are read and
+    scored again.
+
+    Parameters:
+    - cnbs_database (str): Path to the CNBS forecast database.
+    - glcc_dir (str): Directory of the GLCC files.
+    - table (str): The CNBS forecast table. Default = 'cnbs_forecast'.
+    - component (str): The forecast component verified against the GLCC NBS. Default = 'cnbs'.
+    - verification_table (str): The cache table. Default = 'cnbs_verification'.
+    - max_lead (int, optional): Longest lead (in months) to verify. Default = None (all).
+
+    Returns:
+    - dict: {'batches': number of batches, 'updated': list of the batches (YYYYMM) scored again}.
+    """
+    observations = load_glcc_observations(glcc_dir)
+    obs_keys = observations.index.year.to_numpy() * 12 + observations.index.month.to_numpy() - 1
+    obs_values = observations.to_numpy()
+
+    conn = sqlite3.connect(cnbs_database)
+    try:
+        _open_verification_table(conn, verification_table)
+        fingerprints = _batch_fingerprints(conn, table, component)
+        cached = dict(conn.execute(f'SELECT batch, fingerprint FROM "{verification_table}" GROUP BY batch').fetchall())
+
+        updated = []
+        for batch, forecast_fingerprint in sorted(fingerprints.items()):
+            # The observations of the 12 months from the issue month on are part of the fingerprint
+            issue = (batch // 100) * 12 + batch % 100 - 1
+            window = obs_values[(obs_keys >= issue) & (obs_keys < issue + 12)]
+            fingerprint = hashlib.sha1((forecast_fingerprint + '|' + str(max_lead)).encode() + window.tobytes()).hexdigest()
+            if cached.get(batch) == fingerprint:
+                continue
+
+            df = pd.read_sql(f'''
+            SELECT cfs_run, year, month, model, lake, "value [cms]" FROM "{table}"
+            WHERE component = ? AND cfs_run >= ? AND cfs_run < ?
+            ''', conn, params=(component, batch * 10000, (batch + 1) * 10000))
+            result = verify_batch(df, observations, max_lead)
+
+            with conn:
+                conn.execute(f'DELETE FROM "{verification_table}" WHERE batch = ?', (batch,))
+                conn.executemany(f'''
+                INSERT INTO "{verification_table}" (batch, fingerprint, model, lead, lake, members, forecast, observed, crps)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(batch, fingerprint, row.model, int(row.lead), row.lake, int(row.members), float(row.forecast),
+                       None if np.isnan(row.observed) else float(row.observed), None if np.isnan(row.crps) else float(row.crps))
+                      for row in result.itertuples()])
+            updated.append(batch)
+
+        # Drop the batches no longer in the forecast table
+        stale = [(batch,) for batch in cached if batch not in fingerprints]
+        if stale:
+            with conn:
+                conn.executemany(f'DELETE FROM "{verification_table}" WHERE batch = ?', stale)
+    finally:
+        conn.close()
+
+    print(f"Verified {len(updated)} of {len(fingerprints)} forecast batches.")
+    return {'batches': len(fingerprints), 'updated': updated}
+
+def skill_scores(cnbs_database, verification_table=VERIFICATION_TABLE, glcc_dir=None, start=None, end=None,
+                 by=('model', 'lead', 'lake')):
+    """
+    Aggregates the cached verification into skill scores: RMSE, R², bias and mean CRPS of the ensemble mean
+    forecasts, computed as grouped array reductions over every verified batch.
+
+    Parameters:
+    - cnbs_database (str): Path to the CNBS forecast database.
+    - verification_table (str): The cache table filled by `update_verification`. Default = 'cnbs_verification'.
+    - glcc_dir (str, optional): Directory of the GLCC files. If given, RMSE, bias and CRPS are also reported in
+      units of the standard deviation of each lake's GLCC record ('rmse_std', 'bias_std', 'crps_std'),
+      computed once per lake. Default = None.
+    - start (int, optional): First batch (YYYYMM) to score. Default = None.
+    - end (int, optional): Last batch (YYYYMM) to score. Default = None.
+    - by (tuple): Columns to group the scores by. Default = ('model', 'lead', 'lake').
+
+    Returns:
+    - pd.DataFrame: One row per group with 'n' (verified forecasts), 'rmse', 'r2', 'bias' and 'crps'.
+    """
+    conn = sqlite3.connect(cnbs_database)
+    try:
+        df = pd.read_sql(f'''
+        SELECT batch, model, lead, lake, forecast, observed, crps FROM "{verification_table}"
+        WHERE observed IS NOT NULL AND batch >= ? AND batch <= ?
+        ''', conn, params=(start if start is not None else 0, end if end is not None else 999999))
+    finally:
+        conn.close()
+
+    by = list(by)
+    error = df['forecast'].to_numpy() - df['observed'].to_numpy()
+    df = df.assign(error=error, squared_error=error ** 2)
+    grouped = df.groupby(by)
+    scores = grouped.agg(n=('error', 'size'), sse=('squared_error', 'sum'), bias=('error', 'mean'), crps=('crps', 'mean'))
+    # R² against the mean of the observations of each group
+    variance = grouped['observed'].agg(lambda observed: np.sum((observed - observed.mean()) ** 2))
+    scores['rmse'] = np.sqrt(scores['sse'] / scores['n'])
+    scores['r2'] = 1 - scores['sse'] / variance.replace(0, np.nan)
+    scores = scores[['n', 'rmse', 'r2', 'bias', 'crps']].reset_index()
+
+    if glcc_dir is not None and 'lake' in by:
+        climate_std = load_glcc_observations(glcc_dir).std()
+        scale = scores['lake'].map(climate_std).to_numpy()
+        for column in ('rmse', 'bias', 'crps'):
+            scores[f'{column}_std'] = scores[column] / scale
+    return scores
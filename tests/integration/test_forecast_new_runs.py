@@ -0,0 +1,76 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.fixtures import cfs_runs, make_cfs_database, make_trained_models
+from src.data_processing import forecast_new_runs, settled_cfs_run
+from src.database_utils import get_forecast_watermarks
+
+@pytest.fixture
+def trained_models(tmp_path_factory):
+    return make_trained_models(str(tmp_path_factory.mktemp('models')))
+
+def recent_runs(num_runs):
+    start = (datetime.now() - timedelta(days=3)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, cfs_runs(start, num_runs)
+
+def forecast(cfs_database, cnbs_database, trained_models):
+    models_info, x_scaler, y_scaler = trained_models
+    return forecast_new_runs(str(cfs_database), str(cnbs_database), x_scaler, y_scaler, models_info)
+
+def watermarks(cnbs_database):
+    with sqlite3.connect(cnbs_database) as conn:
+        return get_forecast_watermarks(conn)
+
+def test_run_committed_out_of_order_is_forecast(tmp_path, trained_models):
+    start, runs = recent_runs(8)
+    cfs_database, cnbs_database = tmp_path / 'cfs.db', tmp_path / 'cnbs.db'
+    make_cfs_database(str(cfs_database), 8, start=start)
+
+    # The fourth run is committed after the later ones (as by a parallel ingest)
+    with sqlite3.connect(cfs_database) as conn:
+        late_rows = conn.execute('SELECT * FROM cfs_forecast_data WHERE cfs_run = ?', (int(runs[3]),)).fetchall()
+        conn.execute('DELETE FROM cfs_forecast_data WHERE cfs_run = ?', (int(runs[3]),))
+
+    result = forecast(cfs_database, cnbs_database, trained_models)
+    assert result['runs'] == [int(run) for run in runs if run != runs[3]]
+    assert set(watermarks(cnbs_database).values()) == {int(runs[2])}
+
+    with sqlite3.connect(cfs_database) as conn:
+        conn.executemany(f'INSERT INTO cfs_forecast_data VALUES ({", ".join("?" * 7)})', late_rows)
+
+    result = forecast(cfs_database, cnbs_database, trained_models)
+    assert result['runs'] == [int(runs[3])]
+    assert set(watermarks(cnbs_database).values()) == {int(runs[-1])}
+    assert forecast(cfs_database, cnbs_database, trained_models)['rows'] == 0
+
+def test_incomplete_run_is_completed_later(tmp_path, trained_models):
+    start, runs = recent_runs(4)
+    cfs_database, cnbs_database = tmp_path / 'cfs.db', tmp_path / 'cnbs.db'
+    make_cfs_database(str(cfs_database), 4, start=start)
+
+    # One forecast month of the second run misses a feature
+    with sqlite3.connect(cfs_database) as conn:
+        missing = conn.execute('''SELECT * FROM cfs_forecast_data WHERE cfs_run = ? AND component = 'evaporation'
+                                  ORDER BY year, month LIMIT 1''', (int(runs[1]),)).fetchone()
+        conn.execute('DELETE FROM cfs_forecast_data WHERE cfs_run = ? AND year = ? AND month = ? AND lake = ? AND surface_type = ? AND component = ?',
+                     missing[:6])
+
+    result = forecast(cfs_database, cnbs_database, trained_models)
+    assert int(runs[1]) in result['runs']
+    assert set(watermarks(cnbs_database).values()) == {int(runs[0])}
+
+    with sqlite3.connect(cfs_database) as conn:
+        conn.execute(f'INSERT INTO cfs_forecast_data VALUES ({", ".join("?" * 7)})', missing)
+
+    result = forecast(cfs_database, cnbs_database, trained_models)
+    assert result['runs'] == [int(runs[1])]
+    assert result['months'] == [(missing[1], missing[2])]
+    assert set(watermarks(cnbs_database).values()) == {int(runs[-1])}
+
+def test_old_gaps_are_not_waited_for():
+    runs = {2025010100, 2025010106, 2025010200, 2025011500}
+    assert settled_cfs_run(runs, set(), 2025010100, 2025011500, recheck_days=7, include_start=True) == 2025010718
+    assert settled_cfs_run(runs, set(), 2025010100, 2025011500, recheck_days=30, include_start=True) == 2025010106
+    assert settled_cfs_run(runs, {2025010100}, 2025010100, 2025011500, recheck_days=30, include_start=True) is None
@@ -0,0 +1,275 @@
+"""
+Byte-range GRIB subsetting against a local HTTP server with Range support and a local S3 stand-in (moto).
+
+The GRIB files are written with ecCodes on a regional 0.5 degree grid around the Great Lakes, with an
+inventory (.idx) in the wgrib2 format the CFS files are published with, and uniform fields whose basin
+averages are known.
+"""
+import functools
+import http.server
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+eccodes = pytest.importorskip('eccodes')
+pytest.importorskip('cfgrib')
+
+from benchmarks.fixtures import MASK_VARIABLES, write_gl_mask
+from src.cache_utils import GribCache
+from src.data_processing import process_grib_files
+from src.database_utils import GRIB_SUBSET_PATTERNS, download_cfs_run, download_grb2_ncei, download_grb2_subset_http, \
+    download_grb2_subset_s3, open_cfs_db
+from src.hydro_utils import calculate_evaporation, calculate_grid_cell_areas
+
+CFS_RUN = '2025050100'
+FORECAST = '202506'
+
+# Grid of the test files: 0.5 degree, north to south, covering the mask domain
+LATITUDES = np.arange(52.0, 39.75, -0.5)
+LONGITUDES = np.arange(266.0, 287.25, 0.5)
+
+# (inventory variable and level, ecCodes keys, uniform value) of the messages of each product
+MESSAGES = {
+    'pgbf': [('PRES:surface', [('shortName', 'sp')], 1e5),
+             ('APCP:surface', [('productDefinitionTemplateNumber', 8), ('shortName', 'tp')], 1e-4),
+             ('TMP:2 m above ground', [('shortName', '2t')], 290.0)],
+    'flxf': [('PRES:surface', [('shortName', 'sp')], 1e5),
+             ('TMP:2 m above ground', [('productDefinitionTemplateNumber', 8), ('shortName', 'avg_2t')], 285.0),
+             ('UGRD:10 m above ground', [('shortName', '10u')], 3.0),
+             ('LHTFL:surface', [('productDefinitionTemplateNumber', 8), ('shortName', 'avg_slhtf')], 40.0),
+             ('PRMSL:mean sea level', [('shortName', 'prmsl')], 1e5)],
+}
+
+def write_grib(path, messages):
+    """Writes uniform GRIB2 messages and their .idx inventory. Returns the bytes of each message."""
+    encoded = []
+    for _, keys, value in messages:
+        handle = eccodes.codes_grib_new_from_samples('regular_ll_sfc_grib2')
+        grid = [('Ni', len(LONGITUDES)), ('Nj', len(LATITUDES)),
+                ('latitudeOfFirstGridPointInDegrees', LATITUDES[0]), ('longitudeOfFirstGridPointInDegrees', LONGITUDES[0]),
+                ('latitudeOfLastGridPointInDegrees', LATITUDES[-1]), ('longitudeOfLastGridPointInDegrees', LONGITUDES[-1]),
+                ('iDirectionIncrementInDegrees', 0.5), ('jDirectionIncrementInDegrees', 0.5),
+                ('dataDate', int(CFS_RUN[:8])), ('dataTime', 0)]
+        for key, key_value in grid + keys:
+            eccodes.codes_set(handle, key, key_value)
+        eccodes.codes_set_values(handle, np.full(len(LATITUDES) * len(LONGITUDES), value))
+        encoded.append(eccodes.codes_get_message(handle))
+        eccodes.codes_release(handle)
+
+    with open(path, 'wb') as f:
+        f.write(b''.join(encoded))
+    offsets = np.cumsum([0] + [len(message) for message in encoded])
+    with open(path + '.idx', 'w') as f:
+        for number, ((variable, _, _), offset) in enumerate(zip(messages, offsets), start=1):
+            f.write(f'{number}:{offset}:d={CFS_RUN}:{variable}:1 month fcst:\n')
+    return encoded
+
+@pytest.fixture
+def remote_dir(tmp_path):
+    """A directory with the pgbf and flxf files of one forecast month, and the bytes of their messages."""
+    directory = tmp_path / 'remote'
+    directory.mkdir()
+    messages = {product: write_grib(str(directory / f'{product}.01.{CFS_RUN}.{FORECAST}.avrg.grib.grb2'), specs)
+                for product, specs in MESSAGES.items()}
+    return directory, messages
+
+def selected(messages, product, patterns):
+    """The bytes of the messages of a product that match the patterns, in file order."""
+    return b''.join(message for (variable, _, _), message in zip(MESSAGES[product], messages[product])
+                    if any(pattern in f':{variable}:' for pattern in patterns))
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler that honours single byte ranges (206) and records the requests."""
+
+    requests = []
+
+    def send_head(self):
+        type(self).requests.append((self.command, self.path, self.headers.get('Range')))
+        path = self.translate_path(self.path)
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if match is None or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        return _Limited(f, end - start + 1)
+
+    def log_message(self, *args):
+        pass
+
+class _Limited:
+    """File object that reads at most `remaining` bytes (the requested range)."""
+
+    def __init__(self, f, remaining):
+        self.f, self.remaining = f, remaining
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+@pytest.fixture
+def http_server(remote_dir):
+    directory, _ = remote_dir
+    RangeHandler.requests = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(RangeHandler, directory=str(directory)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+    server.server_close()
+
+def ingest(download_dir, tmp_path):
+    """Runs process_grib_files on the downloaded files and returns {(lake, surface, component): value}."""
+    import netCDF4 as nc
+
+    database = str(tmp_path / 'cfs.db')
+    conn, _ = open_cfs_db(database)
+    conn.close()
+    with nc.Dataset(write_gl_mask(str(tmp_path / 'GL_mask.nc'))) as mask_ds:
+        mask_lat, mask_lon = mask_ds.variables['latitude'][:], mask_ds.variables['longitude'][:]
+        process_grib_files(str(download_dir), database, 'cfs_forecast_data', CFS_RUN, mask_lat, mask_lon, mask_ds,
+                           MASK_VARIABLES, calculate_grid_cell_areas(mask_lon, mask_lat), index_dir=str(tmp_path / 'index'))
+    with sqlite3.connect(database) as conn:
+        rows = conn.execute('SELECT lake, surface_type, component, "value [mm]" FROM cfs_forecast_data').fetchall()
+    return {row[:3]: row[3] for row in rows}
+
+def check_basin_averages(values):
+    expected = {'precipitation': 1e-4 * 4 * 30, 'air_temperature': 285.0,
+                'evaporation': calculate_evaporation(285.0, 40.0) * 30 * 86400}
+    assert len(values) == 3 * len(MASK_VARIABLES)
+    for (_, _, component), value in values.items():
+        assert value == pytest.approx(expected[component], rel=1e-5)
+
+def test_parse_idx_ranges_match_messages(remote_dir):
+    from src.database_utils import parse_grib_idx, select_grib_ranges
+
+    directory, messages = remote_dir
+    with open(directory / f'flxf.01.{CFS_RUN}.{FORECAST}.avrg.grib.grb2.idx') as f:
+        ranges = select_grib_ranges(parse_grib_idx(f.read()), GRIB_SUBSET_PATTERNS['flx'])
+
+    lengths = [len(message) for message in messages['flxf']]
+    offsets = np.cumsum([0] + lengths)
+    assert ranges == [(offsets[1], offsets[2] - 1), (offsets[3], offsets[4] - 1)]
+
+@pytest.mark.parametrize('product, patterns', [('pgbf', GRIB_SUBSET_PATTERNS['pgb']), ('flxf', GRIB_SUBSET_PATTERNS['flx'])])
+def test_http_subset_has_only_selected_messages(remote_dir, http_server, tmp_path, product, patterns):
+    _, messages = remote_dir
+    filename = f'{product}.01.{CFS_RUN}.{FORECAST}.avrg.grib.grb2'
+    local_path = str(tmp_path / filename)
+
+    num_bytes = download_grb2_subset_http(http_server + filename, local_path, patterns)
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == selected(messages, product, patterns)
+    assert num_bytes == len(selected(messages, product, patterns))
+    assert all(method == 'GET' and (path.endswith('.idx') or byte_range) for method, path, byte_range in RangeHandler.requests)
+
+def test_http_subset_without_inventory(http_server, tmp_path):
+    assert download_grb2_subset_http(http_server + 'missing.grb2', str(tmp_path / 'missing.grb2'), [':APCP:surface:']) is None
+
+def test_ncei_subset_is_ingested(remote_dir, http_server, tmp_path):
+    download_dir = tmp_path / 'download'
+    download_dir.mkdir()
+    for product in ('pgb', 'flx'):
+        download_grb2_ncei(product, http_server, str(download_dir), subset=True)
+
+    _, messages = remote_dir
+    for product, patterns in (('pgbf', GRIB_SUBSET_PATTERNS['pgb']), ('flxf', GRIB_SUBSET_PATTERNS['flx'])):
+        with open(download_dir / f'{product}.01.{CFS_RUN}.{FORECAST}.avrg.grib.grb2', 'rb') as f:
+            assert f.read() == selected(messages, product, patterns)
+    check_basin_averages(ingest(download_dir, tmp_path))
+
+def write_listing(directory):
+    """Writes an Apache-style index.html (name, last modified and size columns) of the GRIB files."""
+    rows = ''.join(f'<tr><td><a href="{name}">{name}</a></td><td align="right">2025-05-01 10:04  </td>'
+                   f'<td align="right">{os.path.getsize(directory / name)}</td><td>&nbsp;</td></tr>\n'
+                   for name in sorted(os.listdir(directory)) if name.endswith('.grb2'))
+    (directory / 'index.html').write_text(f'<html><body><table>\n{rows}</table></body></html>\n')
+
+def test_ncei_cache_hit_needs_no_request(remote_dir, http_server, tmp_path):
+    directory, _ = remote_dir
+    write_listing(directory)
+    cache = GribCache(str(tmp_path / 'cache'))
+
+    for attempt in range(2):
+        RangeHandler.requests = []
+        download_dir = tmp_path / f'download{attempt}'
+        download_dir.mkdir()
+        download_grb2_ncei('flx', http_server, str(download_dir), cache=cache)
+        assert os.path.exists(download_dir / f'flxf.01.{CFS_RUN}.{FORECAST}.avrg.grib.grb2')
+
+    # Only the listing is requested when the cached copy is up to date
+    assert [(method, path) for method, path, _ in RangeHandler.requests] == [('GET', '/')]
+
+def test_ncei_cache_without_listing_columns_uses_head(remote_dir, http_server, tmp_path):
+    cache = GribCache(str(tmp_path / 'cache'))
+    download_dir = tmp_path / 'download'
+    download_dir.mkdir()
+    download_grb2_ncei('flx', http_server, str(download_dir), cache=cache)
+
+    assert ('HEAD', f'/flxf.01.{CFS_RUN}.{FORECAST}.avrg.grib.grb2', None) in RangeHandler.requests
+
+@pytest.fixture
+def s3_bucket(remote_dir, monkeypatch):
+    """A moto S3 bucket holding the files of the run under the CFS key layout."""
+    moto = pytest.importorskip('moto')
+    import boto3
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    directory, _ = remote_dir
+    with moto.mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='cfs-test')
+        # Public like the NOAA bucket, which the downloads read without credentials
+        s3.put_bucket_policy(Bucket='cfs-test', Policy=json.dumps({'Version': '2012-10-17', 'Statement': [
+            {'Effect': 'Allow', 'Principal': '*', 'Action': ['s3:GetObject', 's3:ListBucket'],
+             'Resource': ['arn:aws:s3:::cfs-test', 'arn:aws:s3:::cfs-test/*']}]}))
+        prefix = f'cfs.{CFS_RUN[:8]}/{CFS_RUN[8:]}/monthly_grib_01/'
+        for name in os.listdir(directory):
+            s3.upload_file(str(directory / name), 'cfs-test', prefix + name)
+        yield s3, 'cfs-test', prefix
+
+@pytest.mark.parametrize('product, patterns', [('pgbf', GRIB_SUBSET_PATTERNS['pgb']), ('flxf', GRIB_SUBSET_PATTERNS['flx'])])
+def test_s3_subset_has_only_selected_messages(remote_dir, s3_bucket, tmp_path, product, patterns):
+    _, messages = remote_dir
+    s3, bucket, prefix = s3_bucket
+    local_path = str(tmp_path / 'subset.grb2')
+
+    num_bytes = download_grb2_subset_s3(s3, bucket, f'{prefix}{product}.01.{CFS_RUN}.{FORECAST}.avrg.grib.grb2', local_path, patterns)
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == selected(messages, product, patterns)
+    assert num_bytes == len(selected(messages, product, patterns))
+
+def test_aws_subset_run_is_ingested(remote_dir, s3_bucket, tmp_path):
+    _, messages = remote_dir
+    _, bucket, _ = s3_bucket
+    download_dir = tmp_path / 'download'
+
+    assert download_cfs_run(datetime.strptime(CFS_RUN, '%Y%m%d%H'), str(download_dir), bucket_name=bucket, subset=True)
+
+    for product, patterns in (('pgbf', GRIB_SUBSET_PATTERNS['pgb']), ('flxf', GRIB_SUBSET_PATTERNS['flx'])):
+        with open(download_dir / f'{product}.01.{CFS_RUN}.{FORECAST}.avrg.grib.grb2', 'rb') as f:
+            assert f.read() == selected(messages, product, patterns)
+    check_basin_averages(ingest(download_dir, tmp_path))
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import MASK_VARIABLES, cfs_runs, make_cfs_fields, synthetic_grib_reader, write_gl_mask, \
+    write_grib_placeholders
+from src.archive_utils import CFSArchive
+from src.data_processing import process_cfs_range
+
+RUNS = cfs_runs(datetime(2025, 1, 1), 8)
+
+@pytest.fixture
+def download_dir(tmp_path):
+    """Two days of CFS runs, the fifth of which has no GRIB files."""
+    directory = tmp_path / 'CFS'
+    for cfs_run in RUNS:
+        write_grib_placeholders(str(directory / cfs_run[:8]), [cfs_run])
+    for name in os.listdir(directory / RUNS[4][:8]):
+        if RUNS[4] in name:
+            os.remove(directory / RUNS[4][:8] / name)
+    return str(directory)
+
+def ingest(tmp_path, download_dir, workers, runs_per_commit):
+    name = f'{workers}-{runs_per_commit}'
+    database = str(tmp_path / f'cfs-{name}.db')
+    archive = CFSArchive(str(tmp_path / f'archive-{name}'))
+    with synthetic_grib_reader(make_cfs_fields()):
+        result = process_cfs_range('01-01-2025', '01-02-2025', download_dir, database,
+                                   write_gl_mask(str(tmp_path / 'GL_mask.nc')), MASK_VARIABLES,
+                                   workers=workers, runs_per_commit=runs_per_commit, archive=archive)
+    with sqlite3.connect(database) as conn:
+        rows = pd.read_sql('SELECT * FROM cfs_forecast_data ORDER BY cfs_run, year, month, lake, surface_type, component', conn)
+    return result, rows, archive.feature_matrix()
+
+def test_parallel_ingest_writes_the_same_rows(tmp_path, download_dir):
+    result, rows, features = ingest(tmp_path, download_dir, workers=1, runs_per_commit=1)
+
+    assert result['processed'] == [run for run in RUNS if run != RUNS[4]]
+    assert list(result['failed']) == [RUNS[4]]
+    assert sorted(rows['cfs_run'].unique().tolist()) == [int(run) for run in result['processed']]
+
+    for workers, runs_per_commit in [(2, 1), (2, 3), (3, 8)]:
+        parallel_result, parallel_rows, parallel_features = ingest(tmp_path, download_dir, workers, runs_per_commit)
+        assert parallel_result == result
+        pd.testing.assert_frame_equal(parallel_rows, rows)
+        pd.testing.assert_frame_equal(parallel_features, features)
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import src.pipeline as pipeline
+from benchmarks.fixtures import MASK_VARIABLES, cfs_runs, make_cfs_fields, synthetic_grib_reader, write_gl_mask, \
+    write_grib_placeholders
+from src.data_processing import process_cfs_range
+from src.pipeline import stream_cfs_runs
+
+RUNS = cfs_runs(datetime(2025, 1, 1), 8)
+MISSING_RUN = RUNS[5]
+
+def grib_runs(download_dir):
+    """The CFS runs with GRIB files on disk."""
+    return {name.split('.')[2] for _, _, files in os.walk(download_dir) for name in files if name.endswith('.grb2')}
+
+@pytest.fixture
+def fake_download(monkeypatch):
+    """Replaces the download with placeholder files, recording how many runs are on disk at each download."""
+    on_disk = []
+
+    def download_cfs_run(date, download_path, **kwargs):
+        cfs_run = date.strftime('%Y%m%d%H')
+        on_disk.append(len(grib_runs(os.path.dirname(download_path))))
+        if cfs_run == MISSING_RUN:
+            return False
+        write_grib_placeholders(download_path, [cfs_run])
+        return True
+
+    monkeypatch.setattr(pipeline, 'download_cfs_run', download_cfs_run)
+    return on_disk
+
+def stored_rows(database):
+    with sqlite3.connect(database) as conn:
+        return pd.read_sql('SELECT * FROM cfs_forecast_data ORDER BY cfs_run, year, month, lake, surface_type, component', conn)
+
+@pytest.mark.parametrize('queue_size, runs_per_commit', [(1, 1), (2, 3)])
+def test_streamed_runs_match_a_batch_ingest(tmp_path, fake_download, queue_size, runs_per_commit):
+    download_dir, mask_file = str(tmp_path / 'CFS'), write_gl_mask(str(tmp_path / 'GL_mask.nc'))
+    database = str(tmp_path / 'stream.db')
+
+    with synthetic_grib_reader(make_cfs_fields()):
+        result = stream_cfs_runs('01-01-2025', '01-02-2025', download_dir, database, mask_file, MASK_VARIABLES,
+                                 queue_size=queue_size, runs_per_commit=runs_per_commit)
+
+    assert result['processed'] == [run for run in RUNS if run != MISSING_RUN]
+    assert list(result['failed']) == [MISSING_RUN]
+    # Every run's files are released once committed, and the queue bounds the runs waiting on disk
+    assert grib_runs(download_dir) == set()
+    assert max(fake_download) <= queue_size + runs_per_commit + 1
+
+    # The same files ingested in one batch give the same rows
+    for cfs_run in result['processed']:
+        write_grib_placeholders(os.path.join(download_dir, cfs_run[:8]), [cfs_run])
+    batch_database = str(tmp_path / 'batch.db')
+    with synthetic_grib_reader(make_cfs_fields()):
+        process_cfs_range('01-01-2025', '01-02-2025', download_dir, batch_database, mask_file, MASK_VARIABLES)
+    pd.testing.assert_frame_equal(stored_rows(database), stored_rows(batch_database))
+
+def test_files_are_kept_when_asked(tmp_path, fake_download):
+    download_dir = str(tmp_path / 'CFS')
+    with synthetic_grib_reader(make_cfs_fields()):
+        stream_cfs_runs('01-01-2025 00', '01-01-2025 12', download_dir, str(tmp_path / 'cfs.db'),
+                        write_gl_mask(str(tmp_path / 'GL_mask.nc')), MASK_VARIABLES, delete_files=False)
+
+    assert grib_runs(download_dir) == set(RUNS[:3])
+
+def test_runs_without_data_are_reported_and_released(tmp_path, fake_download):
+    download_dir = str(tmp_path / 'CFS')
+    # Files without the requested fields give no rows for any forecast month
+    with synthetic_grib_reader({'pgbf': {}, 'flxf': {}}):
+        result = stream_cfs_runs('01-01-2025', '01-02-2025', download_dir, str(tmp_path / 'cfs.db'),
+                                 write_gl_mask(str(tmp_path / 'GL_mask.nc')), MASK_VARIABLES, queue_size=1)
+
+    assert result['processed'] == []
+    assert list(result['failed']) == RUNS
+    assert result['failed'][MISSING_RUN] == "Run not available from the source."
+    assert grib_runs(download_dir) == set()
+    with sqlite3.connect(str(tmp_path / 'cfs.db')) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM cfs_forecast_data').fetchone()[0] == 0
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import MASK_VARIABLES, cfs_runs, make_cfs_database, make_cfs_fields, synthetic_grib_reader, \
+    write_gl_mask, write_grib_placeholders
+from src.archive_utils import ARCHIVE_VARIABLES, CFSArchive, export_cfs_archive
+from src.data_processing import FEATURE_COLUMNS, load_feature_matrix, process_grib_files
+from src.database_utils import CFSWriter, open_cfs_db
+
+def run_frame(cfs_run, value, variables=ARCHIVE_VARIABLES, num_months=3):
+    """Long rows of one run for the forecast months after it, every value equal to `value`."""
+    year, month = int(str(cfs_run)[:4]), int(str(cfs_run)[4:6])
+    rows = []
+    for lead in range(1, num_months + 1):
+        valid_year, valid_month = year + (month + lead - 1) // 12, (month + lead - 1) % 12 + 1
+        for variable in variables:
+            lake, surface_type, component = variable.split('_', 2)
+            rows.append((int(cfs_run), valid_year, valid_month, lake, surface_type, component, float(value)))
+    return pd.DataFrame(rows, columns=['cfs_run', 'year', 'month', 'lake', 'surface_type', 'component', 'value [mm]'])
+
+def test_feature_matrix_matches_load_feature_matrix(tmp_path):
+    database = str(tmp_path / 'cfs.db')
+    make_cfs_database(database, 12, start=datetime(2024, 12, 30))
+    archive = export_cfs_archive(database, str(tmp_path / 'archive'), chunk_runs=5)
+
+    expected = load_feature_matrix(database)
+    actual = archive.feature_matrix()
+
+    assert len(archive) == 12
+    assert list(actual.columns) == FEATURE_COLUMNS
+    expected.index = expected.index.set_levels([level.astype(np.int64) for level in expected.index.levels])
+    actual = actual.loc[expected.index]
+    # The archive stores float32 values
+    np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol=1e-6)
+
+    # A later export only adds the new runs
+    make_cfs_database(database, 4, start=datetime(2025, 1, 2, 12), seed=1)
+    assert len(export_cfs_archive(database, str(tmp_path / 'archive'))) == 16
+
+def test_out_of_order_appends_keep_the_runs_sorted_and_open_readers_unchanged(tmp_path):
+    archive_dir = str(tmp_path / 'archive')
+    archive = CFSArchive(archive_dir)
+    for i, cfs_run in enumerate(cfs_runs(datetime(2000, 1, 1), 4)):
+        archive.append_frame(run_frame(cfs_run, i))
+
+    reader = CFSArchive(archive_dir, mode='r')
+    runs_before = np.array(reader.runs)
+    values_before = np.array(reader.values)
+
+    archive.append_frame(pd.concat([run_frame(1999123118, 10), run_frame(2000010103, 11)]))
+
+    assert archive.runs.tolist() == [1999123118, 2000010100, 2000010103, 2000010106, 2000010112, 2000010118]
+    assert np.all(archive.values[0, 1:4] == 10) and np.all(archive.values[2, 1:4] == 11)
+    assert np.all(archive.values[1, 1:4] == 0) and np.all(archive.values[5, 1:4] == 3)
+    # The reader opened before the insert still sees its runs in the same rows
+    assert np.array_equal(reader.runs, runs_before)
+    np.testing.assert_array_equal(reader.values, values_before)
+
+    reopened = CFSArchive(archive_dir, mode='r')
+    assert np.array_equal(reopened.runs, archive.runs)
+    np.testing.assert_array_equal(reopened.values, archive.values)
+
+def test_partial_runs_are_completed_over_several_appends(tmp_path):
+    archive = CFSArchive(str(tmp_path / 'archive'))
+    half = len(ARCHIVE_VARIABLES) // 2
+    archive.append_frame(run_frame(2000010100, 1.0, ARCHIVE_VARIABLES[:half]))
+
+    assert len(archive) == 1
+    assert archive.feature_matrix().empty
+
+    archive.append_frame(run_frame(2000010100, 2.0, ARCHIVE_VARIABLES[half:]))
+    X = archive.feature_matrix()
+
+    assert len(archive) == 1
+    assert len(X) == 3
+    assert np.all(X[ARCHIVE_VARIABLES[:half]] == 1.0) and np.all(X[ARCHIVE_VARIABLES[half:]] == 2.0)
+    assert X.index.get_level_values('month').tolist() == [2, 3, 4]
+
+def test_runs_are_archived_only_once_committed(tmp_path):
+    import netCDF4 as nc
+    from src.hydro_utils import calculate_grid_cell_areas
+
+    runs = cfs_runs(datetime(2025, 1, 1), 3)
+    grib_dir = str(tmp_path / 'grib')
+    write_grib_placeholders(grib_dir, runs)
+    database = str(tmp_path / 'cfs.db')
+    conn, _ = open_cfs_db(database)
+    conn.close()
+    archive = CFSArchive(str(tmp_path / 'archive'))
+
+    with nc.Dataset(write_gl_mask(str(tmp_path / 'GL_mask.nc'))) as mask_ds:
+        mask_lat, mask_lon = mask_ds.variables['latitude'][:], mask_ds.variables['longitude'][:]
+        area = calculate_grid_cell_areas(mask_lon, mask_lat)
+
+        def ingest(writer, cfs_run):
+            process_grib_files(grib_dir, database, 'cfs_forecast_data', cfs_run, mask_lat, mask_lon, mask_ds,
+                               MASK_VARIABLES, area, writer=writer, archive=archive)
+
+        with synthetic_grib_reader(make_cfs_fields()):
+            with CFSWriter(database, runs_per_commit=2) as writer:
+                ingest(writer, runs[0])
+                assert len(archive) == 0
+                ingest(writer, runs[1])
+                assert archive.runs.tolist() == [int(run) for run in runs[:2]]
+
+            # A run whose commit never happens is not archived
+            with pytest.raises(RuntimeError):
+                with CFSWriter(database, runs_per_commit=2) as writer:
+                    ingest(writer, runs[2])
+                    raise RuntimeError("crash before the commit")
+
+    assert archive.runs.tolist() == [int(run) for run in runs[:2]]
+    with sqlite3.connect(database) as conn:
+        assert conn.execute('SELECT COUNT(DISTINCT cfs_run) FROM cfs_forecast_data').fetchone()[0] == 2
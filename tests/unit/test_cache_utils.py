@@ -0,0 +1,114 @@
+import os
+import sqlite3
+
+import pytest
+
+from src.cache_utils import GribCache, link_cached_file
+
+def writer(content, calls):
+    """A download function writing `content`, recording each call."""
+    def download(path):
+        calls.append(path)
+        with open(path, 'wb') as f:
+            f.write(content)
+    return download
+
+def test_fetch_downloads_on_a_miss_and_reuses_on_a_hit(tmp_path):
+    cache, calls = GribCache(str(tmp_path / 'cache')), []
+
+    path, hit = cache.fetch('cfs/pgbf.grb2', 'etag1', 4, writer(b'abcd', calls))
+    assert not hit and len(calls) == 1
+    assert open(path, 'rb').read() == b'abcd'
+
+    assert cache.fetch('cfs/pgbf.grb2', 'etag1', 4, writer(b'xxxx', calls)) == (path, True)
+    assert len(calls) == 1
+
+    # A new ETag or another variant is a different object
+    assert not cache.fetch('cfs/pgbf.grb2', 'etag2', 4, writer(b'efgh', calls))[1]
+    assert not cache.fetch('cfs/pgbf.grb2', 'etag1', 4, writer(b'ab', calls), variant='subset')[1]
+    assert len(calls) == 3
+    assert not [name for name in os.listdir(cache.cache_dir) if name.endswith('.part')]
+
+def test_index_persists_across_instances(tmp_path):
+    calls = []
+    path, _ = GribCache(str(tmp_path)).fetch('key', 'etag', 3, writer(b'abc', calls))
+
+    cache = GribCache(str(tmp_path))
+    assert cache.lookup('key', 'etag', 3) == path
+    assert cache.total_bytes() == 3
+
+def test_truncated_file_is_fetched_again(tmp_path):
+    cache, calls = GribCache(str(tmp_path)), []
+    path, _ = cache.fetch('key', 'etag', 4, writer(b'abcd', calls))
+    with open(path, 'wb') as f:
+        f.write(b'ab')
+
+    assert cache.lookup('key', 'etag', 4) is None
+    path, hit = cache.fetch('key', 'etag', 4, writer(b'abcd', calls))
+    assert not hit and open(path, 'rb').read() == b'abcd'
+    assert len(calls) == 2
+
+def test_failed_download_leaves_nothing_behind(tmp_path):
+    cache = GribCache(str(tmp_path))
+
+    def failing(path):
+        open(path, 'wb').write(b'partial')
+        raise IOError("connection reset")
+
+    with pytest.raises(IOError):
+        cache.fetch('key', 'etag', 7, failing)
+    assert cache.lookup('key', 'etag', 7) is None
+    assert cache.total_bytes() == 0
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.part')]
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path):
+    cache, calls = GribCache(str(tmp_path), max_bytes=25), []
+    paths = {key: cache.fetch(key, 'etag', 10, writer(b'x' * 10, calls))[0] for key in ('a', 'b')}
+    # Use 'a' so 'b' is the least recently used entry
+    assert cache.lookup('a', 'etag', 10) == paths['a']
+
+    cache.fetch('c', 'etag', 10, writer(b'x' * 10, calls))
+
+    assert cache.lookup('b', 'etag', 10) is None
+    assert not os.path.exists(paths['b'])
+    assert cache.lookup('a', 'etag', 10) == paths['a']
+    assert cache.lookup('c', 'etag', 10) is not None
+    assert cache.total_bytes() == 20
+
+def test_linked_entries_are_not_evicted_until_released(tmp_path):
+    cache, calls = GribCache(str(tmp_path / 'cache'), max_bytes=15), []
+    cached, _ = cache.fetch('a', 'etag', 10, writer(b'x' * 10, calls))
+    download = link_cached_file(cached, str(tmp_path / 'download' / 'a.grb2'))
+    assert os.stat(download).st_nlink == 2
+
+    # Evicting 'a' would not free its bytes while the download directory links it
+    cache.fetch('b', 'etag', 10, writer(b'y' * 10, calls))
+    assert os.path.exists(cached)
+    assert cache.total_bytes() == 20
+
+    os.remove(download)
+    assert cache.evict() == 10
+    assert cache.lookup('a', 'etag', 10) is None
+    assert cache.total_bytes() == 10
+
+def test_index_connections_are_closed(tmp_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    class TrackedConnection(sqlite3.Connection):
+        def close(self):
+            opened.remove(self)
+            super().close()
+
+    def tracked_connect(*args, **kwargs):
+        conn = connect(*args, factory=TrackedConnection, **kwargs)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(sqlite3, 'connect', tracked_connect)
+    cache = GribCache(str(tmp_path), max_bytes=100)
+    cache.fetch('key', 'etag', 3, writer(b'abc', []))
+    cache.lookup('key', 'etag', 3)
+    cache.total_bytes()
+    cache.evict()
+    assert opened == []
@@ -0,0 +1,99 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.catalog_utils as catalog_utils
+from src.catalog_utils import GLCC_FILES, DataCatalog
+
+ERIE_FILE = GLCC_FILES['erie']
+
+@pytest.fixture
+def data_dir(tmp_path):
+    shutil.copytree('data/glcc', tmp_path / 'data' / 'glcc')
+    return str(tmp_path / 'data')
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Records the sources parsed from their CSV files."""
+    parsed = []
+    parse_source = catalog_utils.parse_source
+
+    def recording_parse_source(source, directory):
+        parsed.append(source)
+        return parse_source(source, directory)
+
+    monkeypatch.setattr(catalog_utils, 'parse_source', recording_parse_source)
+    return parsed
+
+def set_erie_value(data_dir, year, month, value):
+    """Rewrites one monthly value of the Erie GLCC file."""
+    path = os.path.join(data_dir, 'glcc', ERIE_FILE)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    row = next(i for i, line in enumerate(lines) if line.startswith(f'{year},'))
+    values = lines[row].split(',')
+    values[month] = value
+    lines[row] = ','.join(values)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def test_frame_matches_the_csv_files(data_dir):
+    observed = DataCatalog(data_dir).frame('glcc', lakes=['erie'], columns='{lake}')['erie']
+
+    glcc = pd.read_csv(os.path.join(data_dir, 'glcc', ERIE_FILE), comment='#', skipinitialspace=True)
+    glcc.columns = [column.strip() for column in glcc.columns]
+    expected = glcc.set_index('Year').iloc[:, :12].stack().to_numpy(dtype=np.float64)
+    expected = expected[:np.flatnonzero(expected > -9999)[-1] + 1]
+
+    assert observed.index[0] == pd.Timestamp('1900-01-01')
+    np.testing.assert_array_equal(observed.to_numpy(), np.where(expected <= -9999, np.nan, expected))
+
+def test_cached_array_is_reused_until_a_file_changes(data_dir, parses):
+    first = DataCatalog(data_dir).load('glcc')
+    assert parses == ['glcc']
+    assert os.path.exists(os.path.join(data_dir, '.catalog', 'glcc.npy'))
+
+    # A new catalog (as in a new process) reads the cached array
+    cached = DataCatalog(data_dir).load('glcc')
+    assert parses == ['glcc']
+    np.testing.assert_array_equal(cached['values'], first['values'])
+
+    # A touched file with the same content keeps the cached array
+    path = os.path.join(data_dir, 'glcc', ERIE_FILE)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    catalog = DataCatalog(data_dir)
+    catalog.load('glcc')
+    assert parses == ['glcc']
+
+    # A changed value is parsed again, by the catalog in memory as well
+    set_erie_value(data_dir, 2020, 3, '4321.0')
+    changed = catalog.load('glcc')
+    assert parses == ['glcc', 'glcc']
+    lake, year = changed['lakes'].index('erie'), changed['years'].index(2020)
+    assert changed['values'][lake, 0, year, 2] == 4321.0
+    assert DataCatalog(data_dir).load('glcc')['values'][lake, 0, year, 2] == 4321.0
+    assert parses == ['glcc', 'glcc']
+
+def test_cache_of_another_directory_or_version_is_not_used(data_dir, tmp_path, parses, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    DataCatalog(data_dir, cache_dir=cache_dir).load('glcc')
+
+    other_dir = str(tmp_path / 'other')
+    shutil.copytree(os.path.join(data_dir, 'glcc'), other_dir)
+    DataCatalog(data_dir, cache_dir=cache_dir, directories={'glcc': other_dir}).load('glcc')
+    assert parses == ['glcc', 'glcc']
+
+    monkeypatch.setattr(catalog_utils, 'CATALOG_VERSION', catalog_utils.CATALOG_VERSION + 1)
+    DataCatalog(data_dir, cache_dir=cache_dir, directories={'glcc': other_dir}).load('glcc')
+    assert parses == ['glcc', 'glcc', 'glcc']
+
+def test_missing_file_or_source(data_dir):
+    os.remove(os.path.join(data_dir, 'glcc', ERIE_FILE))
+    with pytest.raises(FileNotFoundError):
+        DataCatalog(data_dir).load('glcc')
+    with pytest.raises(ValueError):
+        DataCatalog(data_dir).load('gauges')
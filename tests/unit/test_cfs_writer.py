@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+from src.database_utils import CFSWriter, open_cfs_db
+
+def run_rows(cfs_run, value=1.0):
+    return [(cfs_run, 2025, month, lake, 'lake', 'precipitation', value)
+            for month in (2, 3) for lake in ('erie', 'superior')]
+
+def stored_runs(database):
+    with sqlite3.connect(database) as conn:
+        return [row[0] for row in conn.execute('SELECT DISTINCT cfs_run FROM cfs_forecast_data ORDER BY cfs_run')]
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'cfs.db')
+    conn, _ = open_cfs_db(path)
+    conn.close()
+    return path
+
+def test_runs_are_committed_in_batches(database):
+    with CFSWriter(database, runs_per_commit=3) as writer:
+        for i, cfs_run in enumerate(['2025010100', '2025010106', '2025010112', '2025010118']):
+            writer.extend(run_rows(cfs_run))
+            writer.end_run()
+            if i < 2:
+                assert stored_runs(database) == []
+                assert writer.rows_written == 0
+        # The fourth run is still buffered after the first batch of three
+        assert stored_runs(database) == [2025010100, 2025010106, 2025010112]
+        assert writer.rows_written == 12 and len(writer.rows) == 4
+
+    # Closing the writer commits the last, partial batch
+    assert stored_runs(database) == [2025010100, 2025010106, 2025010112, 2025010118]
+    assert writer.rows_written == 16
+
+def test_one_commit_per_run_by_default(database):
+    with CFSWriter(database) as writer:
+        writer.extend(run_rows('2025010100'))
+        writer.end_run()
+        assert stored_runs(database) == [2025010100]
+
+def test_rows_are_upserted(database):
+    with CFSWriter(database) as writer:
+        writer.extend(run_rows('2025010100', 1.0))
+        writer.end_run()
+        writer.extend(run_rows('2025010100', 2.0))
+        writer.end_run()
+
+    with sqlite3.connect(database) as conn:
+        assert conn.execute('SELECT COUNT(*), MIN("value [mm]") FROM cfs_forecast_data').fetchone() == (4, 2.0)
+
+def test_an_error_discards_the_buffered_runs(database):
+    with pytest.raises(RuntimeError):
+        with CFSWriter(database, runs_per_commit=2) as writer:
+            writer.extend(run_rows('2025010100'))
+            writer.end_run()
+            writer.extend(run_rows('2025010106'))
+            writer.end_run()
+            writer.extend(run_rows('2025010112'))
+            raise RuntimeError("decode failed")
+
+    # The committed batch stays, the partly buffered run is not written
+    assert stored_runs(database) == [2025010100, 2025010106]
+
+def test_after_commit_callbacks_wait_for_the_commit(database):
+    committed = []
+    with CFSWriter(database, runs_per_commit=2) as writer:
+        writer.extend(run_rows('2025010100'))
+        writer.after_commit(lambda: committed.append(stored_runs(database)))
+        writer.end_run()
+        assert committed == []
+        writer.extend(run_rows('2025010106'))
+        writer.end_run()
+        assert committed == [[2025010100, 2025010106]]
+
+@pytest.mark.parametrize('row', [
+    ('2025010100', '2025', 2, 'erie', 'lake', 'precipitation', 1.0),
+    ('2025010100', 2025, 13, 'erie', 'lake', 'precipitation', 1.0),
+    (2025010100, 2025, 2, 'erie', 'lake', 'precipitation', 1.0),
+    ('2025010100', 2025, 2, 'erie', 'lake', 'precipitation', '1.0'),
+])
+def test_invalid_rows_are_rejected(database, row):
+    with CFSWriter(database) as writer:
+        with pytest.raises(ValueError):
+            writer.add(*row)
+        assert writer.rows == []
+
+def test_runs_per_commit_must_be_positive(database):
+    with pytest.raises(ValueError):
+        CFSWriter(database, runs_per_commit=0)
@@ -0,0 +1,99 @@
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import MASK_VARIABLES, cfs_runs, forecast_months
+from src.data_processing import load_feature_matrix
+from src.database_utils import CFS_COMPACT_TABLE, CFSWriter, is_compact_cfs_db, migrate_cfs_db, open_cfs_db, \
+    pull_from_db
+
+LAKES = {'eri': 'erie', 'ont': 'ontario', 'mih': 'michigan-huron', 'sup': 'superior'}
+COMPONENTS = ['precipitation', 'evaporation', 'air_temperature']
+
+def write_legacy_database(path, num_runs=6):
+    """A database with the original long cfs_forecast_data table (no valid-month index), as written before the migration existed."""
+    rng = np.random.default_rng(0)
+    with sqlite3.connect(path) as conn:
+        conn.execute('''
+        CREATE TABLE cfs_forecast_data (
+            cfs_run INTEGER,
+            year INTEGER,
+            month INTEGER,
+            lake TEXT,
+            surface_type TEXT,
+            component TEXT,
+            "value [mm]" REAL,
+            PRIMARY KEY (cfs_run, year, month, lake, surface_type, component)
+        )
+        ''')
+    with CFSWriter(path, runs_per_commit=num_runs) as writer:
+        for cfs_run in cfs_runs(datetime(2024, 12, 31), num_runs):
+            for year, month in forecast_months(cfs_run):
+                for mask_var in MASK_VARIABLES:
+                    lake_abv, surface_type = mask_var.split('_')
+                    for component in COMPONENTS:
+                        writer.add(cfs_run, year, month, LAKES[lake_abv], surface_type, component, float(rng.normal(50, 20)))
+            writer.end_run()
+
+def all_rows(path):
+    with sqlite3.connect(path) as conn:
+        return pd.read_sql('SELECT * FROM cfs_forecast_data ORDER BY cfs_run, year, month, lake, surface_type, component', conn)
+
+@pytest.fixture
+def legacy_database(tmp_path):
+    path = str(tmp_path / 'cfs.db')
+    write_legacy_database(path)
+    return path
+
+def test_migration_keeps_every_value(legacy_database):
+    rows_before = all_rows(legacy_database)
+    features_before = load_feature_matrix(legacy_database)
+    samples = rows_before.sample(20, random_state=0)
+
+    result = migrate_cfs_db(legacy_database)
+
+    assert result['rows'] == len(rows_before)
+    with sqlite3.connect(legacy_database) as conn:
+        assert is_compact_cfs_db(conn)
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'cfs_forecast_data_legacy'").fetchone() is None
+    pd.testing.assert_frame_equal(all_rows(legacy_database), rows_before)
+    pd.testing.assert_frame_equal(load_feature_matrix(legacy_database), features_before)
+    pd.testing.assert_frame_equal(load_feature_matrix(legacy_database, since_run=2025010106, valid_from=(2025, 3)),
+                                  features_before.loc[(features_before.index.get_level_values('cfs_run') >= 2025010106)
+                                                      & (features_before.index.get_level_values('month') >= 3)
+                                                      & (features_before.index.get_level_values('year') == 2025)])
+    for row in samples.itertuples(index=False):
+        assert pull_from_db(legacy_database, 'cfs_forecast_data', *row[:6]) == row[6]
+
+def test_writes_through_the_view_round_trip(legacy_database):
+    migrate_cfs_db(legacy_database, keep_legacy=True)
+    conn, _ = open_cfs_db(legacy_database)
+    num_compact = conn.execute(f'SELECT COUNT(*) FROM {CFS_COMPACT_TABLE}').fetchone()[0]
+    assert conn.execute('SELECT COUNT(*) FROM cfs_forecast_data_legacy').fetchone()[0] == num_compact
+    conn.close()
+
+    with CFSWriter(legacy_database) as writer:
+        # A new run, an update of an existing value and a name the lookup tables do not know yet
+        writer.add('2025020100', 2025, 3, 'erie', 'lake', 'precipitation', 12.5)
+        writer.add('2024123100', 2025, 1, 'superior', 'land', 'evaporation', -3.25)
+        writer.add('2025020100', 2025, 3, 'erie', 'lake', 'runoff', 7.0)
+        writer.end_run()
+
+    assert pull_from_db(legacy_database, 'cfs_forecast_data', 2025020100, 2025, 3, 'erie', 'lake', 'precipitation') == 12.5
+    assert pull_from_db(legacy_database, 'cfs_forecast_data', 2024123100, 2025, 1, 'superior', 'land', 'evaporation') == -3.25
+    assert pull_from_db(legacy_database, 'cfs_forecast_data', 2025020100, 2025, 3, 'erie', 'lake', 'runoff') == 7.0
+
+    with sqlite3.connect(legacy_database) as conn:
+        assert conn.execute(f'SELECT COUNT(*) FROM {CFS_COMPACT_TABLE}').fetchone()[0] == num_compact + 2
+        conn.execute("DELETE FROM cfs_forecast_data WHERE cfs_run = 2025020100")
+        assert conn.execute(f'SELECT COUNT(*) FROM {CFS_COMPACT_TABLE}').fetchone()[0] == num_compact
+        # The known names keep their codes
+        assert conn.execute("SELECT lake_id FROM cfs_lakes WHERE lake = 'superior'").fetchone()[0] == 0
+
+def test_migrating_twice_is_refused(legacy_database):
+    migrate_cfs_db(legacy_database, vacuum=False)
+    with pytest.raises(ValueError):
+        migrate_cfs_db(legacy_database)
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from src.database_utils import open_cnbs_db
+from src.ensemble_utils import compute_ensemble_statistics, update_ensemble_summary
+
+def make_forecasts(seed=0):
+    """Forecasts of overlapping CFS runs, each covering the three months after its start."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for run_month in range(1, 7):
+        for day in (1, 11, 21):
+            cfs_run = 2024000000 + run_month * 10000 + day * 100
+            for lead in range(3):
+                month = run_month + lead
+                for model in ('GP', 'LR'):
+                    for lake in ('superior', 'erie'):
+                        for component in ('evap', 'precip'):
+                            value = rng.normal(50, 10)
+                            rows.append((cfs_run, month, 2024, model, lake, component, value, value * 10))
+    return pd.DataFrame(rows, columns=['cfs_run', 'month', 'year', 'model', 'lake', 'component', 'value [mm]', 'value [cms]'])
+
+def sort_summary(summary):
+    key = ['year', 'month', 'model', 'lake', 'component', 'statistic']
+    return summary.sort_values(key).reset_index(drop=True)
+
+def test_update_ensemble_summary_by_month_matches_whole_table(tmp_path):
+    df = make_forecasts()
+    conn, _ = open_cnbs_db(str(tmp_path / 'cnbs.db'))
+    df.to_sql('cnbs_forecast', conn, if_exists='append', index=False)
+
+    written = update_ensemble_summary(conn)
+    expected = compute_ensemble_statistics(df)
+
+    written, expected = sort_summary(written), sort_summary(expected)
+    assert len(written) == len(expected)
+    pd.testing.assert_frame_equal(written, expected, check_dtype=False)
+
+    stored = pd.read_sql('SELECT * FROM cnbs_forecast_summary', conn)
+    assert len(stored) == len(expected)
+    assert set(zip(stored['year'], stored['month'])) == set(zip(df['year'], df['month']))
+    conn.close()
+
+def test_update_ensemble_summary_only_touches_given_months(tmp_path):
+    df = make_forecasts()
+    conn, _ = open_cnbs_db(str(tmp_path / 'cnbs.db'))
+    df.to_sql('cnbs_forecast', conn, if_exists='append', index=False)
+
+    update_ensemble_summary(conn, months=[(2024, 7), (2024, 8)])
+
+    stored = pd.read_sql('SELECT DISTINCT year, month FROM cnbs_forecast_summary', conn)
+    assert sorted(zip(stored['year'], stored['month'])) == [(2024, 7), (2024, 8)]
+    conn.close()
@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing import shift_variables
+from src.feature_utils import FeatureSchema, lagged_column_names, lagged_matrix
+
+def reference_shift(df, lag, lead):
+    """The original `shift_variables`: one pandas `shift` per column and offset, without dropping rows."""
+    columns = [df]
+    for column in df.columns:
+        columns += [df[column].shift(lag_month).rename(f'{column}_mo-{lag_month}') for lag_month in range(1, lag + 1)]
+        columns += [df[column].shift(-lead_month).rename(f'{column}_mo{lead_month}') for lead_month in range(1, lead + 1)]
+    return pd.concat(columns, axis=1)
+
+@pytest.fixture
+def monthly_frame():
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2000-01-01', periods=30, freq='MS')
+    return pd.DataFrame(rng.standard_normal((30, 3)), columns=['a', 'b', 'c'], index=index)
+
+@pytest.mark.parametrize('lag, lead', [(0, 0), (1, 0), (0, 2), (3, 2), (6, 0)])
+def test_lagged_matrix_matches_pandas_shift(monthly_frame, lag, lead):
+    expected = reference_shift(monthly_frame, lag, lead)
+
+    values = lagged_matrix(monthly_frame.to_numpy(), lag, lead)
+
+    assert lagged_column_names(monthly_frame.columns, lag, lead) == list(expected.columns)
+    np.testing.assert_array_equal(values, expected.to_numpy())
+    pd.testing.assert_frame_equal(shift_variables(monthly_frame, lag, lead), expected.dropna())
+
+def test_lagged_matrix_rejects_bad_arguments():
+    with pytest.raises(ValueError):
+        lagged_matrix(np.zeros((4, 2)), lag=-1)
+    with pytest.raises(ValueError):
+        lagged_matrix(np.zeros(4), lag=1)
+
+def test_schema_builds_lags_and_the_month_one_hot(monthly_frame):
+    schema = FeatureSchema(['b', 'a'], lag=2)
+    X = schema.build(monthly_frame)
+
+    assert list(X.columns) == ['b', 'a', 'b_mo-1', 'b_mo-2', 'a_mo-1', 'a_mo-2'] + [f'month_{i}' for i in range(1, 13)]
+    assert X.index[0] == monthly_frame.index[2]
+    assert np.array_equal(X['a_mo-2'].to_numpy(), monthly_frame['a'].to_numpy()[:-2])
+    assert (X.filter(like='month_').sum(axis=1) == 1).all()
+    assert (X['month_3'] == (X.index.month == 3)).all()
+
+def test_schema_save_load_round_trip(tmp_path):
+    schema = FeatureSchema(['a', 'b'], lag=1, lead=2, month_one_hot=False)
+    path = str(tmp_path / 'feature_schema.json')
+    schema.save(path)
+
+    loaded = FeatureSchema.load(path)
+    assert loaded.columns == schema.columns
+    assert loaded.fingerprint == schema.fingerprint
+    assert (loaded.lag, loaded.lead, loaded.month_one_hot) == (1, 2, False)
+
+    # A schema file whose columns do not follow from its settings is rejected
+    with open(path) as f:
+        data = json.load(f)
+    data['columns'] = data['columns'][::-1]
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    with pytest.raises(ValueError):
+        FeatureSchema.load(path)
+
+def test_schema_check_reorders_and_rejects_columns(monthly_frame):
+    schema = FeatureSchema(['a', 'b', 'c'], lag=1)
+    X = schema.build(monthly_frame)
+
+    assert schema.check(X) is X
+    shuffled = X[X.columns[::-1]]
+    pd.testing.assert_frame_equal(schema.check(shuffled), X)
+
+    with pytest.raises(ValueError, match='missing'):
+        schema.check(X.drop(columns='b_mo-1'))
+    with pytest.raises(ValueError, match='unexpected'):
+        schema.check(X.assign(extra=0.0))
+
+    class Scaler:
+        feature_names_in_ = np.array(list(reversed(schema.columns)))
+    with pytest.raises(ValueError):
+        schema.check(X, Scaler())
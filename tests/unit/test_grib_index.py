@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.data_processing import grib_index_path, read_grib_fields
+
+LATITUDES = np.arange(50.0, 39.75, -0.5)
+LONGITUDES = np.arange(268.0, 285.25, 0.5)
+
+def write_grib(path, value):
+    """Writes a single uniform surface pressure GRIB2 message on a 0.5 degree grid."""
+    eccodes = pytest.importorskip('eccodes')
+    handle = eccodes.codes_grib_new_from_samples('regular_ll_sfc_grib2')
+    for key, key_value in [('Ni', len(LONGITUDES)), ('Nj', len(LATITUDES)),
+                           ('latitudeOfFirstGridPointInDegrees', LATITUDES[0]),
+                           ('longitudeOfFirstGridPointInDegrees', LONGITUDES[0]),
+                           ('latitudeOfLastGridPointInDegrees', LATITUDES[-1]),
+                           ('longitudeOfLastGridPointInDegrees', LONGITUDES[-1]),
+                           ('iDirectionIncrementInDegrees', 0.5), ('jDirectionIncrementInDegrees', 0.5),
+                           ('shortName', 'sp')]:
+        eccodes.codes_set(handle, key, key_value)
+    eccodes.codes_set_values(handle, np.full(len(LATITUDES) * len(LONGITUDES), value))
+    with open(path, 'wb') as f:
+        f.write(eccodes.codes_get_message(handle))
+    eccodes.codes_release(handle)
+
+def index_files(index_dir):
+    return sorted(name for name in os.listdir(index_dir) if name.endswith('.idx'))
+
+def test_index_path_follows_the_size_and_mtime(tmp_path):
+    grib_file = tmp_path / 'flxf.grb2'
+    grib_file.write_bytes(b'x' * 100)
+    index_dir = str(tmp_path / 'index')
+
+    path = grib_index_path(str(grib_file), index_dir)
+    assert os.path.dirname(path) == index_dir
+    assert grib_index_path(str(grib_file), index_dir) == path
+
+    # An index built for the current file is kept
+    open(path.format(short_hash='abcde'), 'w').close()
+    assert grib_index_path(str(grib_file), index_dir) == path
+    assert len(index_files(index_dir)) == 1
+
+    # A new modification time gives a new path and removes the old index
+    stat = os.stat(grib_file)
+    os.utime(grib_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    touched = grib_index_path(str(grib_file), index_dir)
+    assert touched != path
+    assert index_files(index_dir) == []
+
+    # So does a new size
+    open(touched.format(short_hash='abcde'), 'w').close()
+    grib_file.write_bytes(b'x' * 200)
+    os.utime(grib_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert grib_index_path(str(grib_file), index_dir) not in (path, touched)
+    assert index_files(index_dir) == []
+
+def test_index_of_another_file_is_left_alone(tmp_path):
+    index_dir = str(tmp_path / 'index')
+    paths = {}
+    for name in ('a.grb2', 'b.grb2'):
+        (tmp_path / name).write_bytes(name.encode())
+        paths[name] = grib_index_path(str(tmp_path / name), index_dir)
+        open(paths[name].format(short_hash='abcde'), 'w').close()
+
+    (tmp_path / 'a.grb2').write_bytes(b'changed')
+    grib_index_path(str(tmp_path / 'a.grb2'), index_dir)
+
+    assert index_files(index_dir) == [os.path.basename(paths['b.grb2']).format(short_hash='abcde')]
+
+def test_rewritten_grib_file_is_read_with_a_new_index(tmp_path):
+    pytest.importorskip('cfgrib')
+    grib_file = str(tmp_path / 'flxf.grb2')
+    index_dir = str(tmp_path / 'index')
+    mask_lat, mask_lon = np.arange(48.0, 41.0, -1.0), np.arange(270.0, 282.0, 1.0)
+    fields = {'surface_pressure': ['sp']}
+
+    write_grib(grib_file, 98000.0)
+    first = read_grib_fields(grib_file, fields, mask_lat, mask_lon, index_dir=index_dir)
+    built = index_files(index_dir)
+    assert len(built) == 1
+    assert np.allclose(first['surface_pressure'], 98000.0)
+
+    # An unchanged file reuses its index
+    mtime = os.path.getmtime(os.path.join(index_dir, built[0]))
+    read_grib_fields(grib_file, fields, mask_lat, mask_lon, index_dir=index_dir)
+    assert index_files(index_dir) == built
+    assert os.path.getmtime(os.path.join(index_dir, built[0])) == mtime
+
+    # A re-downloaded file with other values is not read through the stale index
+    write_grib(grib_file, 99000.0)
+    stat = os.stat(grib_file)
+    os.utime(grib_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    second = read_grib_fields(grib_file, fields, mask_lat, mask_lon, index_dir=index_dir)
+    assert np.allclose(second['surface_pressure'], 99000.0)
+    assert len(index_files(index_dir)) == 1 and index_files(index_dir) != built
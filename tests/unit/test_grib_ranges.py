@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from src.database_utils import _write_grib_subset, select_grib_ranges
+
+DATA = bytes(range(256)) * 4
+
+def read_range(start, end):
+    return DATA[start:] if end is None else DATA[start:end + 1]
+
+def test_subset_is_written_from_the_ranges(tmp_path):
+    path = str(tmp_path / 'subset.grb2')
+
+    assert _write_grib_subset(path, [(0, 9), (100, 149), (1000, None)], read_range) == 10 + 50 + 24
+    with open(path, 'rb') as f:
+        assert f.read() == DATA[:10] + DATA[100:150] + DATA[1000:]
+    assert os.listdir(tmp_path) == ['subset.grb2']
+
+def test_failed_range_leaves_no_partial_file(tmp_path):
+    path = str(tmp_path / 'subset.grb2')
+    calls = []
+
+    def failing(start, end):
+        calls.append(start)
+        if len(calls) == 2:
+            raise ConnectionError("connection reset")
+        return read_range(start, end)
+
+    with pytest.raises(ConnectionError):
+        _write_grib_subset(path, [(0, 9), (100, 149)], failing)
+    assert os.listdir(tmp_path) == []
+
+def test_adjacent_ranges_are_merged():
+    messages = [{'start': 0, 'end': 9, 'line': '1:0:d=2025050100:PRES:surface'},
+                {'start': 10, 'end': 19, 'line': '2:10:d=2025050100:PRATE:surface'},
+                {'start': 20, 'end': 29, 'line': '3:20:d=2025050100:TMP:2 m above ground'},
+                {'start': 30, 'end': None, 'line': '4:30:d=2025050100:LHTFL:surface'}]
+
+    assert select_grib_ranges(messages, ['PRATE:surface', 'TMP:2 m']) == [(10, 29)]
+    assert select_grib_ranges(messages, ['PRES:surface', 'LHTFL:surface']) == [(0, 9), (30, None)]
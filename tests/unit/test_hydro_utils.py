@@ -0,0 +1,96 @@
+import calendar
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.hydro_utils import LAKE_SURFACE_AREA, calculate_grid_cell_areas, convert_cms_to_mm, convert_mm_to_cms, \
+    seconds_in_month, seconds_in_months
+
+def reference_grid_cell_areas(lon, lat):
+    """The original double loop of `calculate_grid_cell_areas`."""
+    R = 6371000.0
+    lat_rad = np.radians(lat)
+    dlat = np.radians(lat[1] - lat[0])
+    dlon = np.radians(lon[1] - lon[0])
+    area = np.zeros((len(lat), len(lon)))
+    for i in range(len(lat)):
+        for j in range(len(lon)):
+            area[i, j] = R**2 * dlat * dlon * np.cos(lat_rad[i])
+    return area
+
+def reference_mm_to_cms(df):
+    """The original row-wise `df.apply` of `convert_mm_to_cms`."""
+    df['value [cms]'] = df.apply(
+        lambda row: (row['value [mm]'] / 1000) * LAKE_SURFACE_AREA.get(row['lake'], 0) / seconds_in_month(row.name[2], row.name[1]),
+        axis=1
+    )
+    return df
+
+def reference_cms_to_mm(df):
+    """Row-wise inverse of `reference_mm_to_cms` (NaN for unknown lakes)."""
+    def to_mm(row):
+        area = LAKE_SURFACE_AREA.get(row['lake'], 0)
+        return row['value [cms]'] * seconds_in_month(row.name[2], row.name[1]) / area * 1000 if area else np.nan
+
+    df['value [mm]'] = df.apply(to_mm, axis=1)
+    return df
+
+@pytest.fixture
+def forecast_frame():
+    """Forecasts indexed by (cfs_run, month, year), with every February kind and an unknown lake."""
+    rng = np.random.default_rng(0)
+    years_months = [(2024, 2), (2023, 2), (2000, 2), (1900, 2), (2100, 2), (2025, 1), (2025, 6), (2025, 12)]
+    lakes = list(LAKE_SURFACE_AREA) + ['st-clair']
+    rows = [(2025010100 + i, month, year, lake) for i, (year, month) in enumerate(years_months) for lake in lakes]
+    index = pd.MultiIndex.from_tuples([row[:3] for row in rows], names=['cfs_run', 'month', 'year'])
+    return pd.DataFrame({'lake': [row[3] for row in rows], 'value [mm]': rng.normal(50, 30, len(rows))}, index=index)
+
+@pytest.mark.parametrize('lat, lon', [
+    (np.arange(40.0, 51.0, 0.1), np.arange(267.0, 286.0, 0.1)),  # Great Lakes mask grid
+    (np.arange(90.0, -90.25, -0.5), np.arange(0.0, 360.0, 0.5)),  # CFS grid, north to south
+])
+def test_grid_cell_areas_match_reference(lat, lon):
+    assert np.array_equal(calculate_grid_cell_areas(lon, lat), reference_grid_cell_areas(lon, lat))
+
+def test_grid_cell_areas_of_masked_coordinates():
+    lat, lon = np.arange(40.0, 51.0, 0.5), np.arange(267.0, 286.0, 0.5)
+    areas = calculate_grid_cell_areas(np.ma.masked_array(lon), np.ma.masked_array(lat))
+
+    assert np.array_equal(areas, reference_grid_cell_areas(lon, lat))
+
+def test_seconds_in_months_match_calendar():
+    years, months = np.meshgrid(np.arange(1896, 2105), np.arange(1, 13), indexing='ij')
+    expected = [calendar.monthrange(year, month)[1] * 86400 for year, month in zip(years.ravel(), months.ravel())]
+
+    assert np.array_equal(seconds_in_months(years.ravel(), months.ravel()), expected)
+    assert seconds_in_months([2024], [2])[0] == 29 * 86400
+    assert seconds_in_months([1900], [2])[0] == 28 * 86400
+    with pytest.raises(ValueError):
+        seconds_in_months([2024], [13])
+
+def test_mm_to_cms_matches_reference(forecast_frame):
+    expected = reference_mm_to_cms(forecast_frame.copy())
+    converted = convert_mm_to_cms(forecast_frame.copy())
+
+    assert np.allclose(converted['value [cms]'], expected['value [cms]'], rtol=1e-12, atol=0)
+    assert (converted.loc[converted['lake'] == 'st-clair', 'value [cms]'] == 0).all()
+
+def test_mm_to_cms_leap_february(forecast_frame):
+    converted = convert_mm_to_cms(forecast_frame.copy())
+    superior = converted[converted['lake'] == 'superior']
+
+    for year, days in ((2024, 29), (2023, 28), (2000, 29), (1900, 28), (2100, 28)):
+        row = superior.xs((2, year), level=('month', 'year'))
+        expected = row['value [mm]'].iloc[0] / 1000 * LAKE_SURFACE_AREA['superior'] / (days * 86400)
+        assert row['value [cms]'].iloc[0] == pytest.approx(expected, rel=1e-12)
+
+def test_cms_to_mm_matches_reference(forecast_frame):
+    cms = reference_mm_to_cms(forecast_frame.copy()).drop(columns='value [mm]')
+    expected = reference_cms_to_mm(cms.copy())
+    converted = convert_cms_to_mm(cms.copy())
+
+    assert np.allclose(converted['value [mm]'], expected['value [mm]'], rtol=1e-12, atol=0, equal_nan=True)
+    known = forecast_frame['lake'] != 'st-clair'
+    assert np.allclose(converted.loc[known, 'value [mm]'], forecast_frame.loc[known, 'value [mm]'], rtol=1e-12)
+    assert converted.loc[~known, 'value [mm]'].isna().all()
@@ -0,0 +1,55 @@
+"""
+Import budgets of the entry points of each stage.
+
+Each entry point is imported in a fresh interpreter; the test fails when it takes longer than its budget
+or pulls in the heavy stack of another stage (GRIB decoding, AWS, scikit-learn/TensorFlow).
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import statement, time budget in seconds and modules that must not be loaded, for each stage's entry point
+IMPORT_BUDGETS = {
+    'forecast': ('from src.data_processing import forecast_new_runs, load_feature_matrix, predict_ensemble', 1.0,
+                 ['cfgrib', 'eccodes', 'xarray', 'netCDF4', 'scipy', 'boto3', 'botocore', 'bs4', 'requests', 'sklearn', 'tensorflow']),
+    'ingest': ('from src.data_processing import process_grib_files, process_cfs_range', 1.0,
+               ['boto3', 'botocore', 'bs4', 'requests', 'sklearn', 'tensorflow']),
+    'pipeline': ('from src.pipeline import stream_cfs_runs, CFSForecastDaemon', 1.0,
+                 ['cfgrib', 'eccodes', 'xarray', 'netCDF4', 'scipy', 'boto3', 'botocore', 'bs4', 'requests', 'sklearn', 'tensorflow']),
+    'cli': ('from src.cli import main', 0.25,
+            ['numpy', 'pandas', 'cfgrib', 'eccodes', 'xarray', 'netCDF4', 'boto3', 'botocore', 'bs4', 'requests', 'sklearn', 'tensorflow']),
+    'download': ('from src.database_utils import download_cfs_run', 0.25,
+                 ['pandas', 'cfgrib', 'eccodes', 'xarray', 'netCDF4', 'boto3', 'botocore', 'bs4', 'requests', 'sklearn', 'tensorflow']),
+}
+
+def measure_import(statement, repeat=3):
+    """Return the best time of an import statement in `repeat` fresh interpreters, and the top-level modules it loaded."""
+    code = (
+        "import json, sys, time\n"
+        "before = set(sys.modules)\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "elapsed = time.perf_counter() - start\n"
+        "loaded = sorted({name.split('.')[0] for name in set(sys.modules) - before})\n"
+        "print(json.dumps([elapsed, loaded]))\n"
+    )
+
+    best, loaded = float('inf'), []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout
+        elapsed, loaded = json.loads(output.strip().splitlines()[-1])
+        best = min(best, elapsed)
+    return best, loaded
+
+@pytest.mark.parametrize('stage', list(IMPORT_BUDGETS))
+def test_import_budget(stage):
+    statement, budget, forbidden = IMPORT_BUDGETS[stage]
+    elapsed, loaded = measure_import(statement)
+
+    assert not [module for module in forbidden if module in loaded], f"{stage} entry point loads another stage's stack"
+    assert elapsed <= budget, f"{stage} entry point took {elapsed:.3f} s (budget {budget} s)"
@@ -0,0 +1,79 @@
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import make_cfs_database
+from src.data_processing import FEATURE_COLUMNS, load_feature_matrix
+from src.database_utils import CFSWriter, migrate_cfs_db
+
+INCOMPLETE_RUN = 2024121612
+
+@pytest.fixture(params=[False, True], ids=['long', 'compact'])
+def database(request, tmp_path):
+    """Runs from mid-December 2024, so the forecast months cross a year; one run month lacks a value."""
+    path = str(tmp_path / 'cfs.db')
+    make_cfs_database(path, 40, start=datetime(2024, 12, 10))
+    with CFSWriter(path) as writer:
+        # A component that is not a feature is ignored
+        writer.add('2024121000', 2025, 1, 'erie', 'lake', 'runoff', 1.0)
+    with sqlite3.connect(path) as conn:
+        conn.execute("DELETE FROM cfs_forecast_data WHERE cfs_run = ? AND year = 2025 AND month = 3 "
+                     "AND lake = 'erie' AND surface_type = 'land' AND component = 'evaporation'", (INCOMPLETE_RUN,))
+    if request.param:
+        migrate_cfs_db(path, vacuum=False)
+    return path
+
+def pandas_feature_matrix(database):
+    """The feature matrix of the whole table, pivoted in pandas."""
+    with sqlite3.connect(database) as conn:
+        data = pd.read_sql('SELECT * FROM cfs_forecast_data', conn)
+    data['variable'] = data['lake'] + '_' + data['surface_type'] + '_' + data['component']
+    X = data.pivot_table(index=['cfs_run', 'year', 'month'], columns='variable', values='value [mm]', aggfunc='first')
+    X = X.reindex(columns=FEATURE_COLUMNS)
+    months = X.index.get_level_values('month').to_numpy()
+    for i in range(1, 13):
+        X[f'month_{i}'] = (months == i).astype(float)
+    X.columns.name = None
+    return X.sort_index()
+
+def valid_at_or_after(X, year, month):
+    years, months = X.index.get_level_values('year'), X.index.get_level_values('month')
+    return (years > year) | ((years == year) & (months >= month))
+
+@pytest.mark.parametrize('since_run, valid_from', [
+    (None, None),
+    (2024121800, None),
+    ('2024121800', None),
+    (None, (2025, 1)),
+    (None, datetime(2024, 12, 1)),
+    (2024121506, (2025, 6)),
+    (2030010100, None),
+])
+def test_filters_match_pandas(database, since_run, valid_from):
+    X = pandas_feature_matrix(database)
+    keep = np.ones(len(X), dtype=bool)
+    if since_run is not None:
+        keep &= X.index.get_level_values('cfs_run') >= int(since_run)
+    if valid_from is not None:
+        year, month = (valid_from.year, valid_from.month) if isinstance(valid_from, datetime) else valid_from
+        keep &= valid_at_or_after(X, year, month)
+    expected = X[keep]
+
+    with_missing = load_feature_matrix(database, since_run=since_run, valid_from=valid_from, dropna=False)
+    pd.testing.assert_frame_equal(with_missing, expected, check_index_type=False)
+
+    dropped = load_feature_matrix(database, since_run=since_run, valid_from=valid_from)
+    pd.testing.assert_frame_equal(dropped, expected.dropna(), check_index_type=False)
+
+    values, index = load_feature_matrix(database, since_run=since_run, valid_from=valid_from, as_array=True)
+    np.testing.assert_array_equal(values, expected.dropna().to_numpy())
+    assert index.equals(expected.dropna().index)
+
+def test_incomplete_run_month_is_dropped(database):
+    X = load_feature_matrix(database, since_run=INCOMPLETE_RUN)
+    assert (INCOMPLETE_RUN, 2025, 3) not in X.index
+    assert (INCOMPLETE_RUN, 2025, 4) in X.index
+    assert np.isnan(load_feature_matrix(database, dropna=False).loc[(INCOMPLETE_RUN, 2025, 3), 'erie_land_evaporation'])
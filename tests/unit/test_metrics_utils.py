@@ -0,0 +1,76 @@
+import json
+import logging
+from datetime import datetime
+
+
+from benchmarks.fixtures import MASK_VARIABLES, cfs_runs, make_cfs_fields, synthetic_grib_reader, write_gl_mask, \
+    write_grib_placeholders
+from src.cli import build_parser
+from src.data_processing import process_cfs_range
+from src.metrics_utils import METRICS_ENV, PipelineMetrics, log_skip, logger, metrics
+
+def ingest_range(tmp_path, workers):
+    """Ingest two days of synthetic CFS runs with process_cfs_range and return the metrics snapshot."""
+    runs = cfs_runs(datetime(2025, 1, 1), 8)
+    download_dir = tmp_path / 'CFS'
+    for cfs_run in runs:
+        write_grib_placeholders(str(download_dir / cfs_run[:8]), [cfs_run])
+    mask_file = write_gl_mask(str(tmp_path / 'GL_mask.nc'))
+
+    metrics.reset()
+    with synthetic_grib_reader(make_cfs_fields()):
+        result = process_cfs_range('01-01-2025', '01-02-2025', str(download_dir), str(tmp_path / f'cfs{workers}.db'),
+                                   mask_file, MASK_VARIABLES, workers=workers, runs_per_commit=3)
+    assert result['processed'] == runs and not result['failed']
+    return metrics.snapshot()
+
+def test_worker_metrics_are_merged_into_the_summary(tmp_path):
+    serial = ingest_range(tmp_path, workers=1)
+    parallel = ingest_range(tmp_path, workers=2)
+
+    path = str(tmp_path / 'metrics' / 'metrics.json')
+    metrics.write_json(path, command='ingest')
+    with open(path) as f:
+        summary = json.load(f)
+
+    assert summary['command'] == 'ingest'
+    # The stages run in the workers are counted once per call, as in a serial ingest
+    for stage in ('ingest_run', 'crop', 'regrid', 'mask_reduction', 'db_write'):
+        assert summary['stages'][stage]['calls'] == serial['stages'][stage]['calls'] > 0, stage
+        assert summary['stages'][stage]['seconds'] > 0
+    assert summary['stages']['db_write']['calls'] == 3
+    assert summary['counters'] == serial['counters'] == parallel['counters']
+    assert summary['counters']['runs_processed'] == 8
+    assert summary['counters']['rows_written'] == summary['counters']['rows_extracted'] == 8 * 9 * 3 * len(MASK_VARIABLES)
+    metrics.reset()
+
+def test_merge_adds_timers_and_counters():
+    parent, worker = PipelineMetrics(), PipelineMetrics()
+    parent.add_time('regrid', 1.0)
+    parent.count('rows_written', 5)
+    worker.add_time('regrid', 3.0, calls=2, max_seconds=2.5)
+    worker.count('rows_written', 7)
+    worker.count('runs_failed')
+
+    parent.merge(worker.snapshot())
+    snapshot = parent.snapshot()
+
+    assert snapshot['stages']['regrid'] == {'calls': 3, 'seconds': 4.0, 'max_seconds': 2.5}
+    assert snapshot['counters'] == {'rows_written': 12, 'runs_failed': 1}
+
+def test_log_skip_counts_and_logs_the_cause(caplog):
+    metrics.reset()
+    with caplog.at_level(logging.WARNING, logger=logger.name):
+        log_skip('runs_skipped', FileNotFoundError('flx'), cfs_run='2025010100', reason='flx_file_missing')
+
+    assert metrics.snapshot()['counters'] == {'runs_skipped': 1}
+    event = json.loads(caplog.records[-1].getMessage())
+    assert event['event'] == 'runs_skipped' and event['cfs_run'] == '2025010100'
+    assert 'FileNotFoundError' in event['error']
+    metrics.reset()
+
+def test_metrics_path_defaults_to_the_environment(monkeypatch):
+    monkeypatch.setenv(METRICS_ENV, '/tmp/metrics.json')
+    assert build_parser().parse_args(['forecast']).metrics == '/tmp/metrics.json'
+    monkeypatch.delenv(METRICS_ENV)
+    assert build_parser().parse_args(['forecast']).metrics is None
@@ -0,0 +1,80 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+from src.model_utils import ModelRegistry
+from src.numpy_models import export_model
+
+def save(path, value, mtime_ns=None):
+    """Dumps an artifact of a fixed size, optionally setting the file's modification time."""
+    joblib.dump({'weights': np.full(4, value)}, path)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return os.stat(path)
+
+@pytest.fixture
+def artifact(tmp_path):
+    path = str(tmp_path / 'model.joblib')
+    return path, save(path, 1.0)
+
+def test_unchanged_artifact_is_loaded_once(artifact):
+    path, _ = artifact
+    registry = ModelRegistry()
+    first = registry.get(path)
+
+    assert registry.get(os.path.relpath(path)) is first
+    assert path in registry and len(registry) == 1
+    registry.clear()
+    assert registry.get(path) is not first
+
+def test_new_mtime_reloads(artifact):
+    path, stat = artifact
+    registry = ModelRegistry()
+    first = registry.get(path)
+
+    save(path, 2.0, mtime_ns=stat.st_mtime_ns + 10**9)
+    second = registry.get(path)
+    assert second is not first
+    assert np.all(second['weights'] == 2.0)
+    assert registry.get(path) is second
+
+@pytest.mark.parametrize('validate, reloaded', [('mtime', False), ('hash', True)])
+def test_rewrite_keeping_size_and_mtime(artifact, validate, reloaded):
+    path, stat = artifact
+    registry = ModelRegistry(validate=validate)
+    first = registry.get(path)
+
+    # Same size and modification time, other content: only the content hash sees the change
+    assert save(path, 3.0, mtime_ns=stat.st_mtime_ns).st_size == stat.st_size
+    assert (registry.get(path) is not first) == reloaded
+    assert np.all(registry.get(path)['weights'] == (3.0 if reloaded else 1.0))
+
+def test_touch_without_changes_keeps_the_hash_validated_artifact(artifact):
+    path, stat = artifact
+    registry = ModelRegistry(validate='hash')
+    first = registry.get(path)
+
+    os.utime(path, ns=(stat.st_mtime_ns + 10**9, stat.st_mtime_ns + 10**9))
+    assert registry.get(path) is first
+
+def test_npz_exports_are_loaded_as_numpy_models(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((20, 3))
+    model = LinearRegression().fit(X, X @ rng.standard_normal((3, 2)))
+    joblib_path, npz_path = str(tmp_path / 'LR.joblib'), str(tmp_path / 'LR.npz')
+    joblib.dump(model, joblib_path)
+    export_model(joblib_path, npz_path)
+
+    registry = ModelRegistry()
+    loaded = registry.warm_up([npz_path])[npz_path]
+    assert not isinstance(loaded, LinearRegression)
+    assert np.allclose(loaded.predict(X), model.predict(X))
+
+def test_invalid_arguments(tmp_path):
+    with pytest.raises(ValueError):
+        ModelRegistry(validate='size')
+    with pytest.raises(FileNotFoundError):
+        ModelRegistry().get(str(tmp_path / 'missing.joblib'))
@@ -0,0 +1,89 @@
+import joblib
+import numpy as np
+import pytest
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, ConstantKernel, Matern, RationalQuadratic, WhiteKernel
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import StandardScaler
+
+from src.numpy_models import NumpyMLP, export_model, export_models, load_numpy_model, to_numpy_model
+
+@pytest.fixture
+def training_data():
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((60, 6))
+    y = X @ rng.standard_normal((6, 4)) + 0.1 * rng.standard_normal((60, 4))
+    X_new = rng.standard_normal((25, 6))
+    return X, y, X_new
+
+@pytest.mark.parametrize('kernel', [
+    1.0 * Matern(nu=1.5) * RationalQuadratic(),  # Kernel of the production GP
+    ConstantKernel(2.0) * RBF(length_scale=np.ones(6)) + WhiteKernel(0.1, noise_level_bounds='fixed'),
+    Matern(nu=2.5),
+])
+def test_gaussian_process_matches_sklearn(training_data, kernel):
+    X, y, X_new = training_data
+    model = GaussianProcessRegressor(kernel=kernel, alpha=0.1, normalize_y=True, random_state=0).fit(X, y)
+
+    assert np.allclose(to_numpy_model(model).predict(X_new), model.predict(X_new), rtol=1e-10, atol=1e-10)
+
+def test_linear_and_scalers_match_sklearn(training_data):
+    X, y, X_new = training_data
+    model = LinearRegression().fit(X, y)
+    scaler = StandardScaler().fit(X)
+
+    assert np.allclose(to_numpy_model(model).predict(X_new), model.predict(X_new))
+    assert np.allclose(to_numpy_model(scaler).transform(X_new), scaler.transform(X_new))
+    assert np.allclose(to_numpy_model(scaler).inverse_transform(X_new), scaler.inverse_transform(X_new))
+
+def test_export_models_round_trip(training_data, tmp_path):
+    X, y, X_new = training_data
+    x_scaler, y_scaler = StandardScaler().fit(X), StandardScaler().fit(y)
+    models = {'GP': GaussianProcessRegressor(kernel=1.0 * Matern(nu=1.5) * RationalQuadratic(), alpha=0.1, optimizer=None),
+              'LR': LinearRegression()}
+    paths = {'x_scaler': tmp_path / 'x_scaler.joblib', 'y_scaler': tmp_path / 'y_scaler.joblib'}
+    joblib.dump(x_scaler, paths['x_scaler'])
+    joblib.dump(y_scaler, paths['y_scaler'])
+    models_info = []
+    for name, model in models.items():
+        model.fit(x_scaler.transform(X), y_scaler.transform(y))
+        joblib.dump(model, tmp_path / f'{name}_trained_model.joblib')
+        models_info.append({'model': name, 'path': str(tmp_path / f'{name}_trained_model.joblib')})
+
+    x_path, y_path, exported_info = export_models(str(paths['x_scaler']), str(paths['y_scaler']), models_info, str(tmp_path / 'numpy'))
+
+    x_numpy, y_numpy = load_numpy_model(x_path), load_numpy_model(y_path)
+    for model_info, (name, model) in zip(exported_info, models.items()):
+        assert model_info['path'].endswith('.npz')
+        expected = y_scaler.inverse_transform(model.predict(x_scaler.transform(X_new)))
+        predicted = y_numpy.inverse_transform(load_numpy_model(model_info['path']).predict(x_numpy.transform(X_new)))
+        assert np.allclose(predicted, expected, rtol=1e-10, atol=1e-10), name
+
+@pytest.fixture
+def keras_model(training_data):
+    tf = pytest.importorskip('tensorflow')
+    from src.training_utils import _keras_mlp
+
+    X, y, _ = training_data
+    tf.keras.utils.set_random_seed(0)
+    model = _keras_mlp(X.shape[1], y.shape[1])
+    model.fit(X, y, epochs=3, batch_size=16, verbose=0)
+    return model
+
+def test_mlp_matches_keras(training_data, keras_model):
+    _, _, X_new = training_data
+    expected = keras_model.predict(X_new, verbose=0)
+
+    assert np.allclose(to_numpy_model(keras_model).predict(X_new), expected, rtol=1e-5, atol=1e-5)
+
+def test_mlp_export_matches_keras(training_data, keras_model, tmp_path):
+    pytest.importorskip('h5py')
+    _, _, X_new = training_data
+    expected = keras_model.predict(X_new, verbose=0)
+    joblib.dump(keras_model, tmp_path / 'NN_trained_model.joblib')
+
+    export_model(str(tmp_path / 'NN_trained_model.joblib'), str(tmp_path / 'NN_trained_model.npz'))
+    from_pickle = NumpyMLP.from_keras_pickle(str(tmp_path / 'NN_trained_model.joblib'))
+
+    assert np.allclose(load_numpy_model(str(tmp_path / 'NN_trained_model.npz')).predict(X_new), expected, rtol=1e-5, atol=1e-5)
+    assert np.allclose(from_pickle.predict(X_new), expected, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import make_cfs_database, make_trained_models
+from src.data_processing import CNBS_COLUMNS, load_feature_matrix, predict_cnbs, predict_ensemble
+from src.model_utils import ModelRegistry
+
+@pytest.fixture(scope='module')
+def forecast_inputs(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('ensemble')
+    database = str(directory / 'cfs.db')
+    make_cfs_database(database, 8, start=datetime(2024, 12, 30))
+    return (load_feature_matrix(database),) + make_trained_models(str(directory / 'models'))
+
+def per_model_forecasts(X, x_scaler, y_scaler, models_info, models):
+    """The wide predict_cnbs output of each model, melted to the long layout one model at a time."""
+    frames = []
+    for model_name in models:
+        wide = predict_cnbs(X, x_scaler, y_scaler, models_info, model_name, registry=ModelRegistry())
+        wide.columns.name = 'column'
+        long = wide.stack().rename('value [mm]').reset_index()
+        long[['lake', 'component']] = long['column'].str.split('_', n=1, expand=True)
+        long['model'] = model_name
+        frames.append(long.drop(columns='column'))
+    expected = pd.concat(frames)
+    return expected[['cfs_run', 'month', 'year', 'model', 'lake', 'component', 'value [mm]']]
+
+def sort_rows(df):
+    return df.sort_values(['cfs_run', 'year', 'month', 'model', 'lake', 'component']).reset_index(drop=True)
+
+@pytest.mark.parametrize('models, workers', [(None, 1), (['LR'], 1), (['LR', 'GP'], 2)])
+def test_long_output_matches_predict_cnbs(forecast_inputs, models, workers):
+    X, models_info, x_scaler, y_scaler = forecast_inputs
+    names = models if models is not None else [model['model'] for model in models_info]
+
+    df = predict_ensemble(X, x_scaler, y_scaler, models_info, models=models, registry=ModelRegistry(), workers=workers)
+
+    assert df.index.names == ['cfs_run', 'month', 'year']
+    assert len(df) == len(X) * len(names) * len(CNBS_COLUMNS)
+    assert list(df['model'].cat.categories) == names
+
+    actual = df.reset_index().astype({'model': str, 'lake': str, 'component': str})
+    expected = per_model_forecasts(X, x_scaler, y_scaler, models_info, names)
+    actual, expected = sort_rows(actual), sort_rows(expected)
+    pd.testing.assert_frame_equal(actual.drop(columns='value [mm]'), expected.drop(columns='value [mm]'), check_dtype=False)
+    np.testing.assert_allclose(actual['value [mm]'], expected['value [mm]'], rtol=1e-10)
+
+def test_unknown_model_is_rejected(forecast_inputs):
+    X, models_info, x_scaler, y_scaler = forecast_inputs
+    with pytest.raises(ValueError):
+        predict_ensemble(X, x_scaler, y_scaler, models_info, models=['RF'], registry=ModelRegistry())
+    with pytest.raises(ValueError):
+        predict_ensemble(X.reset_index(), x_scaler, y_scaler, models_info, registry=ModelRegistry())
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from src import regrid_utils
+from src.regrid_utils import RegridOperator, build_regrid_operator, get_regrid_operator
+
+# A cut of the CFS 0.5 degree grid (north to south, as in the GRIB files) and a finer target grid
+# that overhangs it on every side, like the mask domain at the edge of a crop
+SRC_LAT = np.arange(51.0, 40.0 - 0.25, -0.5)
+SRC_LON = np.arange(267.0, 286.0 + 0.25, 0.5)
+DST_LAT = np.linspace(39.8, 51.3, 47)
+DST_LON = np.round(np.arange(266.8, 286.4, 0.2), 1)
+
+def source_field(seed=0, nan_fraction=0.0):
+    rng = np.random.default_rng(seed)
+    values = rng.standard_normal((len(SRC_LAT), len(SRC_LON)))
+    values[rng.random(values.shape) < nan_fraction] = np.nan
+    return xr.DataArray(values, dims=('latitude', 'longitude'), coords={'latitude': SRC_LAT, 'longitude': SRC_LON})
+
+def interp(field, lat=DST_LAT, lon=DST_LON):
+    return field.interp(latitude=lat, longitude=lon, method='linear').values
+
+@pytest.mark.parametrize('nan_fraction', [0.0, 0.05])
+def test_operator_matches_xarray_interp(nan_fraction):
+    field = source_field(nan_fraction=nan_fraction)
+    operator = build_regrid_operator(SRC_LAT, SRC_LON, DST_LAT, DST_LON)
+
+    expected = interp(field)
+    actual = operator(field.values)
+
+    # Target points beyond the source grid are NaN, as with interp
+    assert np.isnan(actual[DST_LAT < SRC_LAT.min()]).all() and np.isnan(actual[:, DST_LON > SRC_LON.max()]).all()
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    np.testing.assert_allclose(actual, expected, rtol=1e-12, atol=1e-12, equal_nan=True)
+
+def test_operator_on_target_points_that_hit_source_points():
+    field = source_field(seed=1, nan_fraction=0.1)
+    lat, lon = SRC_LAT[::-2].copy(), SRC_LON[1::3].copy()
+    operator = build_regrid_operator(SRC_LAT, SRC_LON, lat, lon)
+
+    np.testing.assert_allclose(operator(field.values), interp(field, lat, lon), rtol=1e-12, equal_nan=True)
+
+def test_operator_regrids_a_stack_of_fields():
+    fields = np.stack([source_field(seed).values for seed in range(3)])
+    operator = build_regrid_operator(SRC_LAT, SRC_LON, DST_LAT, DST_LON)
+
+    stacked = operator(fields)
+    assert stacked.shape == (3, len(DST_LAT), len(DST_LON))
+    for i in range(3):
+        np.testing.assert_array_equal(stacked[i], operator(fields[i]))
+    with pytest.raises(ValueError):
+        operator(fields[:, :-1])
+
+def test_weights_are_reused_from_the_disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(regrid_utils, '_REGRID_OPERATORS', {})
+    field = source_field()
+    first = get_regrid_operator(SRC_LAT, SRC_LON, DST_LAT, DST_LON, cache_dir=str(tmp_path))
+    assert get_regrid_operator(SRC_LAT, SRC_LON, DST_LAT, DST_LON, cache_dir=str(tmp_path)) is first
+    cache_files = os.listdir(tmp_path)
+    assert len(cache_files) == 1
+
+    # A new process reloads the saved weights instead of rebuilding them
+    monkeypatch.setattr(regrid_utils, '_REGRID_OPERATORS', {})
+    monkeypatch.setattr(regrid_utils, 'build_regrid_operator', lambda *args: pytest.fail("The operator was rebuilt."))
+    reloaded = get_regrid_operator(SRC_LAT, SRC_LON, DST_LAT, DST_LON, cache_dir=str(tmp_path))
+    assert reloaded is not first
+    np.testing.assert_array_equal(reloaded(field.values), first(field.values))
+    np.testing.assert_allclose(reloaded(field.values), interp(field), rtol=1e-12, equal_nan=True)
+
+def test_corrupt_cache_file_is_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(regrid_utils, '_REGRID_OPERATORS', {})
+    operator = get_regrid_operator(SRC_LAT, SRC_LON, DST_LAT, DST_LON, cache_dir=str(tmp_path))
+    cache_file = os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    with open(cache_file, 'wb') as f:
+        f.write(b'not an npz file')
+
+    monkeypatch.setattr(regrid_utils, '_REGRID_OPERATORS', {})
+    rebuilt = get_regrid_operator(SRC_LAT, SRC_LON, DST_LAT, DST_LON, cache_dir=str(tmp_path))
+    field = source_field()
+    np.testing.assert_array_equal(rebuilt(field.values), operator(field.values))
+    assert isinstance(RegridOperator.load(cache_file), RegridOperator)
@@ -0,0 +1,105 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing import CNBS_COLUMNS, FEATURE_COLUMNS, predict_cnbs
+from src.feature_utils import FEATURE_SCHEMA_FILE, FeatureSchema
+from src.model_utils import ModelRegistry
+from src.training_utils import TARGET_COLUMNS, FoldCache, cross_validate, rolling_origin_folds, select_candidates, \
+    train_models
+
+@pytest.fixture
+def training_data():
+    """Ten years of monthly features built with the production schema, and targets linear in them."""
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2000-01-01', periods=120, freq='MS')
+    schema = FeatureSchema(FEATURE_COLUMNS[:24])
+    base = pd.DataFrame(rng.standard_normal((len(index), 24)), columns=FEATURE_COLUMNS[:24], index=index)
+    X = schema.build(base)
+    weights = rng.standard_normal((24, len(TARGET_COLUMNS)))
+    y = pd.DataFrame(base.to_numpy() @ weights + 0.1 * rng.standard_normal((len(index), len(TARGET_COLUMNS))),
+                     columns=TARGET_COLUMNS, index=index)
+    return X, y, schema
+
+@pytest.mark.parametrize('gap_months, max_train_months', [(0, None), (3, None), (0, 24), (2, 36)])
+def test_rolling_origin_folds_never_train_on_the_test_window(gap_months, max_train_months):
+    index = pd.date_range('2000-01-01', periods=120, freq='MS')
+    folds = rolling_origin_folds(index, '2004-01-01', test_months=12, step_months=6, gap_months=gap_months,
+                                 max_train_months=max_train_months)
+
+    assert len(folds) == 11
+    for fold, (train, test) in enumerate(folds):
+        assert index[test[0]] == pd.Timestamp('2004-01-01') + pd.DateOffset(months=6 * fold)
+        assert len(test) == 12
+        # Every training month is before every test month, with gap_months left out in between
+        assert train.max() < test.min()
+        assert test.min() - train.max() - 1 == gap_months
+        if max_train_months is None:
+            assert train[0] == 0
+        else:
+            assert len(train) == max_train_months
+
+def test_rolling_origin_folds_rejects_unsorted_and_short_data():
+    index = pd.date_range('2000-01-01', periods=24, freq='MS')
+    with pytest.raises(ValueError):
+        rolling_origin_folds(index[::-1], '2001-01-01')
+    with pytest.raises(ValueError):
+        rolling_origin_folds(index, '2001-06-01')
+
+def test_fold_cache_fits_the_scalers_on_the_training_months_only(training_data, tmp_path):
+    X, y, _ = training_data
+    # Shift the later months so statistics that include them would be far off
+    X = X + np.where(np.arange(len(X)) >= 60, 100.0, 0.0)[:, None]
+    folds = rolling_origin_folds(X.index, '2005-01-01', test_months=12, step_months=12)
+    cache = FoldCache(X, y, folds, str(tmp_path))
+
+    for fold, (train, test) in enumerate(folds):
+        X_train, y_train, X_test, y_test = cache.get(fold)
+        X_values = X.to_numpy()[train]
+        mean, std = X_values.mean(axis=0), X_values.std(axis=0)
+        std[std == 0] = 1
+        assert np.allclose(X_train, (X_values - mean) / std)
+        assert np.allclose(X_test, (X.to_numpy()[test] - mean) / std)
+        assert np.allclose(y_train.mean(axis=0), 0)
+
+    # The matrices are reused from the cache for the same data and folds
+    assert FoldCache(X, y, folds, str(tmp_path)).path == cache.path
+
+def test_select_candidates_when_every_candidate_fails(training_data):
+    X, y, _ = training_data
+    folds = rolling_origin_folds(X.index, '2008-01-01')
+    results = cross_validate(X, y, folds, models=('LR',), candidates={'LR': [{'bogus': 1}]})
+
+    assert results['error'].notna().all()
+    assert select_candidates(results).empty
+
+def test_cross_validate_then_train_saves_what_predict_cnbs_loads(training_data, tmp_path):
+    X, y, schema = training_data
+    folds = rolling_origin_folds(X.index, '2007-01-01', test_months=12, step_months=12)
+    candidates = {'LR': [{}, {'fit_intercept': False}], 'RF': [{'n_estimators': 5, 'max_depth': 3}]}
+    results = cross_validate(X, y, folds, models=('LR', 'RF'), candidates=candidates)
+
+    assert len(results) == 3 * len(folds)
+    assert results['error'].isna().all()
+    best = select_candidates(results)
+    assert sorted(best['model']) == ['LR', 'RF']
+
+    output_dir = str(tmp_path / 'input')
+    models_info = train_models(X, y, output_dir, best, schema=schema, train_end='2008-12-01')
+    for name in ('x_scaler.joblib', 'y_scaler.joblib', FEATURE_SCHEMA_FILE, 'LR_trained_model.joblib', 'RF_trained_model.joblib'):
+        assert os.path.exists(os.path.join(output_dir, name))
+    assert FeatureSchema.load(os.path.join(output_dir, FEATURE_SCHEMA_FILE)).columns == list(X.columns)
+    assert json.loads(best.set_index('model').loc['LR', 'params']) in candidates['LR']
+
+    x_scaler_path, y_scaler_path = os.path.join(output_dir, 'x_scaler.joblib'), os.path.join(output_dir, 'y_scaler.joblib')
+    X_new = X.loc['2009-01-01':]
+    for model_info in models_info:
+        predicted = predict_cnbs(X_new, x_scaler_path, y_scaler_path, models_info, model_info['model'], registry=ModelRegistry())
+        x_scaler, y_scaler = joblib.load(x_scaler_path), joblib.load(y_scaler_path)
+        expected = y_scaler.inverse_transform(joblib.load(model_info['path']).predict(x_scaler.transform(X_new)))
+        assert list(predicted.columns) == CNBS_COLUMNS
+        assert np.allclose(predicted.to_numpy(), expected)
@@ -0,0 +1,131 @@
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.database_utils import open_cnbs_db
+from src.verification_utils import VERIFIED_LAKES, crps_ensemble, load_glcc_observations, update_verification, \
+    verify_batch
+
+BATCHES = (202301, 202307, 202401, 202407)
+
+def brute_force_crps(observation, members):
+    """E|X - y| - 1/2 E|X - X'| over the members that are not NaN, from every pair of members."""
+    members = members[~np.isnan(members)]
+    if len(members) == 0 or np.isnan(observation):
+        return np.nan
+    return np.mean(np.abs(members - observation)) - 0.5 * np.mean(np.abs(members[:, None] - members[None, :]))
+
+def test_crps_matches_brute_force():
+    rng = np.random.default_rng(0)
+    members = rng.normal(100, 30, size=(6, 5, 9))
+    members[rng.random(members.shape) < 0.2] = np.nan
+    members[0, 0] = np.nan
+    members[1, 2, :3] = 100.0
+    observations = rng.normal(100, 30, size=(6, 5))
+    observations[2, 1] = np.nan
+
+    crps = crps_ensemble(observations, members)
+    expected = np.array([[brute_force_crps(observations[i, j], members[i, j]) for j in range(5)] for i in range(6)])
+    np.testing.assert_allclose(crps, expected, rtol=1e-12, atol=1e-12)
+    assert np.isnan(crps[0, 0]) and np.isnan(crps[2, 1])
+
+    # The member axis can be any axis
+    np.testing.assert_allclose(crps_ensemble(observations, np.moveaxis(members, -1, 0), axis=0), expected,
+                               rtol=1e-12, atol=1e-12)
+
+def test_crps_of_a_single_member_is_the_absolute_error():
+    assert crps_ensemble(np.array([3.0]), np.array([[5.0]]))[0] == 2.0
+
+@pytest.fixture
+def glcc_dir(tmp_path):
+    directory = tmp_path / 'data' / 'glcc'
+    shutil.copytree('data/glcc', directory)
+    return str(directory)
+
+def make_forecasts(seed=0):
+    """CNBS forecasts of three runs per batch, for the issue month and the two months after it."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for batch in BATCHES:
+        year, month = divmod(batch, 100)
+        for day in (1, 11, 21):
+            cfs_run = batch * 10000 + day * 100
+            for lead in range(3):
+                valid_year, valid_month = year + (month + lead - 1) // 12, (month + lead - 1) % 12 + 1
+                for model in ('GP', 'LR'):
+                    for lake in VERIFIED_LAKES:
+                        value = rng.normal(0, 1000)
+                        rows.append((cfs_run, valid_month, valid_year, model, lake, 'cnbs', value / 10, value))
+    return pd.DataFrame(rows, columns=['cfs_run', 'month', 'year', 'model', 'lake', 'component', 'value [mm]', 'value [cms]'])
+
+@pytest.fixture
+def cnbs_database(tmp_path):
+    path = str(tmp_path / 'cnbs.db')
+    conn, _ = open_cnbs_db(path)
+    make_forecasts().to_sql('cnbs_forecast', conn, if_exists='append', index=False)
+    conn.close()
+    return path
+
+def stored_verification(cnbs_database):
+    with sqlite3.connect(cnbs_database) as conn:
+        return pd.read_sql('SELECT * FROM cnbs_verification ORDER BY batch, model, lead, lake', conn)
+
+def test_verify_batch_scores_each_model_and_the_pooled_ensemble(glcc_dir):
+    df = make_forecasts()
+    df = df[df['cfs_run'] // 10000 == 202307]
+    observations = load_glcc_observations(glcc_dir)
+
+    result = verify_batch(df, observations).set_index(['model', 'lead', 'lake'])
+
+    assert len(result) == 3 * 3 * len(VERIFIED_LAKES)
+    for (model, lead, lake), row in result.iterrows():
+        valid = df[(df['year'] * 12 + df['month'] == 2023 * 12 + 7 + lead) & (df['lake'] == lake)]
+        members = (valid if model == 'all' else valid[valid['model'] == model])['value [cms]'].to_numpy()
+        observed = observations.loc[f'2023-{7 + lead:02d}-01', lake]
+        assert row['members'] == len(members)
+        assert np.isclose(row['forecast'], members.mean())
+        assert row['observed'] == observed
+        assert np.isclose(row['crps'], brute_force_crps(observed, members))
+
+def test_unchanged_batches_are_not_verified_again(cnbs_database, glcc_dir):
+    first = update_verification(cnbs_database, glcc_dir)
+    assert first == {'batches': len(BATCHES), 'updated': list(BATCHES)}
+    stored = stored_verification(cnbs_database)
+
+    assert update_verification(cnbs_database, glcc_dir)['updated'] == []
+    pd.testing.assert_frame_equal(stored_verification(cnbs_database), stored)
+
+    # A changed forecast only scores its batch again
+    with sqlite3.connect(cnbs_database) as conn:
+        conn.execute('UPDATE cnbs_forecast SET "value [cms]" = "value [cms]" + 100 '
+                     "WHERE cfs_run = 2024010100 AND model = 'LR' AND lake = 'erie' AND month = 2")
+    assert update_verification(cnbs_database, glcc_dir)['updated'] == [202401]
+    changed = stored_verification(cnbs_database)
+    assert not changed[changed['batch'] == 202401].equals(stored[stored['batch'] == 202401])
+    pd.testing.assert_frame_equal(changed[changed['batch'] != 202401], stored[stored['batch'] != 202401])
+
+    # So does a changed observation, for the batches whose 12 months include it
+    path = f'{glcc_dir}/LakeErie_MonthlyNetBasinSupply_1900to2025.csv'
+    with open(path) as f:
+        lines = f.read().splitlines()
+    row = next(i for i, line in enumerate(lines) if line.startswith('2023,'))
+    values = lines[row].split(',')
+    values[3] = '1234.0'
+    lines[row] = ','.join(values)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    assert update_verification(cnbs_database, glcc_dir)['updated'] == [202301]
+
+    # A batch removed from the forecasts is removed from the cache
+    with sqlite3.connect(cnbs_database) as conn:
+        conn.execute('DELETE FROM cnbs_forecast WHERE cfs_run >= 2024070000')
+    assert update_verification(cnbs_database, glcc_dir) == {'batches': len(BATCHES) - 1, 'updated': []}
+    assert 202407 not in set(stored_verification(cnbs_database)['batch'])
+
+def test_a_new_max_lead_verifies_every_batch_again(cnbs_database, glcc_dir):
+    update_verification(cnbs_database, glcc_dir)
+    assert update_verification(cnbs_database, glcc_dir, max_lead=1)['updated'] == list(BATCHES)
+    assert stored_verification(cnbs_database)['lead'].max() == 1